@@ -0,0 +1,233 @@
+""" Compiles the built-in LED animations into frame timelines.
+
+A timeline holds two arrays: offsets[i] is the time in seconds, relative to the
+start of the animation, at which the frame masks[i] is shown. A frame is an
+integer bitmask, bit i set means the LED with index i is on. Timelines are
+built once per set of parameters and kept in an LRU cache, so playing
+an animation again is a plain loop over prebuilt arrays. The animations 
+themselves are the generators of patterns, compiled with 
+patterns.compile_pattern.
+
+NumPy is used for the arrays if it is installed, the array module otherwise.
+"""
+from array import array
+import bisect
+import random
+
+import patterns
+
+try:
+	from functools import lru_cache
+except ImportError:
+	lru_cache = None
+
+try:
+	import numpy as np
+except ImportError:
+	np = None
+
+
+# Number of compiled timelines kept in memory.
+ANIMATION_CACHE_SIZE = 64
+# Masks of up to this many LEDs fit into an unsigned 64 bit integer.
+MASK_BITS = 64
+
+
+class Timeline(object):
+	""" Compiled animation: frames masks[i] shown at offsets[i], ending at
+		<duration> seconds after the start.
+	"""
+	__slots__ = ('offsets', 'masks', 'duration')
+
+	def __init__(self, offsets, masks, duration):
+		self.offsets = offsets
+		self.masks = masks
+		self.duration = duration
+
+	def __len__(self):
+		return len(self.offsets)
+
+	def frames(self):
+		""" Iterator over (offset, mask) pairs as plain Python numbers. """
+		return zip(self.offsets.tolist(), _tolist(self.masks))
+
+
+def _tolist(masks):
+	return masks if isinstance(masks, list) else masks.tolist()
+
+def _offsets(values):
+	if np is not None:
+		offsets = np.asarray(values, dtype=np.float64)
+		offsets.flags.writeable = False
+		return offsets
+	return array('d', values)
+
+def _masks(values, pin_count):
+	""" Pack frame masks into the most compact array that can hold them. """
+	if np is not None:
+		dtype = np.uint64 if pin_count <= MASK_BITS else object
+		masks = np.array(values, dtype=dtype)
+		masks.flags.writeable = False
+		return masks
+	if pin_count <= MASK_BITS:
+		return array('Q', values)
+	return list(values)
+
+# Binary digits of the density of RandomFrames, frames are drawn with this 
+# precision.
+DENSITY_BITS = 16
+
+
+class RandomFrames(object):
+	""" Draws random frames of <pin_count> LEDs as bitmasks, without ever 
+		listing the possible frames, so memory and time per frame do not 
+		depend on 2 ** pin_count. Unweighted, every frame is different from 
+		the all-on frame and otherwise uniform. Weighted, the all-on frame is 
+		drawn like any other:
+		
+		<density>  each LED is on with this probability, independently, so 
+		           a density of 1 gives all-on frames only
+		<max_lit>  at most this many LEDs are on, uniform among those frames
+		
+		With both, frames with more lit LEDs are thinned out at random. The 
+		same <seed> gives the same frames on the same installation. batch() 
+		draws many frames at once, vectorized with NumPy for up to 64 LEDs.
+	"""
+	def __init__(self, pin_count, seed=None, density=None, max_lit=None):
+		self.pin_count = pin_count
+		self.all_mask = (1 << pin_count) - 1
+		self.density = density
+		self.max_lit = max_lit
+		self.random = random.Random(seed)
+		self.rng = np.random.default_rng(seed) if np is not None else None
+		if max_lit is not None:
+			# cumulative[j]: number of frames with at most j LEDs on
+			self.cumulative = []
+			total = 0
+			for j in range(min(max_lit, pin_count) + 1):
+				total += _comb(pin_count, j)
+				self.cumulative.append(total)
+				
+	def vectorized(self):
+		return self.rng is not None and self.pin_count <= MASK_BITS and self.max_lit is None
+		
+	def batch(self, n):
+		""" <n> random frames, as array or list like Timeline.masks. """
+		if self.vectorized():
+			if self.density is None:
+				masks = self.rng.integers(0, max(self.all_mask, 1), n, dtype=np.uint64)
+			else:
+				masks = self.density_bits(lambda: self.rng.integers(0, 1 << MASK_BITS, n, dtype=np.uint64),
+										  np.zeros(n, dtype=np.uint64)) & np.uint64(self.all_mask)
+			masks.flags.writeable = False
+			return masks
+		return [self.frame() for i in range(n)]
+		
+	def frame(self):
+		""" One random frame. """
+		if self.density is not None:
+			mask = self.density_bits(lambda: self.random.getrandbits(self.pin_count), 0) & self.all_mask
+			if self.max_lit is not None:
+				lit = []
+				rest = mask
+				while rest:
+					low = rest & -rest
+					lit.append(low)
+					rest ^= low
+				for low in self.random.sample(lit, max(0, len(lit) - self.max_lit)):
+					mask ^= low
+			return mask
+		if self.max_lit is not None:
+			count = bisect.bisect_right(self.cumulative, self.random.randrange(self.cumulative[-1]))
+			mask = 0
+			for i in self.random.sample(range(self.pin_count), count):
+				mask |= 1 << i
+			return mask
+		return self.random.randrange(max(self.all_mask, 1))
+		
+	def density_bits(self, words, zero):
+		""" Combine random words from <words>() so that every bit is set with 
+			probability density: processing the binary digits of the density 
+			from the last one, a 1 ORs in a random word, which maps the 
+			probability p to (1 + p) / 2, and a 0 ANDs one, giving p / 2.
+		"""
+		digits = int(round(self.density * (1 << DENSITY_BITS)))
+		if digits >= 1 << DENSITY_BITS:
+			return ~zero
+		mask = zero
+		if not digits:
+			return mask
+		# ANDs before the first OR would leave the mask empty.
+		for i in range((digits & -digits).bit_length() - 1, DENSITY_BITS):
+			if digits >> i & 1:
+				mask = mask | words()
+			else:
+				mask = mask & words()
+		return mask
+		
+	def holds(self, n, longest):
+		""" <n> random hold times below <longest> seconds. """
+		if self.rng is not None:
+			return longest * self.rng.random(n)
+		return [longest * self.random.random() for i in range(n)]
+		
+		
+def _comb(n, k):
+	result = 1
+	for i in range(k):
+		result = result * (n - i) // (i + 1)
+	return result
+
+def _raupe(pin_count, rounds, rev, inv, delay, delay2, code):
+	return patterns.raupe(pin_count, delay, rounds, rev)
+
+def _progress(pin_count, rounds, rev, inv, delay, delay2, code):
+	return patterns.progress(pin_count, delay, rounds, rev, inv)
+
+def _blink(pin_count, rounds, rev, inv, delay, delay2, code):
+	return patterns.blink(code, rounds, delay, delay2)
+
+
+_BUILDERS = {
+	'raupe': _raupe,
+	'progress': _progress,
+	'blink': _blink,
+}
+
+def _compile(mode, pin_count, rounds, rev, inv, delay, delay2, code):
+	pattern = _BUILDERS[mode](pin_count, rounds, rev, inv, delay, delay2, code)
+	return patterns.compile_pattern(pattern, pin_count)
+
+if lru_cache is not None:
+	_compile = lru_cache(maxsize=ANIMATION_CACHE_SIZE)(_compile)
+
+
+def compile_frames(masks, holds, pin_count):
+	""" Timeline showing masks[i] for holds[i] seconds each. Not cached, it
+		is meant for sequences built at runtime.
+	"""
+	offsets = [0.0]
+	for hold in holds:
+		offsets.append(offsets[-1] + hold)
+	duration = offsets.pop()
+	return Timeline(_offsets(offsets), _masks(list(masks), pin_count), duration)
+
+
+def compile_animation(mode, pin_count, rounds=1, rev=False, inv=False, delay=0.3, delay2=None, code=0, 
+					  seed=None, density=None, max_lit=None):
+	""" Timeline of the animation <mode> for <pin_count> LEDs.
+		<mode> is one of 'raupe', 'progress', 'blink' and 'disco'.
+		<delay> is the time each frame is shown. For 'blink', <code> is the mask
+		of blinking LEDs, which stay on for <delay> and off for <delay2> seconds.
+		'disco' is random, so it is compiled anew on every call, <seed>, 
+		<density> and <max_lit> are passed to RandomFrames.
+	"""
+	if mode == 'disco':
+		# All frames are drawn in one batch.
+		pattern = patterns.disco(pin_count, rounds, 0.2, seed, density, max_lit, batch=max(rounds, 1))
+		return patterns.compile_pattern(pattern, pin_count)
+	if mode not in _BUILDERS:
+		raise ValueError('Unknown animation: {}'.format(mode))
+	if delay2 is None:
+		delay2 = delay
+	return _compile(mode, pin_count, rounds, rev, inv, delay, delay2, code)
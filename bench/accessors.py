@@ -0,0 +1,99 @@
+""" Micro-benchmark of the xbox.Joystick accessors.
+
+Compares the per-call cost of reading buttons, triggers and sticks from the 
+decoded JoystickState with slicing and parsing the raw 140 char line on every 
+call, as the accessors did before. No controller or xboxdrv is needed, the 
+joystick is built around a fixed line and never refreshes.
+
+	python bench/accessors.py
+"""
+from __future__ import print_function
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import xbox
+
+
+LINE = b'X1: -1200 Y1:  3100  X2:     0 Y2:     0  du:0 dd:0 dl:0 dr:0  back:0 guide:0 start:0  TL:0 TR:0  A:1 B:0 X:0 Y:1  LB:0 RB:0  LT: 17 RT:200\n'
+NUMBER = 200000
+
+
+class SlicingJoystick(object):
+	""" The accessors as they were: parse a slice of the raw line per call. """
+	def __init__(self, line):
+		self.reading = line
+
+	def refresh(self):
+		pass
+
+	def A(self):
+		self.refresh()
+		return int(self.reading[100:101])
+
+	def B(self):
+		self.refresh()
+		return int(self.reading[104:105])
+
+	def X(self):
+		self.refresh()
+		return int(self.reading[108:109])
+
+	def Y(self):
+		self.refresh()
+		return int(self.reading[112:113])
+
+	def rightTrigger(self):
+		self.refresh()
+		return int(self.reading[136:139]) / 255.0
+
+	def leftX(self, deadzone=4000):
+		self.refresh()
+		return xbox.Joystick.axisScale(self, int(self.reading[3:9]), deadzone)
+
+	def leftY(self, deadzone=4000):
+		self.refresh()
+		return xbox.Joystick.axisScale(self, int(self.reading[13:19]), deadzone)
+
+	def leftStick(self, deadzone=4000):
+		self.refresh()
+		return (self.leftX(deadzone), self.leftY(deadzone))
+
+
+def decoded_joystick(line):
+	""" A Joystick holding the decoded <line>, without a xboxdrv process. """
+	joy = xbox.Joystick.__new__(xbox.Joystick)
+	joy.threaded = True
+	joy.readerError = None
+	joy.state = xbox.parseReading(line)
+	return joy
+
+
+def measure(joy, number=NUMBER):
+	""" Nanoseconds per call of the typical accessors, as a dict. """
+	calls = {
+		'A': joy.A,
+		'ABXY': lambda: (joy.A(), joy.B(), joy.X(), joy.Y()),
+		'rightTrigger': joy.rightTrigger,
+		'leftStick': joy.leftStick,
+	}
+	return dict((name, 1e9 * min(timeit.repeat(call, number=number, repeat=3)) / number)
+				for name, call in calls.items())
+
+
+def run(number=NUMBER):
+	""" Accessor cost in ns per call before (slicing) and after (decoded). """
+	return {
+		'slicing': measure(SlicingJoystick(LINE), number),
+		'decoded': measure(decoded_joystick(LINE), number),
+	}
+
+
+if __name__ == '__main__':
+	results = run()
+	print("{:<14}{:>12}{:>12}{:>9}".format('accessor', 'slicing ns', 'decoded ns', 'speedup'))
+	for name in sorted(results['slicing']):
+		before, after = results['slicing'][name], results['decoded'][name]
+		print("{:<14}{:>12.1f}{:>12.1f}{:>8.1f}x".format(name, before, after, before / after))
@@ -0,0 +1,78 @@
+""" Checks of the frame sources of patterns.py and animations.py at the edges 
+of their input.
+
+Plays every case, taking at most FRAME_LIMIT + 1 frames of the endless ones:
+
+	repeat       an empty pattern repeated endlessly or many times, and an
+	             iterator that is used up after one pass, end by themselves
+	random_frames
+	             RandomFrames of 1 to 3 LEDs: unweighted never all on, with a 
+	             density of 1 always, of 0 never, frame by frame and in 
+	             batches
+
+	python bench/edge_cases.py
+
+Exits with an AssertionError at the first wrong case.
+"""
+from __future__ import print_function
+
+import itertools
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import animations
+import patterns
+
+
+# Frames taken from a case at most, more count as never ending.
+FRAME_LIMIT = 10000
+# Frames drawn per case of RandomFrames.
+RANDOM_FRAMES = 1000
+
+
+def played(pat):
+	""" The frames of <pat>, at most FRAME_LIMIT + 1. """
+	return list(itertools.islice(pat, FRAME_LIMIT + 1))
+
+
+def check_repeat():
+	empty = patterns.frames([], [])
+	cases = [
+		(empty.repeat(), []),
+		(empty.repeat(10 ** 9), []),
+		(patterns.repeat(iter([(0.1, 1), (0.2, 0)])), [(0.1, 1), (0.2, 0)]),
+		(patterns.blink(1).repeat(3), [(0.3, 1), (0.3, 0)] * 3),
+	]
+	for pat, expected in cases:
+		frames = played(pat)
+		assert frames == expected, 'repeat: {} frames, expected {}'.format(len(frames), expected)
+	return len(cases)
+
+
+def check_random_frames():
+	cases = 0
+	for pin_count in (1, 2, 3):
+		all_mask = (1 << pin_count) - 1
+		for density, allowed in ((None, set(range(all_mask))), (1, {all_mask}), (0, {0})):
+			source = animations.RandomFrames(pin_count, seed=0, density=density)
+			drawn = [source.frame() for i in range(RANDOM_FRAMES)]
+			drawn += animations._tolist(source.batch(RANDOM_FRAMES))
+			wrong = set(drawn) - allowed
+			assert not wrong, 'RandomFrames({}, density={}): frames {}'.format(pin_count, density, sorted(wrong))
+			cases += 1
+	return cases
+
+
+def run():
+	""" Cases checked by source, raises AssertionError at the first wrong case. """
+	return {
+		'repeat': check_repeat(),
+		'random_frames': check_random_frames(),
+	}
+
+
+if __name__ == '__main__':
+	results = run()
+	for source in sorted(results):
+		print("{:<16}{} cases ok".format(source, results[source]))
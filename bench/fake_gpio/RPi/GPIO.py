@@ -0,0 +1,88 @@
+""" In-memory stand-in for RPi.GPIO, used by the benchmarks.
+
+Nothing is written to hardware. Every output is counted and its time stamp
+and level are kept, so a benchmark can tell how many GPIO writes a mode
+caused and how they were spread over time. Only the calls used by lights.py
+are provided.
+"""
+from collections import deque
+import time
+
+BOARD = 10
+BCM = 11
+OUT = 0
+IN = 1
+LOW = 0
+HIGH = 1
+
+# Number of writes whose time stamp is kept.
+LOG_SIZE = 100000
+
+mode = None
+levels = {}
+writes = 0
+pwm_changes = 0
+log = deque(maxlen=LOG_SIZE)
+
+
+def reset():
+	""" Forget all writes counted so far. """
+	global writes, pwm_changes
+	writes = 0
+	pwm_changes = 0
+	log.clear()
+
+def setmode(new_mode):
+	global mode
+	mode = new_mode
+
+def setwarnings(flag):
+	pass
+
+def setup(channel, direction, initial=LOW):
+	for pin in _channels(channel):
+		levels[pin] = initial
+
+def output(channel, value):
+	global writes
+	now = time.monotonic()
+	for pin in _channels(channel):
+		levels[pin] = value
+		log.append((now, pin, value))
+		writes += 1
+
+def input(channel):
+	return levels.get(channel, LOW)
+
+def cleanup(channel=None):
+	if channel is None:
+		levels.clear()
+	else:
+		for pin in _channels(channel):
+			levels.pop(pin, None)
+
+def _channels(channel):
+	return channel if isinstance(channel, (list, tuple)) else (channel,)
+
+
+class PWM(object):
+	def __init__(self, channel, frequency):
+		self.channel = channel
+		self.frequency = frequency
+		self.duty_cycle = None
+
+	def start(self, dc):
+		self.ChangeDutyCycle(dc)
+
+	def stop(self):
+		self.duty_cycle = None
+
+	def ChangeDutyCycle(self, dc):
+		global pwm_changes
+		self.duty_cycle = dc
+		pwm_changes += 1
+
+	def ChangeFrequency(self, frequency):
+		global pwm_changes
+		self.frequency = frequency
+		pwm_changes += 1
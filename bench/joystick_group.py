@@ -0,0 +1,98 @@
+""" Benchmark of reading several gamepads.
+
+Starts 1 to 8 fake xboxdrv processes (bench/bin), each sending LINE_RATE
+lines per second, and runs a game loop reading the A button of every player
+on every iteration, for a fixed number of seconds. Compares
+
+	independent  one polled Joystick per player, every accessor call checks
+	             its own pipe with a select call
+	group        one JoystickGroup, one selector call per iteration for all
+	             pipes, the players are read from the published snapshots
+
+by microseconds per loop iteration and CPU share of the whole process.
+
+	python bench/joystick_group.py
+"""
+from __future__ import print_function
+
+import os
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..'))
+os.environ['PATH'] = os.path.join(BENCH_DIR, 'bin') + os.pathsep + os.environ.get('PATH', '')
+import xbox
+
+
+PLAYER_COUNTS = (1, 2, 4, 8)
+# Lines per second sent by every fake xboxdrv.
+LINE_RATE = 250
+# Seconds each measurement runs.
+DURATION = 0.5
+
+
+def open_joysticks(count):
+	os.environ['FAKE_XBOXDRV_RATE'] = str(LINE_RATE)
+	os.environ['FAKE_XBOXDRV_LINES'] = '0'
+	joysticks = []
+	try:
+		for player in range(count):
+			joysticks.append(xbox.Joystick(refreshRate=1e9, controllerId=player))
+	except Exception:
+		for joy in joysticks:
+			joy.close()
+		raise
+	return joysticks
+
+
+def measure(iteration, duration):
+	""" Run <iteration> for <duration> seconds. """
+	iterations = 0
+	cpu, start = time.process_time(), time.monotonic()
+	end = start + duration
+	now = start
+	while now < end:
+		iteration()
+		iterations += 1
+		now = time.monotonic()
+	elapsed = now - start
+	return {
+		'us_per_iteration': elapsed / iterations * 1e6,
+		'cpu_share': (time.process_time() - cpu) / elapsed,
+	}
+
+
+def bench_independent(count, duration):
+	joysticks = open_joysticks(count)
+	try:
+		return measure(lambda: [joy.A() for joy in joysticks], duration)
+	finally:
+		for joy in joysticks:
+			joy.close()
+
+
+def bench_group(count, duration):
+	group = xbox.JoystickGroup(joysticks=open_joysticks(count))
+	try:
+		def iteration():
+			group.refresh()
+			return [state.pressed('A') for state in group.snapshots()]
+		return measure(iteration, duration)
+	finally:
+		group.close()
+
+
+def run(duration=DURATION):
+	""" Cost per iteration by way of reading and number of players. """
+	return {
+		'independent': dict((count, bench_independent(count, duration)) for count in PLAYER_COUNTS),
+		'group': dict((count, bench_group(count, duration)) for count in PLAYER_COUNTS),
+	}
+
+
+if __name__ == '__main__':
+	results = run()
+	print("{:<8}".format('Players') + "".join("{:>16}".format(way + ' us') for way in sorted(results)))
+	for count in PLAYER_COUNTS:
+		print("{:<8}".format(count) + "".join("{:>16.2f}".format(results[way][count]['us_per_iteration']) for way in sorted(results)))
@@ -0,0 +1,151 @@
+""" Register check of the mmap GPIO backend.
+
+Maps a temporary file instead of /dev/gpiomem and checks the words the
+backend stores there against the BCM2835 register layout, read back from
+the file itself: the function select field of every LED pin set to output
+(001) with the fields of the other GPIOs kept, and after every frame of
+write and write_many the words of GPSET0/1 and GPCLR0/1. The set and clear
+registers are zeroed before each frame, so a word must be exactly the bits
+of the pins switched on or off, and 0 if it was not written. The pin sets
+include pins above 31, which are in the second set and clear register, and
+more than 8 pins, for which write_many falls back to write.
+
+	python bench/mmap_registers.py
+
+Exits with an AssertionError at the first wrong word.
+"""
+from __future__ import print_function
+
+import os
+import random
+import struct
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import gpio_backends
+from gpio_backends import GPFSEL0, GPSET0, GPCLR0
+
+
+PIN_SETS = (
+	(17, 18, 27, 22),
+	(2, 3, 4, 14, 15, 23, 24, 25),
+	(4, 31, 32, 33, 40, 47, 53),
+	(0, 5, 9, 10, 19, 26, 30, 31, 34, 35, 41, 52),
+)
+# Random frames checked per pin set and write method.
+FRAMES = 2000
+# Content of the function select registers before the backend opens the
+# file, every GPIO on alternative function 3 (111).
+FSEL_BEFORE = 0x3fffffff
+FSEL_REGISTERS = 6
+
+
+def read_word(fd, offset):
+	return struct.unpack('<I', os.pread(fd, 4, offset))[0]
+
+
+def write_word(fd, offset, value):
+	os.pwrite(fd, struct.pack('<I', value), offset)
+
+
+def expected_words(pins, mask, changed):
+	""" (GPSET0, GPSET1, GPCLR0, GPCLR1) after writing <mask>. """
+	set_bits = clear_bits = 0
+	for i, p in enumerate(pins):
+		if changed >> i & 1:
+			if mask >> i & 1:
+				set_bits |= 1 << p
+			else:
+				clear_bits |= 1 << p
+	return set_bits & 0xffffffff, set_bits >> 32, clear_bits & 0xffffffff, clear_bits >> 32
+
+
+def output_words(fd):
+	""" (GPSET0, GPSET1, GPCLR0, GPCLR1) as stored in the file. """
+	return (read_word(fd, GPSET0), read_word(fd, GPSET0 + 4),
+			read_word(fd, GPCLR0), read_word(fd, GPCLR0 + 4))
+
+
+def clear_output_words(fd):
+	for offset in (GPSET0, GPSET0 + 4, GPCLR0, GPCLR0 + 4):
+		write_word(fd, offset, 0)
+
+
+def check_function_select(fd, pins):
+	for reg in range(FSEL_REGISTERS):
+		expected = FSEL_BEFORE
+		for p in pins:
+			if p // 10 == reg:
+				shift = 3 * (p % 10)
+				expected = expected & ~(7 << shift) | 1 << shift
+		word = read_word(fd, GPFSEL0 + 4 * reg)
+		assert word == expected, 'GPFSEL{} of pins {}: {:#010x}, expected {:#010x}'.format(reg, pins, word, expected)
+
+
+def check_pins(path, pins, rng, frames=FRAMES):
+	""" Check the mmap backend driving <pins> on the file <path>. Returns the
+		number of frames checked.
+	"""
+	fd = os.open(path, os.O_RDWR)
+	try:
+		os.ftruncate(fd, 0)
+		os.ftruncate(fd, gpio_backends.GPIO_BLOCK_SIZE)
+		for reg in range(FSEL_REGISTERS):
+			write_word(fd, GPFSEL0 + 4 * reg, FSEL_BEFORE)
+		backend = gpio_backends.MmapBackend(pins, path)
+		try:
+			check_function_select(fd, pins)
+			all_mask = (1 << len(pins)) - 1
+			# Every single pin on and off, then random frames and changed masks.
+			cases = [(1 << i, 1 << i) for i in range(len(pins))] + [(0, 1 << i) for i in range(len(pins))]
+			cases += [(all_mask, all_mask), (0, all_mask), (all_mask, 0)]
+			cases += [(rng.getrandbits(len(pins)), rng.choice((all_mask, rng.getrandbits(len(pins)))))
+					  for i in range(frames)]
+			for mask, changed in cases:
+				expected = expected_words(pins, mask, changed)
+				for write in (lambda: backend.write(mask, changed), lambda: backend.write_many([mask], changed)):
+					clear_output_words(fd)
+					write()
+					words = output_words(fd)
+					assert words == expected, 'pins {}, mask {:#x}, changed {:#x}: {}, expected {}'.format(
+						pins, mask, changed, ['{:#010x}'.format(w) for w in words], ['{:#010x}'.format(w) for w in expected])
+			# A run of frames leaves the words of the last one. Storing 0 does 
+			# nothing on the chip, so where the last frame has no bits a word 
+			# may also be the last one stored before.
+			for changed in (all_mask, rng.getrandbits(len(pins)) | 1):
+				masks = [rng.getrandbits(len(pins)) for i in range(64)]
+				clear_output_words(fd)
+				backend.write_many(masks, changed)
+				frames_words = [expected_words(pins, m, changed) for m in masks]
+				for k, word in enumerate(output_words(fd)):
+					allowed = {frames_words[-1][k]}
+					if not frames_words[-1][k]:
+						allowed.add(next((w[k] for w in reversed(frames_words) if w[k]), 0))
+					assert word in allowed, 'pins {}, write_many ending with {:#x}, changed {:#x}: word {} is {:#010x}'.format(
+						pins, masks[-1], changed, k, word)
+		finally:
+			backend.close()
+		# The function select registers are only written when opening.
+		check_function_select(fd, pins)
+	finally:
+		os.close(fd)
+	return len(cases)
+
+
+def run(seed=0):
+	""" Frames checked by pin set, raises AssertionError at the first wrong
+		register word.
+	"""
+	rng = random.Random(seed)
+	results = {}
+	with tempfile.NamedTemporaryFile() as regs:
+		for pins in PIN_SETS:
+			results[','.join(str(p) for p in pins)] = check_pins(regs.name, pins, rng)
+	return results
+
+
+if __name__ == '__main__':
+	results = run()
+	for pins in sorted(results):
+		print("{:<40}{} frames ok".format(pins, results[pins]))
@@ -0,0 +1,271 @@
+""" Benchmark and regression check of recorded gamepad input.
+
+Records LINES lines of the fake xboxdrv (bench/bin) with
+Joystick(record=...), or takes a recording made with lights.py --record, and
+replays it as fast as possible into the LED picking of the games: every
+button press taken from the input history (lights.picked_leds) is shown
+with LedControllerBase.phase on the mock GPIO backend. Prints the lines
+and recorded seconds played per second and a digest of the frames written.
+The same recording always gives the same digest, so a changed digest after
+a change to the input handling means the games see the input differently.
+
+The game replay plays a made up Binary Calculator session of SESSION_HOURS
+hours through BinaryCalculator.run() on a timing.VirtualClock: the lines 
+arrive at their recorded times, but the waits of the game and the pauses 
+of the player take no real time. It prints the recorded seconds played per 
+second and a digest of the frames and of what the calculator printed, the 
+same on every run and machine. The race replay does the same for the 
+multiplayer ReactionRace, RACE_PLAYERS gamepads pressing their buttons in 
+turn, read through an xbox.JoystickGroup, and the Memory Duel with the same 
+recordings. The games draw their LEDs and pauses from random, seeded with 
+RACE_SEED.
+
+	python bench/replay.py [recording.xbr]
+"""
+from __future__ import print_function
+
+import asyncio
+import contextlib
+import hashlib
+import io
+import os
+import random
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..'))
+os.environ['PATH'] = os.path.join(BENCH_DIR, 'bin') + os.pathsep + os.environ.get('PATH', '')
+import gpio_backends
+import lights
+import timing
+import xbox
+
+lights.xbox = xbox
+
+PINS = (lights.GPIO_PIN_1, lights.GPIO_PIN_2, lights.GPIO_PIN_3, lights.GPIO_PIN_4)
+# Lines of the fake xboxdrv recorded when no recording is given.
+LINES = 100000
+# Lines per second of the fake xboxdrv while recording.
+RECORD_RATE = 0
+# Recorded hours of the Binary Calculator session of the game replay.
+SESSION_HOURS = 2
+# xboxdrv line with nothing pressed, and where the digits of the buttons and 
+# of the right trigger used by the session are.
+IDLE_LINE = b'X1:     0 Y1:     0  X2:     0 Y2:     0  du:0 dd:0 dl:0 dr:0  back:0 guide:0 start:0  TL:0 TR:0  A:0 B:0 X:0 Y:0  LB:0 RB:0  LT:  0 RT:  0\n'
+BUTTON_DIGITS = {'A': 100, 'B': 104, 'X': 108, 'Y': 112, 'RB': 123}
+RIGHT_TRIGGER_DIGITS = slice(136, 139)
+# Gamepads, recorded seconds of each and seed of the race replay.
+RACE_PLAYERS = 2
+RACE_SECONDS = 600
+RACE_SEED = 0
+
+
+def record(path, lines=LINES, rate=RECORD_RATE):
+	""" Record <lines> lines of the fake xboxdrv to <path>. """
+	os.environ['FAKE_XBOXDRV_RATE'] = str(rate)
+	os.environ['FAKE_XBOXDRV_LINES'] = str(lines)
+	joy = xbox.Joystick(refreshRate=1e9, record=path)
+	try:
+		while joy.history.count < lines:
+			joy.refresh()
+	finally:
+		joy.close()
+
+
+def recorded_span(path):
+	""" Lines and seconds between the first and the last line of a recording. """
+	with open(path, 'rb') as f:
+		times = [float(entry.split(b' ', 1)[0]) for entry in f]
+	return len(times), times[-1] - times[0] if times else 0.0
+
+
+def replay(path, speed=0):
+	""" Play the recording <path> into the LED picking until it ends. Returns
+		the frames written to the mock backend and the seconds it took.
+	"""
+	backend = gpio_backends.open_backend('mock', PINS)
+	ledc = lights.LedControllerBase(*PINS, backend=backend)
+	joy = xbox.Joystick(refreshRate=1e9, replay=path, speed=speed)
+
+	async def pick_leds():
+		joy.attach(asyncio.get_running_loop())
+		since = joy.history.latest()
+		try:
+			while True:
+				picks, since = lights.picked_leds(joy, since)
+				for pick in picks:
+					ledc.phase(pick)
+				await lights.wait_input(joy)
+		except IOError:
+			# End of the recording. The Joystick detached itself, the lines read
+			# with the end are taken from the history without refreshing.
+			for t, pressed, released in joy.history.transitions(since):
+				pick = [i for i, b in enumerate(lights.LED_BUTTONS) if pressed & xbox.BUTTON_BITS[b]]
+				if pick:
+					ledc.phase(pick)
+
+	start = time.monotonic()
+	try:
+		asyncio.run(pick_leds())
+	finally:
+		joy.close()
+	elapsed = time.monotonic() - start
+	ledc.pwm.close()
+	return [levels for t, levels in backend.frames], elapsed
+
+
+def session_line(buttons=(), right_trigger=0):
+	line = bytearray(IDLE_LINE)
+	for button in buttons:
+		line[BUTTON_DIGITS[button]] = ord('1')
+	line[RIGHT_TRIGGER_DIGITS] = b'%3d' % right_trigger
+	return bytes(line)
+
+
+def write_session(path, hours=SESSION_HOURS):
+	""" Write a made up Binary Calculator session of <hours> hours to <path>:
+		over and over, scroll with the right trigger, pick an operation, 
+		scroll again and press RB for the result, pausing up to a minute in 
+		between.
+	"""
+	t = 1000.0
+	end = t + 3600 * hours
+	n = 0
+	with open(path, 'wb') as f:
+		def hold(seconds, pause, buttons=(), right_trigger=0):
+			f.write(b'%.6f %s' % (t, session_line(buttons, right_trigger)))
+			f.write(b'%.6f %s' % (t + seconds, session_line()))
+			return t + seconds + pause
+
+		while t < end:
+			t = hold(0.3 + 0.1 * (n % 7), 2.0, right_trigger=128 + n % 128)
+			t = hold(0.1, 1.5, ['ABXY'[n % 4]])
+			t = hold(0.2 + 0.05 * (n % 5), 1.0, right_trigger=255)
+			t = hold(0.1, 5.0 + 50.0 * (n % 2), ['RB'])
+			n += 1
+
+
+def write_player(path, player, seconds=RACE_SECONDS):
+	""" Write <seconds> of a made up player <player> of the race to <path>: 
+		A, B, X and Y pressed in turn, each for 0.08 s, at a pace of the player.
+	"""
+	period = 0.37 + 0.11 * player
+	with open(path, 'wb') as f:
+		for n in range(int(seconds / period)):
+			t = 1000.0 + n * period
+			f.write(b'%.6f %s' % (t, session_line(['ABXY'[n % 4]])))
+			f.write(b'%.6f %s' % (t + 0.08, session_line()))
+
+
+def replay_race(paths, seed=RACE_SEED, game=lights.ReactionRace):
+	""" Play the recordings <paths>, one per player, through the run() of the
+		multiplayer <game>, made from the controller and the JoystickGroup, on 
+		a timing.VirtualClock. Returns like replay_game.
+	"""
+	clock = timing.VirtualClock()
+	output = io.StringIO()
+	state = random.getstate()
+	random.seed(seed)
+	with clock.installed(xbox):
+		backend = gpio_backends.open_backend('mock', PINS)
+		ledc = lights.LedControllerBase(*PINS, backend=backend)
+		gamepads = xbox.JoystickGroup(joysticks=[xbox.Joystick(refreshRate=1e9, replay=path, virtual=True)
+												 for path in paths])
+		game = game(ledc, gamepads)
+
+		async def play():
+			gamepads.attach(asyncio.get_running_loop())
+			try:
+				await game.run()
+			finally:
+				gamepads.detach()
+
+		start = time.monotonic()
+		try:
+			with contextlib.redirect_stdout(output):
+				clock.run(play())
+		finally:
+			gamepads.close()
+			random.setstate(state)
+		elapsed = time.monotonic() - start
+	ledc.pwm.close()
+	return [levels for t, levels in backend.frames], output.getvalue(), clock.time(), elapsed
+
+
+def replay_game(path):
+	""" Play the recording <path> through BinaryCalculator.run() on a 
+		timing.VirtualClock until it ends. Returns the frames written to the 
+		mock backend, what the game printed, and the virtual and the real 
+		seconds it took.
+	"""
+	clock = timing.VirtualClock()
+	output = io.StringIO()
+	with clock.installed(xbox):
+		backend = gpio_backends.open_backend('mock', PINS)
+		ledc = lights.LedControllerBase(*PINS, backend=backend)
+		joy = xbox.Joystick(refreshRate=1e9, replay=path, virtual=True)
+		game = lights.BinaryCalculator(ledc, joy)
+
+		async def play():
+			joy.attach(asyncio.get_running_loop())
+			try:
+				await game.run()
+			except IOError:
+				pass	# end of the recording
+
+		start = time.monotonic()
+		try:
+			with contextlib.redirect_stdout(output):
+				clock.run(play())
+		finally:
+			joy.close()
+		elapsed = time.monotonic() - start
+	ledc.pwm.close()
+	return [levels for t, levels in backend.frames], output.getvalue(), clock.time(), elapsed
+
+
+def run(path=None, lines=LINES):
+	""" Replay throughput and frame digest of the recording <path>, of
+		<lines> freshly recorded lines if None.
+	"""
+	with tempfile.TemporaryDirectory() as tmp:
+		if path is None:
+			path = os.path.join(tmp, 'fake.xbr')
+			record(path, lines)
+		lines, span = recorded_span(path)
+		frames, elapsed = replay(path)
+		session = os.path.join(tmp, 'calculator.xbr')
+		write_session(session)
+		game_span = recorded_span(session)[1]
+		game_frames, game_output, game_virtual, game_elapsed = replay_game(session)
+		players = [os.path.join(tmp, 'player{}.xbr'.format(player)) for player in range(RACE_PLAYERS)]
+		for player, player_path in enumerate(players):
+			write_player(player_path, player)
+		race_frames, race_output, race_virtual, race_elapsed = replay_race(players)
+		duel_frames, duel_output = replay_race(players, game=lambda ledc, gamepads: lights.MemoryDuel(ledc, gamepads, 1))[:2]
+	return {
+		'lines': lines,
+		'lines_per_s': lines / elapsed,
+		'recorded_s_per_s': span / elapsed,
+		'frames': len(frames),
+		'digest': hashlib.sha1(bytes(bytearray(frames))).hexdigest(),
+		'game_recorded_s': game_span,
+		'game_virtual_s': game_virtual,
+		'game_recorded_s_per_s': game_span / game_elapsed,
+		'game_frames': len(game_frames),
+		'game_digest': hashlib.sha1(bytes(bytearray(game_frames)) + game_output.encode()).hexdigest(),
+		'race_virtual_s': race_virtual,
+		'race_virtual_s_per_s': race_virtual / race_elapsed,
+		'race_frames': len(race_frames),
+		'race_digest': hashlib.sha1(bytes(bytearray(race_frames)) + race_output.encode()).hexdigest(),
+		'duel_frames': len(duel_frames),
+		'duel_digest': hashlib.sha1(bytes(bytearray(duel_frames)) + duel_output.encode()).hexdigest(),
+	}
+
+
+if __name__ == '__main__':
+	results = run(sys.argv[1] if len(sys.argv) > 1 else None)
+	for key in sorted(results):
+		print("{:<24}{}".format(key, results[key]))
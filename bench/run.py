@@ -0,0 +1,395 @@
+""" Hardware-free benchmark suite of lights.py and xbox.py.
+
+Runs against two stand-ins instead of a Raspberry Pi and a gamepad: the
+in-memory RPi.GPIO in bench/fake_gpio and the fake xboxdrv in bench/bin,
+which streams button presses at a configurable rate. Measures
+
+	modes        calls, frames and GPIO writes per second of every
+	             LedControllerBase mode, played without waiting for the frame
+	             deadlines, so the cost of the mode itself is measured
+	backends     frames per second each GPIO backend writes, the mmap backend
+	             mapping a temporary file instead of /dev/gpiomem
+	mmap_registers
+	             frames of the mmap backend whose GPFSEL, GPSET0/1 and GPCLR0/1
+	             words were checked, the run stops at a wrong word, see 
+	             mmap_registers.py
+	shift_register
+	             full chain refreshes per second of 64 to 512 LEDs on shift
+	             registers, see shift_register.py
+	edge_cases   cases of the frame sources of patterns.py and animations.py
+	             checked at the edges of their input, the run stops at a wrong one, see 
+	             edge_cases.py
+	accessors    ns per call of the Joystick accessors, see accessors.py
+	pipe_drain   lines per second a Joystick reads from a flood of xboxdrv
+	             lines when polling, with the reader thread and attached to
+	             an asyncio loop
+	game_loops   iterations per second of the gamepad driven loops, and frames
+	             per second of the games LedMemory, AnotherGame and 
+	             BinaryCalculator played with the fake xboxdrv for up to the 
+	             duration each, the animations unpaced
+	joystick_group
+	             microseconds per game loop iteration reading 1 to 8 gamepads,
+	             see joystick_group.py
+	render       frames per second a producer hands to the render thread and
+	             what the render thread made of them
+	shared_joystick
+	             cost of reading the gamepad state and its staleness in this
+	             process and from a helper process, see shared_joystick.py
+	udp_stream   frames streamed over UDP loopback into the listener mode of
+	             lights.py: dropped, coalesced and how late they were shown,
+	             see udp_stream.py
+	replay       lines per second a recording of the gamepad input is played
+	             into the LED picking of the games, and recorded seconds per 
+	             second a Binary Calculator session and a two player Reaction
+	             Race are played through the games on a virtual clock, see 
+	             replay.py
+
+and prints the results as JSON, so runs can be compared to find regressions:
+
+	python bench/run.py [--duration 1] [--lines 100000] [--output results.json]
+"""
+from __future__ import print_function
+
+import argparse
+import asyncio
+import contextlib
+import itertools
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, 'fake_gpio'))
+sys.path.insert(1, os.path.join(BENCH_DIR, '..'))
+os.environ['PATH'] = os.path.join(BENCH_DIR, 'bin') + os.pathsep + os.environ.get('PATH', '')
+
+from RPi import GPIO
+import accessors
+import animations
+import edge_cases
+import gpio_backends
+import joystick_group
+import lights
+import mmap_registers
+import replay
+import shared_joystick
+import shift_register
+import timing
+import udp_stream
+import xbox
+
+lights.xbox = xbox
+lights.GPIO_BACKEND = 'rpi'
+
+PINS = (lights.GPIO_PIN_1, lights.GPIO_PIN_2, lights.GPIO_PIN_3, lights.GPIO_PIN_4)
+# Seconds each measurement runs.
+DURATION = 1.0
+# Lines sent by xboxdrv to measure the pipe drain.
+DRAIN_LINES = 100000
+# Lines per second sent by xboxdrv to the game loops, about the most a gamepad
+# polled at 1 kHz can deliver.
+GAME_LINE_RATE = 1000
+# Games played by bench_game_loops, made from the controller and the joystick.
+GAMES = (
+	('led_memory', lambda ledc, joy: lights.LedMemory(ledc, joy, 1)),
+	('another_game', lights.AnotherGame),
+	('binary_calculator', lights.BinaryCalculator),
+)
+
+
+class UnpacedScheduler(timing.DeadlineScheduler):
+	""" Shows every frame at once instead of waiting for its deadline. """
+	def wait_until(self, deadline):
+		pass
+
+	async def wait_until_async(self, deadline):
+		pass
+
+
+class CountingController(lights.LedControllerBase):
+	""" LedControllerBase counting the frames it writes. """
+	def post_init(self):
+		lights.LedControllerBase.post_init(self)
+		self.scheduler = UnpacedScheduler()
+		self.frames = 0
+
+	def write_frame(self, mask):
+		self.frames += 1
+		lights.LedControllerBase.write_frame(self, mask)
+
+
+def repeat_for(call, duration):
+	""" Call <call> until <duration> seconds passed. Returns the number of calls
+		and the seconds it took.
+	"""
+	calls = 0
+	start = time.monotonic()
+	end = start + duration
+	now = start
+	while now < end:
+		call()
+		calls += 1
+		now = time.monotonic()
+	return calls, now - start
+
+
+def bench_modes(duration):
+	ledc = CountingController(*PINS)
+	codes = itertools.cycle([[0], [0, 2], [1, 3], [0, 1, 2, 3], []])
+	pwm_pin = 1
+
+	def dimm():
+		ledc.start_pwm([pwm_pin])
+		ledc.dimm(pwm_pin, delay=0)
+		ledc.stop_pwm(pwm_pin)
+
+	modes = [
+		('phase', lambda: ledc.phase(next(codes))),
+		('phase2', lambda: ledc.phase2(next(codes), independent=True, stop=True)),
+		('blink', lambda: ledc.blink([0, 2], rounds=10)),
+		('phase_blink', lambda: ledc.phase_blink([0], [1, 3], rounds=10)),
+		('disco_mode', lambda: ledc.disco_mode(rounds=100)),
+		('raupe', lambda: ledc.raupe(rounds=20)),
+		('progress_mode', lambda: ledc.progress_mode(rounds=5)),
+		('progress_mode_async', lambda: asyncio.run(ledc.progress_mode_async(rounds=5))),
+		('dimm', dimm),
+		('test_modes', lambda: [ledc.play(timeline) for name, timeline in ledc.test_modes()]),
+	]
+	results = {}
+	for name, call in modes:
+		ledc.stop()
+		ledc.frames = 0
+		GPIO.reset()
+		calls, elapsed = repeat_for(call, duration)
+		results[name] = {
+			'calls_per_s': calls / elapsed,
+			'frames_per_s': ledc.frames / elapsed,
+			'gpio_writes_per_s': GPIO.writes / elapsed,
+			'pwm_changes_per_s': GPIO.pwm_changes / elapsed,
+		}
+	ledc.pwm.close()
+	return results
+
+
+def bench_backends(duration):
+	""" Frames per second written by every backend that opens here, every 
+		frame changing all pins.
+	"""
+	results = {}
+	with tempfile.NamedTemporaryFile() as regs:
+		options = {'mmap': {'path': regs.name}}
+		for name in sorted(gpio_backends.BACKENDS):
+			try:
+				backend = gpio_backends.open_backend(name, PINS, **options.get(name, {}))
+			except (ImportError, RuntimeError, OSError):
+				continue
+			all_mask = (1 << len(PINS)) - 1
+			frames = itertools.cycle([0b0101, 0b1010])
+			calls, elapsed = repeat_for(lambda: backend.write(next(frames), all_mask), duration)
+			backend.close()
+			results[name] = {'frames_per_s': calls / elapsed}
+	return results
+
+
+def bench_render(duration):
+	""" Frames per second LedControllerBase.phase takes with a render thread 
+		at timing.RENDER_RATE, against writing every frame at once, and the 
+		refreshes, dropped and late frames of the render thread.
+	"""
+	results = {}
+	codes = itertools.cycle([[0], [0, 2], [1, 3], [0, 1, 2, 3], []])
+	for name, rate in (('direct', None), ('render_thread', timing.RENDER_RATE)):
+		ledc = lights.LedControllerBase(*PINS)
+		if rate:
+			ledc.start_render(rate)
+		calls, elapsed = repeat_for(lambda: ledc.phase(next(codes)), duration)
+		results[name] = {'frames_per_s': calls / elapsed}
+		if rate:
+			stats = ledc.frame_buffer.stats()
+			ledc.stop_render()
+			results[name].update((key + '_per_s', value / elapsed) for key, value in stats.items())
+		ledc.pwm.close()
+	return results
+
+
+@contextlib.contextmanager
+def fake_joystick(rate=0, lines=0, **kwargs):
+	""" Joystick reading the fake xboxdrv, which sends <lines> lines (0 for no
+		limit) at <rate> lines per second (0 for as fast as possible).
+	"""
+	os.environ['FAKE_XBOXDRV_RATE'] = str(rate)
+	os.environ['FAKE_XBOXDRV_LINES'] = str(lines)
+	joy = xbox.Joystick(**kwargs)
+	try:
+		yield joy
+	finally:
+		joy.close()
+
+
+def drain_rate(mode, lines):
+	""" Lines per second and CPU share while a Joystick reads <lines> lines,
+		sent as fast as possible. <mode> is 'polling', 'threaded' or 'asyncio'.
+	"""
+	with fake_joystick(lines=lines, refreshRate=1e9, threaded=mode == 'threaded') as joy:
+		# xboxdrv sends exactly <lines> lines, the reader thread may have 
+		# counted some of them already.
+		target = lines
+		cpu, start = time.process_time(), time.monotonic()
+		if mode == 'polling':
+			while joy.history.count < target:
+				joy.refresh()
+		elif mode == 'threaded':
+			while joy.history.count < target:
+				time.sleep(0.001)
+		else:
+			async def attached():
+				joy.attach(asyncio.get_running_loop())
+				try:
+					while joy.history.count < target:
+						await asyncio.shield(joy.nextState())
+				finally:
+					joy.detach()
+			asyncio.run(attached())
+		elapsed = time.monotonic() - start
+		return {
+			'lines_per_s': lines / elapsed,
+			'cpu_share': (time.process_time() - cpu) / elapsed,
+		}
+
+
+def bench_pipe_drain(lines):
+	return dict((mode, drain_rate(mode, lines)) for mode in ('polling', 'threaded', 'asyncio'))
+
+
+async def count_for(coro_factory, duration):
+	""" Run the coroutine from <coro_factory>() for <duration> seconds, then
+		cancel it. Returns True if it ended by itself before, exceptions of 
+		the coroutine are raised.
+	"""
+	task = asyncio.ensure_future(coro_factory())
+	await asyncio.wait([task], timeout=duration)
+	ended = task.done()
+	task.cancel()
+	try:
+		await task
+	except asyncio.CancelledError:
+		pass
+	return ended
+
+
+def bench_game_loops(duration):
+	""" Iterations per second of the loops reacting to the gamepad, fed with
+		a new button state on every line at GAME_LINE_RATE lines per second, 
+		and the frames per second of the GAMES played with the same input. 
+		A game whose play() raises fails the benchmark.
+	"""
+	results = {}
+	ledc = CountingController(*PINS)
+	with fake_joystick(rate=GAME_LINE_RATE) as joy:
+		iterations = [0]
+
+		async def input_loop():
+			joy.attach(asyncio.get_running_loop())
+			try:
+				while True:
+					await lights.wait_input(joy)
+					ledc.phase(lights.held_leds(joy))
+					iterations[0] += 1
+			finally:
+				joy.detach()
+
+		async def define_pattern():
+			joy.attach(asyncio.get_running_loop())
+			try:
+				await lights.LedPatternRepeater(ledc, joy).define_pattern()
+			finally:
+				joy.detach()
+
+		cpu, start = time.process_time(), time.monotonic()
+		asyncio.run(count_for(input_loop, duration))
+		elapsed = time.monotonic() - start
+		results['wait_input'] = {
+			'iterations_per_s': iterations[0] / elapsed,
+			'cpu_share': (time.process_time() - cpu) / elapsed,
+		}
+
+		ledc.frames = 0
+		cpu, start = time.process_time(), time.monotonic()
+		with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+			asyncio.run(count_for(define_pattern, duration))
+		elapsed = time.monotonic() - start
+		results['define_pattern'] = {
+			'iterations_per_s': ledc.frames / elapsed,
+			'cpu_share': (time.process_time() - cpu) / elapsed,
+		}
+
+		for name, make_game in GAMES:
+			async def play_game():
+				joy.attach(asyncio.get_running_loop())
+				try:
+					await make_game(ledc, joy).run()
+				finally:
+					joy.detach()
+
+			ledc.stop()
+			ledc.frames = 0
+			cpu, start = time.process_time(), time.monotonic()
+			with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+				ended = asyncio.run(count_for(play_game, duration))
+			elapsed = time.monotonic() - start
+			results[name] = {
+				'frames_per_s': ledc.frames / elapsed,
+				'cpu_share': (time.process_time() - cpu) / elapsed,
+				'ended': ended,
+			}
+	ledc.pwm.close()
+	return results
+
+
+def run(duration=DURATION, number=accessors.NUMBER, lines=DRAIN_LINES):
+	""" All benchmarks, as a dict ready for json.dump. """
+	return {
+		'meta': {
+			'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+			'python': platform.python_version(),
+			'machine': platform.machine(),
+			'numpy': animations.np is not None,
+			'duration': duration,
+			'drain_lines': lines,
+		},
+		'modes': bench_modes(duration),
+		'backends': bench_backends(duration),
+		'mmap_registers': mmap_registers.run(),
+		'shift_register': shift_register.run(duration),
+		'edge_cases': edge_cases.run(),
+		'accessors': accessors.run(number),
+		'pipe_drain': bench_pipe_drain(lines),
+		'game_loops': bench_game_loops(duration),
+		'joystick_group': joystick_group.run(duration),
+		'render': bench_render(duration),
+		'shared_joystick': shared_joystick.run(duration),
+		'udp_stream': udp_stream.run(duration),
+		'replay': replay.run(lines=lines),
+	}
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description="Benchmark lights.py and xbox.py without hardware.")
+	parser.add_argument('--duration', type=float, default=DURATION,
+						help="seconds each measurement runs")
+	parser.add_argument('--number', type=int, default=accessors.NUMBER,
+						help="calls per accessor timing")
+	parser.add_argument('--lines', type=int, default=DRAIN_LINES,
+						help="lines read from xboxdrv per pipe drain measurement")
+	parser.add_argument('--output', help="write the JSON results to this file instead of stdout")
+	args = parser.parse_args()
+	results = run(args.duration, args.number, args.lines)
+	if args.output:
+		with open(args.output, 'w') as f:
+			json.dump(results, f, indent=2, sort_keys=True)
+	else:
+		json.dump(results, sys.stdout, indent=2, sort_keys=True)
+		print()
@@ -0,0 +1,120 @@
+""" Benchmark of reading the gamepad in a helper process.
+
+Compares the ways to read the fake xboxdrv (bench/bin), which sends
+LINE_RATE lines per second stamped with their send time:
+
+	polling   Joystick refreshing on every call, one select call each
+	threaded  Joystick(threaded=True), a reader thread in this process
+	shared    xbox.SharedJoystick, a reader process and a shared memory block
+
+by the cost of one snapshot() call and the staleness of the states read:
+the time from xboxdrv sending a line until the game loop first sees it.
+The game loop spins on snapshot() for DURATION seconds while LOAD_THREADS
+threads burn CPU like animations would. With --single-core everything,
+xboxdrv included, runs on one core like on a Raspberry Pi Zero.
+
+	python bench/shared_joystick.py [--single-core]
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..'))
+os.environ['PATH'] = os.path.join(BENCH_DIR, 'bin') + os.pathsep + os.environ.get('PATH', '')
+import xbox
+
+
+MODES = ('polling', 'threaded', 'shared')
+# Lines per second sent by the fake xboxdrv.
+LINE_RATE = 1000
+# Seconds each measurement runs.
+DURATION = 1.0
+# Threads burning CPU next to the game loop.
+LOAD_THREADS = 1
+# Resolution of the send time stamps in X1, as in bench/bin/xboxdrv.
+STAMP_UNIT = 1e-5
+
+
+def stamp_age(x1):
+	""" Seconds since the line stamped <x1> was sent. """
+	return (int(time.monotonic() / STAMP_UNIT) - x1) % 32768 * STAMP_UNIT
+
+
+def open_joystick(mode):
+	os.environ['FAKE_XBOXDRV_RATE'] = str(LINE_RATE)
+	os.environ['FAKE_XBOXDRV_LINES'] = '0'
+	os.environ['FAKE_XBOXDRV_STAMP'] = '1'
+	if mode == 'shared':
+		return xbox.SharedJoystick()
+	return xbox.Joystick(refreshRate=1e9, threaded=mode == 'threaded')
+
+
+def burn(stop):
+	while not stop.is_set():
+		sum(range(1000))
+
+
+def percentile(values, p):
+	values = sorted(values)
+	return values[min(len(values) - 1, int(p / 100.0 * len(values)))] if values else 0.0
+
+
+def measure(mode, duration=DURATION, load=LOAD_THREADS):
+	""" ns per snapshot() and staleness percentiles in ms of one mode. """
+	joy = open_joystick(mode)
+	stop = threading.Event()
+	loaders = [threading.Thread(target=burn, args=(stop,)) for i in range(load)]
+	for loader in loaders:
+		loader.start()
+	try:
+		calls = 0
+		staleness = []
+		last = joy.snapshot()
+		start = time.perf_counter()
+		end = time.monotonic() + duration
+		while time.monotonic() < end:
+			for i in range(100):
+				state = joy.snapshot()
+				if state is not last:
+					staleness.append(stamp_age(state.leftX))
+					last = state
+			calls += 100
+		# The clock reads are part of the loop, the cost per call is an upper bound.
+		elapsed = time.perf_counter() - start
+	finally:
+		stop.set()
+		for loader in loaders:
+			loader.join()
+		joy.close()
+	return {
+		'ns_per_read': elapsed / calls * 1e9,
+		'states_seen': len(staleness),
+		'staleness_ms_p50': 1e3 * percentile(staleness, 50),
+		'staleness_ms_p99': 1e3 * percentile(staleness, 99),
+		'staleness_ms_max': 1e3 * max(staleness or [0.0]),
+	}
+
+
+def run(duration=DURATION, load=LOAD_THREADS):
+	return dict((mode, measure(mode, duration, load)) for mode in MODES)
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description="Compare reading the gamepad in this and in a helper process.")
+	parser.add_argument('--single-core', action='store_true', help="run everything on the first core")
+	parser.add_argument('--duration', type=float, default=DURATION, help="seconds each measurement runs")
+	parser.add_argument('--load', type=int, default=LOAD_THREADS, help="threads burning CPU next to the game loop")
+	args = parser.parse_args()
+	if args.single_core:
+		os.sched_setaffinity(0, {min(os.sched_getaffinity(0))})
+	results = run(args.duration, args.load)
+	print("{:<10}{:>12}{:>8}{:>12}{:>12}{:>12}".format('mode', 'ns/read', 'states', 'p50 ms', 'p99 ms', 'max ms'))
+	for mode in MODES:
+		r = results[mode]
+		print("{:<10}{:>12.0f}{:>8}{:>12.3f}{:>12.3f}{:>12.3f}".format(mode, r['ns_per_read'], r['states_seen'], 
+			r['staleness_ms_p50'], r['staleness_ms_p99'], r['staleness_ms_max']))
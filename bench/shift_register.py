@@ -0,0 +1,76 @@
+""" Benchmark of the shift register backend.
+
+Measures how many times per second the whole chain of 74HC595 shift
+registers can be refreshed for 64 to 512 LEDs: clocked out on the pins of
+the mock backend, of the mmap backend (mapping a temporary file instead of
+/dev/gpiomem) and handed to SPI as one buffer. The SPI device is a stand-in
+that drops the buffer, so that path measures the packing of the frame only.
+
+	python bench/shift_register.py
+"""
+from __future__ import print_function
+
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import gpio_backends
+
+
+LED_COUNTS = (64, 128, 256, 512)
+# Seconds each measurement runs.
+DURATION = 0.5
+DATA, CLOCK, LATCH = 10, 11, 8
+
+
+class NullSpi(object):
+	""" spidev.SpiDev stand-in that drops every transfer. """
+	def writebytes2(self, data):
+		pass
+
+	def close(self):
+		pass
+
+
+def refresh_rate(backend, led_count, duration):
+	""" Full chain refreshes per second, every refresh changing all LEDs. """
+	all_mask = (1 << led_count) - 1
+	frames = (int('01' * (led_count // 2), 2), int('10' * (led_count // 2), 2))
+	refreshes = 0
+	start = time.monotonic()
+	end = start + duration
+	now = start
+	while now < end:
+		backend.write(frames[refreshes & 1], all_mask)
+		refreshes += 1
+		if isinstance(backend.lines, gpio_backends.MockBackend):
+			del backend.lines.frames[:]
+		now = time.monotonic()
+	return refreshes / (now - start)
+
+
+def run(duration=DURATION):
+	""" Refreshes per second by path and LED count. """
+	results = {'mock': {}, 'mmap': {}, 'spi': {}}
+	with tempfile.NamedTemporaryFile() as regs:
+		for led_count in LED_COUNTS:
+			paths = {
+				'mock': lambda: gpio_backends.ShiftRegisterBackend(led_count, DATA, CLOCK, LATCH, pin_backend='mock'),
+				'mmap': lambda: gpio_backends.ShiftRegisterBackend(
+					led_count, DATA, CLOCK, LATCH, pin_backend=gpio_backends.MmapBackend([DATA, CLOCK, LATCH], regs.name)),
+				'spi': lambda: gpio_backends.ShiftRegisterBackend(led_count, spi=NullSpi()),
+			}
+			for path, open_backend in paths.items():
+				backend = open_backend()
+				results[path][led_count] = refresh_rate(backend, led_count, duration)
+				backend.close()
+	return results
+
+
+if __name__ == '__main__':
+	results = run()
+	print("{:<8}".format('LEDs') + "".join("{:>14}".format(path + ' Hz') for path in sorted(results)))
+	for led_count in LED_COUNTS:
+		print("{:<8}".format(led_count) + "".join("{:>14.0f}".format(results[path][led_count]) for path in sorted(results)))
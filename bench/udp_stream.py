@@ -0,0 +1,111 @@
+""" End-to-end benchmark of streaming frames over UDP.
+
+Runs lights.listen_mainloop on the mock GPIO backend and sends it RATE
+frames per second over loopback from a second thread, every frame targeted
+AHEAD seconds after sending. Every DUPLICATE_EVERY-th frame is sent twice
+and every STALE_EVERY-th frame is one that should have been shown a second
+ago, so the listener has to drop both. Reports the listener's counts, how
+late the frames were shown after their target time and whether the frames
+shown kept their order.
+
+	python bench/udp_stream.py
+"""
+from __future__ import print_function
+
+import asyncio
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import frame_stream
+import gpio_backends
+import lights
+
+
+PINS = (lights.GPIO_PIN_1, lights.GPIO_PIN_2, lights.GPIO_PIN_3, lights.GPIO_PIN_4)
+# Frames per second sent, ten times the refresh rate of the listener.
+RATE = 10 * frame_stream.REFRESH_RATE
+# Seconds between sending a frame and its target time.
+AHEAD = 0.005
+DUPLICATE_EVERY = 50
+STALE_EVERY = 100
+# Seconds the stream runs.
+DURATION = 1.0
+
+
+def send(sender, rate, duration):
+	""" Send the stream, returns the number of frames it should drop. """
+	period = 1.0 / rate
+	drops = 0
+	deadline = time.monotonic()
+	for i in range(int(rate * duration)):
+		if i % STALE_EVERY == STALE_EVERY - 1:
+			sender.send_mask(0, time.time() - 1.0)
+			drops += 1
+		else:
+			sender.send_mask(1 << i % len(PINS), time.time() + AHEAD)
+		if i % DUPLICATE_EVERY == DUPLICATE_EVERY - 1:
+			# The same datagram again
+			sender.seq -= 1
+			sender.send_mask(1 << i % len(PINS), time.time() + AHEAD)
+			drops += 1
+		deadline += period
+		delay = deadline - time.monotonic()
+		if delay > 0:
+			time.sleep(delay)
+	return drops
+
+
+def run(duration=DURATION, rate=RATE):
+	ledc = lights.LedControllerBase(*PINS, backend=gpio_backends.open_backend('mock', PINS))
+	listener = frame_stream.FrameListener(0, '127.0.0.1')
+	sender = frame_stream.FrameSender('127.0.0.1', listener.sock.getsockname()[1], len(PINS))
+	shown, lateness = [], []
+	due = listener.due
+
+	def recording_due(now=None):
+		frame = due(now)
+		if frame is not None:
+			shown.append(frame.seq)
+			lateness.append(time.time() - frame.target)
+		return frame
+	listener.due = recording_due
+
+	drops = []
+	thread = threading.Thread(target=lambda: drops.append(send(sender, rate, duration)))
+
+	async def listen():
+		task = asyncio.ensure_future(lights.listen_mainloop(ledc, listener))
+		thread.start()
+		await asyncio.get_running_loop().run_in_executor(None, thread.join)
+		await asyncio.sleep(0.05)
+		task.cancel()
+		try:
+			await task
+		except asyncio.CancelledError:
+			pass
+
+	asyncio.run(listen())
+	sender.close()
+	listener.close()
+	ledc.pwm.close()
+	lateness.sort()
+	stats = listener.stats
+	return {
+		'sent': stats['received'],
+		'expected_drops': drops[0],
+		'dropped': stats['stale'] + stats['out_of_order'],
+		'shown': stats['shown'],
+		'coalesced': stats['coalesced'],
+		'in_order': all(frame_stream.newer(b, a) for a, b in zip(shown, shown[1:])),
+		'late_ms_p50': 1e3 * lateness[len(lateness) // 2] if lateness else 0.0,
+		'late_ms_p99': 1e3 * lateness[int(0.99 * len(lateness))] if lateness else 0.0,
+	}
+
+
+if __name__ == '__main__':
+	results = run()
+	for key in sorted(results):
+		print("{:<16}{}".format(key, results[key]))
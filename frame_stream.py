@@ -0,0 +1,237 @@
+""" Frames streamed over UDP from another host.
+
+Every datagram carries one frame, all numbers little endian:
+
+	header   HEADER: magic, version, kind, pin count, sequence number and
+	         target time, see below
+	payload  KIND_MASK: the frame bitmask (as in LedControllerBase) in
+	         (pin count + 7) // 8 bytes
+	         KIND_LEVELS: one brightness per pin, 0 (off) to 255 (full on)
+
+The sequence number counts up by one per frame and wraps at 2^32. The target
+time is when the frame should be shown, in microseconds of time.time() on
+the sender, so sender and receiver clocks need to be synchronised (NTP);
+0 shows it at once.
+
+FrameListener receives the frames. It drops frames older than the newest one
+received (duplicates and out of order), frames whose target time passed more
+than STALE_AFTER seconds ago and malformed datagrams. A frame more than
+RESTART_GAP frames behind, or the first one after RESTART_AFTER seconds
+without frames, starts a new sequence: the sender was restarted and counts
+from 0 again. Waiting frames are kept in the order of their target times, so
+a frame for later never holds up one to show at once. Of the frames due at a
+refresh tick only the newest is shown, the others count as coalesced.
+
+Sending a test show to a Pi running `python lights.py --listen 7777`:
+
+	python frame_stream.py send raspberrypi 7777 --rate 200 --leds 4
+"""
+from __future__ import print_function
+
+import argparse
+import collections
+import heapq
+import itertools
+import socket
+import struct
+import time
+
+
+MAGIC = b'LEDS'
+VERSION = 1
+KIND_MASK = 0
+KIND_LEVELS = 1
+# magic, version, kind, pin count, sequence number, target time (us of time.time())
+HEADER = struct.Struct('<4sBBHIq')
+DEFAULT_PORT = 7777
+# Refresh ticks per second of the listener.
+REFRESH_RATE = 200
+# Frames whose target time is older than this many seconds are dropped.
+STALE_AFTER = 0.1
+# Frames waiting for their target time, the earliest are dropped first.
+MAX_PENDING = 256
+# A frame this many sequence numbers behind the newest one starts a new 
+# sequence, as does the first frame after this many seconds without any.
+RESTART_GAP = 4096
+RESTART_AFTER = 1.0
+# Largest datagram read.
+MAX_DATAGRAM = 65536
+
+
+# Received frame: kind, sequence number, target time in seconds of time.time()
+# (0.0 for at once) and the mask or the list of levels.
+Frame = collections.namedtuple('Frame', 'kind seq target data')
+
+
+def pack_frame(kind, seq, target, data, pin_count):
+	""" Datagram of a frame, <data> is the mask or the levels. """
+	header = HEADER.pack(MAGIC, VERSION, kind, pin_count, seq & 0xffffffff, int(round(target * 1e6)))
+	if kind == KIND_MASK:
+		return header + int(data).to_bytes((pin_count + 7) // 8, 'little')
+	return header + bytes(bytearray(data[:pin_count]))
+
+
+def unpack_frame(datagram):
+	""" Frame of a datagram, None if it is no valid frame. """
+	try:
+		magic, version, kind, pin_count, seq, target = HEADER.unpack_from(datagram, 0)
+	except struct.error:
+		return None
+	payload = datagram[HEADER.size:]
+	if magic != MAGIC or version != VERSION:
+		return None
+	if kind == KIND_MASK and len(payload) == (pin_count + 7) // 8:
+		return Frame(kind, seq, target / 1e6, int.from_bytes(payload, 'little'))
+	if kind == KIND_LEVELS and len(payload) == pin_count:
+		return Frame(kind, seq, target / 1e6, list(bytearray(payload)))
+	return None
+
+
+def newer(seq, than):
+	""" True if the sequence number <seq> comes after <than>, across wraps. """
+	return 0 < (seq - than) % (1 << 32) < (1 << 31)
+
+
+class FrameListener(object):
+	""" Non-blocking UDP socket receiving frames. Call receive() whenever the
+		socket is readable and due() on every refresh tick.
+	"""
+	def __init__(self, port=DEFAULT_PORT, host='0.0.0.0', stale=STALE_AFTER, max_pending=MAX_PENDING):
+		self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+		self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+		self.sock.bind((host, port))
+		self.sock.setblocking(False)
+		self.stale = stale
+		self.max_pending = max_pending
+		# Heap of (target, arrival, frame) waiting for their target time.
+		self.pending = []
+		self.arrivals = itertools.count()
+		self.last_seq = None
+		self.last_received = None
+		self.stats = collections.Counter()
+
+	def restarted(self, frame, now):
+		""" True if <frame> starts a new sequence of a restarted sender. """
+		if self.last_received is not None and now - self.last_received > RESTART_AFTER:
+			return True
+		return (self.last_seq - frame.seq) % (1 << 32) > RESTART_GAP
+
+	def fileno(self):
+		return self.sock.fileno()
+
+	def receive(self):
+		""" Read every datagram waiting in the socket. """
+		while True:
+			try:
+				datagram = self.sock.recv(MAX_DATAGRAM)
+			except (BlockingIOError, InterruptedError):
+				return
+			self.stats['received'] += 1
+			now = time.monotonic()
+			frame = unpack_frame(datagram)
+			if frame is None:
+				self.stats['malformed'] += 1
+				continue
+			if self.last_seq is not None and not newer(frame.seq, self.last_seq):
+				if not self.restarted(frame, now):
+					self.stats['out_of_order'] += 1
+					continue
+				self.stats['restarts'] += 1
+			self.last_seq = frame.seq
+			self.last_received = now
+			entry = (frame.target, next(self.arrivals), frame)
+			if len(self.pending) < self.max_pending:
+				heapq.heappush(self.pending, entry)
+			else:
+				self.stats['overflow'] += 1
+				heapq.heappushpop(self.pending, entry)
+
+	def due(self, now=None):
+		""" The newest frame whose target time has come, None if there is none.
+			Older due frames are coalesced into it, stale ones dropped.
+		"""
+		if now is None:
+			now = time.time()
+		frame = arrival = None
+		while self.pending and self.pending[0][0] <= now:
+			target, candidate_arrival, candidate = heapq.heappop(self.pending)
+			if target and target < now - self.stale:
+				self.stats['stale'] += 1
+				continue
+			if frame is not None:
+				self.stats['coalesced'] += 1
+				if candidate_arrival < arrival:
+					continue
+			frame, arrival = candidate, candidate_arrival
+		if frame is not None:
+			self.stats['shown'] += 1
+		return frame
+
+	def report(self):
+		stats = self.stats
+		return "Frames received: {}, shown: {}, coalesced: {}, stale: {}, out of order: {}, malformed: {}, overflow: {}, sender restarts: {}".format(
+			stats['received'], stats['shown'], stats['coalesced'], stats['stale'],
+			stats['out_of_order'], stats['malformed'], stats['overflow'], stats['restarts'])
+
+	def close(self):
+		self.sock.close()
+
+
+class FrameSender(object):
+	""" Sends frames to a FrameListener at <host>:<port>. """
+	def __init__(self, host, port=DEFAULT_PORT, pin_count=4):
+		self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+		self.address = (host, port)
+		self.pin_count = pin_count
+		self.seq = 0
+
+	def send(self, kind, data, target=0.0):
+		self.sock.sendto(pack_frame(kind, self.seq, target, data, self.pin_count), self.address)
+		self.seq = (self.seq + 1) & 0xffffffff
+
+	def send_mask(self, mask, target=0.0):
+		self.send(KIND_MASK, mask, target)
+
+	def send_levels(self, levels, target=0.0):
+		self.send(KIND_LEVELS, levels, target)
+
+	def close(self):
+		self.sock.close()
+
+
+def send_show(sender, rate, seconds, ahead=0.0):
+	""" Send a running light at <rate> frames per second for <seconds>,
+		every frame targeted <ahead> seconds after sending (0: at once).
+		Every fourth frame sends brightness levels instead of a mask.
+	"""
+	period = 1.0 / rate
+	frames = int(seconds * rate)
+	deadline = time.monotonic()
+	for i in range(frames):
+		target = time.time() + ahead if ahead else 0.0
+		lit = i % sender.pin_count
+		if i % 4 == 3:
+			sender.send_levels([255 if p == lit else 32 for p in range(sender.pin_count)], target)
+		else:
+			sender.send_mask(1 << lit, target)
+		deadline += period
+		delay = deadline - time.monotonic()
+		if delay > 0:
+			time.sleep(delay)
+	return frames
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description="Send a test show to lights.py --listen.")
+	parser.add_argument('command', choices=('send',))
+	parser.add_argument('host')
+	parser.add_argument('port', type=int, nargs='?', default=DEFAULT_PORT)
+	parser.add_argument('--rate', type=float, default=100, help="frames per second")
+	parser.add_argument('--seconds', type=float, default=10, help="length of the show")
+	parser.add_argument('--leds', type=int, default=4, help="number of LEDs")
+	parser.add_argument('--ahead', type=float, default=0.0,
+						help="target frames this many seconds after sending, 0 to show them at once")
+	args = parser.parse_args()
+	sender = FrameSender(args.host, args.port, args.leds)
+	print("Sent {} frames".format(send_show(sender, args.rate, args.seconds, args.ahead)))
+	sender.close()
@@ -0,0 +1,429 @@
+""" GPIO backends driving the LED pins.
+
+A backend drives a fixed list of output pins, addressed by their index like
+the LEDs of LedControllerBase, and writes whole frames: write(mask, changed)
+sets every pin whose bit is set in <changed> to its level in the bitmask
+<mask>. How many calls that takes depends on the backend:
+
+	rpi     RPi.GPIO, one GPIO.output per changed pin
+	gpiod   GPIO character device through libgpiod, all pins are requested
+	        as one bulk line request and a frame is a single set_values call
+	mmap    GPIO registers mapped from /dev/gpiomem, a frame is one store to
+	        the set and one to the clear register
+	shift   chained 74HC595 shift registers on three pins of another backend,
+	        or on the SPI bus, for strips of hundreds of LEDs
+	mock    no hardware, every frame is recorded in memory
+
+Only the rpi and mock backends have hardware PWM channels. On the others a
+PWM channel is a DigitalPwm, which switches the pin fully on from a duty
+cycle of DIGITAL_PWM_THRESHOLD and off below it.
+
+The GPIO libraries are only imported when their backend is opened, so this
+module and lights.py import on any machine. open_backend('auto', pins)
+picks the first backend whose library works here. The shift register 
+backend is built with its own arguments, see 
+LedControllerBase.with_shift_register.
+"""
+from __future__ import print_function
+
+import mmap
+import os
+import stat
+import time
+
+
+# Character device and consumer name used by the gpiod backend.
+GPIOD_CHIP = '/dev/gpiochip0'
+GPIOD_CONSUMER = 'led-control'
+# GPIO register block of the BCM2835 to BCM2711 (Raspberry Pi 1 to 4) used by 
+# the mmap backend: path, size and byte offsets of the registers.
+GPIOMEM_PATH = '/dev/gpiomem'
+GPIO_BLOCK_SIZE = 4096
+GPFSEL0 = 0x00
+GPSET0 = 0x1C
+GPCLR0 = 0x28
+# Number of GPIOs of the register block, GPIOs 32 and up are in the second 
+# set and clear register.
+GPIO_COUNT = 54
+# Clock rate of the SPI bus used by the shift register backend (Hz).
+SHIFT_SPI_SPEED = 8000000
+# Duty cycle from which a DigitalPwm channel switches its pin on (percent).
+DIGITAL_PWM_THRESHOLD = 50
+
+
+class GpioBackend(object):
+	""" Base class of the backends. <pins> are the GPIO numbers (BCM) of the
+		LEDs, bit i of a frame belongs to pins[i].
+	"""
+	name = None
+	# True if pwm() gives real PWM channels, False for DigitalPwm.
+	hardware_pwm = False
+
+	def __init__(self, pins):
+		self.pins = list(pins)
+
+	def write(self, mask, changed):
+		""" Set the pins of the bits in <changed> to their level in <mask>. """
+		raise NotImplementedError
+
+	def write_many(self, masks, changed):
+		""" write(mask, changed) for every mask of <masks> in turn. """
+		write = self.write
+		for mask in masks:
+			write(mask, changed)
+
+	def pwm(self, idx, freq):
+		""" New PWM channel of pin <idx>, with the interface of RPi.GPIO.PWM. 
+			Backends without PWM hardware give a DigitalPwm.
+		"""
+		return DigitalPwm(self, idx, freq)
+
+	def close(self):
+		""" Release the pins. """
+
+
+class DigitalPwm(object):
+	""" PWM channel of pin <idx> of a backend without PWM: the pin is on 
+		while the duty cycle is at least DIGITAL_PWM_THRESHOLD and the channel 
+		runs, off otherwise. The frequency is ignored.
+	"""
+	def __init__(self, backend, idx, freq):
+		self.backend = backend
+		self.bit = 1 << idx
+		self.level = None
+
+	def show(self, level):
+		if level != self.level:
+			self.backend.write(self.bit if level else 0, self.bit)
+			self.level = level
+
+	def start(self, dc):
+		# The pin may have been written as digital output since the last stop.
+		self.level = None
+		self.ChangeDutyCycle(dc)
+
+	def stop(self):
+		self.show(False)
+
+	def ChangeDutyCycle(self, dc):
+		self.show(dc >= DIGITAL_PWM_THRESHOLD)
+
+	def ChangeFrequency(self, freq):
+		pass
+
+
+class RPiGpioBackend(GpioBackend):
+	name = 'rpi'
+	hardware_pwm = True
+
+	def __init__(self, pins):
+		GpioBackend.__init__(self, pins)
+		import RPi.GPIO as GPIO
+		self.GPIO = GPIO
+		# Call GPIO pins via their number.
+		GPIO.setmode(GPIO.BCM)
+		for p in self.pins:
+			GPIO.setup(p, GPIO.OUT)
+
+	def write(self, mask, changed):
+		output, pins = self.GPIO.output, self.pins
+		high, low = self.GPIO.HIGH, self.GPIO.LOW
+		while changed:
+			bit = changed & -changed
+			output(pins[bit.bit_length() - 1], high if mask & bit else low)
+			changed ^= bit
+
+	def pwm(self, idx, freq):
+		return self.GPIO.PWM(self.pins[idx], freq)
+
+	def close(self):
+		self.GPIO.cleanup()
+
+
+class GpiodBackend(GpioBackend):
+	""" Requests all pins as output lines of <chip> at once. Works with the
+		Python bindings of libgpiod 1.x and 2.x. Pins are line offsets of the
+		chip, which are the BCM numbers on gpiochip0 of a Raspberry Pi.
+	"""
+	name = 'gpiod'
+
+	def __init__(self, pins, chip=GPIOD_CHIP, consumer=GPIOD_CONSUMER):
+		GpioBackend.__init__(self, pins)
+		import gpiod
+		self.levels = 0
+		self.chip = None
+		if hasattr(gpiod, 'request_lines'):
+			from gpiod.line import Direction, Value
+			self.values = (Value.INACTIVE, Value.ACTIVE)
+			settings = gpiod.LineSettings(direction=Direction.OUTPUT, output_value=Value.INACTIVE)
+			self.request = gpiod.request_lines(chip, consumer=consumer, config={tuple(self.pins): settings})
+			self.lines = None
+		else:
+			self.chip = gpiod.Chip(chip)
+			self.lines = self.chip.get_lines(self.pins)
+			self.lines.request(consumer=consumer, type=gpiod.LINE_REQ_DIR_OUT, default_vals=[0] * len(self.pins))
+			self.request = None
+
+	def write(self, mask, changed):
+		self.levels = self.levels & ~changed | mask & changed
+		if self.request is not None:
+			values, pins = self.values, self.pins
+			update = {}
+			while changed:
+				bit = changed & -changed
+				update[pins[bit.bit_length() - 1]] = values[1 if mask & bit else 0]
+				changed ^= bit
+			self.request.set_values(update)
+		else:
+			# libgpiod 1.x sets every line of the bulk request.
+			self.lines.set_values([self.levels >> i & 1 for i in range(len(self.pins))])
+
+	def close(self):
+		if self.request is not None:
+			self.request.release()
+		else:
+			self.lines.release()
+			self.chip.close()
+
+
+class MmapBackend(GpioBackend):
+	""" Writes the GPIO registers directly through a memory map of <path>. 
+		The GPIO bits of every byte of a frame are looked up in tables built 
+		once, so a frame takes one store to GPSET0 and one to GPCLR0 (plus 
+		GPSET1 and GPCLR1 if pins above 31 are used). <path> may be any file, 
+		a regular file is extended to the size of the register block.
+	"""
+	name = 'mmap'
+
+	def __init__(self, pins, path=GPIOMEM_PATH):
+		GpioBackend.__init__(self, pins)
+		for p in self.pins:
+			if not 0 <= p < GPIO_COUNT:
+				raise ValueError('No GPIO {} in the register block'.format(p))
+		self.fd = os.open(path, os.O_RDWR | os.O_SYNC)
+		try:
+			if stat.S_ISREG(os.fstat(self.fd).st_mode) and os.fstat(self.fd).st_size < GPIO_BLOCK_SIZE:
+				os.ftruncate(self.fd, GPIO_BLOCK_SIZE)
+			self.map = mmap.mmap(self.fd, GPIO_BLOCK_SIZE, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+		except Exception:
+			os.close(self.fd)
+			raise
+		self.regs = memoryview(self.map).cast('I')
+		# tables[k][byte]: GPIO bits, as one 64 bit word of both register sets, 
+		# of the LEDs 8k to 8k+7 that are set in byte.
+		self.tables = []
+		for first in range(0, len(self.pins), 8):
+			bits = [1 << p for p in self.pins[first:first + 8]]
+			table = [0] * 256
+			for j, bit in enumerate(bits):
+				for byte in range(256):
+					if byte >> j & 1:
+						table[byte] |= bit
+			self.tables.append(table)
+		# changed -> set and clear words of every mask, see write_many.
+		self.words = {}
+		for p in self.pins:
+			# Function select: three bits per GPIO, ten GPIOs per register, 001 is output.
+			reg, shift = GPFSEL0 // 4 + p // 10, 3 * (p % 10)
+			self.regs[reg] = self.regs[reg] & ~(7 << shift) | 1 << shift
+
+	def gpio_bits(self, leds):
+		""" GPIO bits of the LEDs set in the bitmask <leds>. """
+		bits = 0
+		for table in self.tables:
+			if not leds:
+				break
+			bits |= table[leds & 0xff]
+			leds >>= 8
+		return bits
+
+	def write(self, mask, changed):
+		regs = self.regs
+		set_bits = self.gpio_bits(mask & changed)
+		clear_bits = self.gpio_bits(changed & ~mask)
+		if set_bits & 0xffffffff:
+			regs[GPSET0 // 4] = set_bits & 0xffffffff
+		if set_bits >> 32:
+			regs[GPSET0 // 4 + 1] = set_bits >> 32
+		if clear_bits & 0xffffffff:
+			regs[GPCLR0 // 4] = clear_bits & 0xffffffff
+		if clear_bits >> 32:
+			regs[GPCLR0 // 4 + 1] = clear_bits >> 32
+
+	def write_many(self, masks, changed):
+		""" Two stores per mask: with at most 8 pins of the first register set 
+			involved, the set and clear words of all 256 masks are looked up 
+			once per <changed>.
+		"""
+		if changed > 0xff or self.gpio_bits(changed) >> 32:
+			return GpioBackend.write_many(self, masks, changed)
+		words = self.words.get(changed)
+		if words is None:
+			words = self.words[changed] = (
+				[self.gpio_bits(m & changed) for m in range(256)],
+				[self.gpio_bits(changed & ~m) for m in range(256)])
+		set_words, clear_words = words
+		regs, gpset, gpclr = self.regs, GPSET0 // 4, GPCLR0 // 4
+		# Bits above <changed> are not written, frames of more than 8 LEDs 
+		# look up their low byte.
+		for mask in masks:
+			regs[gpset] = set_words[mask & 0xff]
+			regs[gpclr] = clear_words[mask & 0xff]
+
+	def close(self):
+		self.regs.release()
+		self.map.close()
+		os.close(self.fd)
+
+
+class ShiftRegisterBackend(GpioBackend):
+	""" Drives <led_count> LEDs on a chain of 74HC595 shift registers, LED i 
+		on output i of the chain: Q0 to Q7 of the first register are the 
+		LEDs 0 to 7, the next register continues with 8. Its "pins" are the 
+		outputs 0 to led_count - 1.
+		
+		Every frame is packed into a byte buffer and the whole chain is shifted 
+		out. Without <spi> the bits are clocked out on the pins <data> and 
+		<clock>, two frames per bit handed to the pin backend in one 
+		write_many call, followed by a pulse on <latch>. The pins 
+		are driven by <pin_backend>, the name of a backend or a backend opened 
+		for the pins (data, clock, latch), or (latch,) with SPI. With <spi>, a (bus, device) pair or an opened 
+		spidev.SpiDev, the buffer is sent in one transfer with data on MOSI 
+		and clock on SCLK. <latch> may then be None if the chip select line 
+		is wired to the latch, which copies the chain to the outputs when the 
+		transfer ends.
+	"""
+	name = 'shift'
+	# Bits of the data and clock lines in the frames of the pin backend.
+	DATA, CLOCK = 1, 2
+
+	def __init__(self, led_count, data=None, clock=None, latch=None, spi=None, pin_backend='auto'):
+		GpioBackend.__init__(self, range(led_count))
+		self.nbytes = (led_count + 7) // 8
+		self.levels = 0
+		self.lines = None
+		if spi is None and (data is None or clock is None or latch is None):
+			raise ValueError('The data, clock and latch pins are needed without SPI')
+		if isinstance(spi, tuple):
+			import spidev
+			self.spi = spidev.SpiDev()
+			self.spi.open(*spi)
+			self.spi.max_speed_hz = SHIFT_SPI_SPEED
+			self.spi.mode = 0
+		else:
+			self.spi = spi
+		# Pins of the pin backend, the latch is the last one.
+		pins = [data, clock, latch] if spi is None else [latch]
+		self.latch_bit = 1 << len(pins) - 1
+		if latch is not None:
+			if isinstance(pin_backend, GpioBackend):
+				self.lines = pin_backend
+			else:
+				self.lines = open_backend(pin_backend, pins)
+		# byte_masks[byte]: the 16 frames of the pin backend clocking out byte, 
+		# MSB first, packed as bytes.
+		self.byte_masks = []
+		for byte in range(256):
+			masks = bytearray()
+			for bit in range(7, -1, -1):
+				level = self.DATA if byte >> bit & 1 else 0
+				masks.extend((level, level | self.CLOCK))
+			self.byte_masks.append(bytes(masks))
+
+	def write(self, mask, changed):
+		self.levels = self.levels & ~changed | mask & changed
+		# The byte shifted out first ends up in the last register.
+		buf = self.levels.to_bytes(self.nbytes, 'big')
+		if self.spi is not None:
+			self.spi.writebytes2(buf)
+		else:
+			byte_masks = self.byte_masks
+			self.lines.write_many(b''.join([byte_masks[byte] for byte in buf]), self.DATA | self.CLOCK)
+		if self.lines is not None:
+			self.lines.write(self.latch_bit, self.latch_bit)
+			self.lines.write(0, self.latch_bit)
+
+	def close(self):
+		if self.spi is not None:
+			self.spi.close()
+		if self.lines is not None:
+			self.lines.close()
+
+
+class MockPwm(object):
+	""" PWM channel of the mock backend, records its changes. """
+	def __init__(self, backend, idx, freq):
+		self.backend = backend
+		self.idx = idx
+		self.record('freq', freq)
+
+	def record(self, event, value=None):
+		self.backend.pwm_events.append((time.monotonic(), self.idx, event, value))
+
+	def start(self, dc):
+		self.record('start', dc)
+
+	def stop(self):
+		self.record('stop')
+
+	def ChangeDutyCycle(self, dc):
+		self.record('dc', dc)
+
+	def ChangeFrequency(self, freq):
+		self.record('freq', freq)
+
+
+class MockBackend(GpioBackend):
+	""" Keeps the pin levels in memory. Every write is appended to self.frames
+		as (time.monotonic(), levels) with the levels of all pins as bitmask,
+		PWM changes to self.pwm_events as (time, idx, event, value).
+	"""
+	name = 'mock'
+	hardware_pwm = True
+
+	def __init__(self, pins):
+		GpioBackend.__init__(self, pins)
+		self.levels = 0
+		self.frames = []
+		self.pwm_events = []
+
+	def write(self, mask, changed):
+		self.levels = self.levels & ~changed | mask & changed
+		self.frames.append((time.monotonic(), self.levels))
+
+	def write_many(self, masks, changed):
+		now, levels = time.monotonic(), self.levels
+		for mask in masks:
+			levels = levels & ~changed | mask & changed
+			self.frames.append((now, levels))
+		self.levels = levels
+
+	def pwm(self, idx, freq):
+		return MockPwm(self, idx, freq)
+
+
+BACKENDS = {
+	'rpi': RPiGpioBackend,
+	'gpiod': GpiodBackend,
+	'mmap': MmapBackend,
+	'mock': MockBackend,
+}
+# Tried in this order by open_backend('auto').
+AUTO_BACKENDS = ('rpi', 'gpiod')
+
+
+def open_backend(name, pins, **options):
+	""" Open the backend <name> for <pins>. 'auto' tries AUTO_BACKENDS and
+		falls back to the mock backend if none of them works here.
+	"""
+	if name == 'auto':
+		for name in AUTO_BACKENDS:
+			try:
+				return BACKENDS[name](pins, **options)
+			except (ImportError, RuntimeError, OSError):
+				pass
+		print("No GPIO library found, the LEDs are simulated in memory.")
+		return MockBackend(pins)
+	if name not in BACKENDS:
+		raise ValueError('Unknown GPIO backend: {}'.format(name))
+	return BACKENDS[name](pins, **options)
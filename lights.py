@@ -1,10 +1,24 @@
 from __future__ import print_function
 
-import RPi.GPIO as GPIO
+import argparse
+import asyncio
+import concurrent.futures
 import time
 import math
+import os
 import random
-from itertools import chain, combinations
+
+import animations
+import frame_stream
+import gpio_backends
+import pattern_files
+import patterns
+import timing
+
+try:
+	raw_input
+except NameError:
+	raw_input = input
 
 
 # 1 Global Constants
@@ -18,6 +32,23 @@ GPIO_PIN_1 = 16
 GPIO_PIN_2 = 5
 GPIO_PIN_3 = 25
 GPIO_PIN_4 = 22
+PWM_FREQUENCY = 100
+# 'auto', 'rpi', 'gpiod' or 'mock', see gpio_backends. Set by the option --backend.
+GPIO_BACKEND = 'auto'
+# Refreshes per second of the render thread writing the frames to the pins, 
+# None to write every frame at once. Set by the option --render-rate.
+RENDER_RATE = None
+# 1.1.1 Shift registers
+# With SHIFT_REGISTER_LEDS > 0 the LEDs are on a chain of 74HC595 shift registers 
+# instead of the pins GPIO_PIN_x. Set by the option --shift-register.
+SHIFT_REGISTER_LEDS = 0
+SHIFT_DATA_PIN = 10
+SHIFT_CLOCK_PIN = 11
+SHIFT_LATCH_PIN = 8
+# (bus, device) to send the chain over SPI instead, None to clock it out on the pins.
+# With SPI, data goes to MOSI (GPIO 10), clock to SCLK (GPIO 11) and the chip 
+# select CE0 (GPIO 8) is the latch.
+SHIFT_SPI = None
 
 # 1.2 Game related
 GAME_SHOW_DELAY = 0.5
@@ -26,9 +57,24 @@ GAME_INPUT_DELAY = 0.25
 GAME_SPEED_RECIPROCALS = [0.75, 1, 1.35, 1.8]
 # 1.2.2 Another Game
 TIME_DECREASE_TABLE = [1.25, 1.1, 0.9, 0.8, 0.75, 0.7, 0.6, 0.5, 0.45, 0.4, 0.3, 0.2, 0, 0, 0, 0]
+# Rounds of the multiplayer Reaction Race.
+RACE_ROUNDS = 5
+# 1.2.3 Led Pattern Repeater
+# The last recorded pattern is kept in this file next to lights.py, wherever 
+# it is started from, see pattern_files.
+PATTERN_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pattern.ledp')
+# 1.2.4 Binary Calculator
+# Bits of the numbers, the number of LEDs for None. Set by the option 
+# --calculator-bits.
+CALCULATOR_BITS = None
+# While a trigger is held, the step between two numbers doubles after this 
+# many steps, up to a sixteenth of the range of numbers. 
+SCROLL_DOUBLING_STEPS = 3
+# While the triggers are pressed less than this together, the step is 1 
+# again, to fine-tune the number without letting go.
+SCROLL_FINE_PRESSURE = 0.5
 
 # 1.3 Miscellaneous
-INPUT_LOOP_DELAY = 0.01
 STD_DELAY = 0.3
 # The following constant is the smallest value x, that makes sense in
 # ```	ledc.phase([...])
@@ -36,33 +82,202 @@ STD_DELAY = 0.3
 # As rightTrigger is always <= 1, this is always >= 0.05. For smaller values, the  
 # LED won't appear as blinking but as always on and dimmed.
 NO_GOOD_NAME_CONSTANT = 1.05 
+# Trigger values below this count as released in the gamepad menu.
+TRIGGER_THRESHOLD = 0.05
+# Gamepad buttons of the LEDs, in the order of the LED indices.
+LED_BUTTONS = ('A', 'B', 'X', 'Y')
+# timing.LatencyTracer, set by the option --trace-latency.
+TRACER = None
+# File recording the gamepad input, set by the option --record. 
+RECORD_FILE = None
+# Recording played instead of the gamepad input and its speed, set by the 
+# options --replay and --replay-speed. See xbox.replay.
+REPLAY_FILE = None
+REPLAY_SPEED = 1.0
+# Read the gamepad in a helper process, see xbox.SharedJoystick. Set by the 
+# option --reader-process.
+READER_PROCESS = False
+# Number of gamepads, one per player, set by the option --players. With more 
+# than one, GAMEPADS is the xbox.JoystickGroup reading all of them.
+PLAYERS = 1
+GAMEPADS = None
+
+
+class PwmPool(object):
+	""" One PWM channel per pin, created by the GPIO backend on first use and 
+		kept for the whole process. A pin is switched between digital and PWM 
+		output by starting and stopping its channel, no GPIO.cleanup() needed.
+		Channels are addressed by LED index.
+	"""
+	def __init__(self, backend, freq=PWM_FREQUENCY):
+		self.backend = backend
+		self.freq = freq
+		self.channels = {}
+		self.freqs = {}
+		self.duty_cycles = {}
+		# Bitmask of the LEDs currently driven by PWM.
+		self.active_mask = 0
+		
+	def channel(self, idx, freq=None):
+		""" PWM channel of LED <idx>, <freq> defaults to the channel's current 
+			frequency.
+		"""
+		pwm = self.channels.get(idx)
+		if pwm is None:
+			freq = freq or self.freq
+			pwm = self.channels[idx] = self.backend.pwm(idx, freq)
+			self.freqs[idx] = freq
+		elif freq and self.freqs[idx] != freq:
+			pwm.ChangeFrequency(freq)
+			self.freqs[idx] = freq
+		return pwm
+		
+	def set(self, idx, dc, freq=None):
+		""" Drive LED <idx> with duty cycle <dc> (0 to 100). """
+		pwm = self.channel(idx, freq)
+		if not self.active_mask >> idx & 1:
+			pwm.start(dc)
+			self.active_mask |= 1 << idx
+		elif self.duty_cycles[idx] != dc:
+			pwm.ChangeDutyCycle(dc)
+		self.duty_cycles[idx] = dc
+		
+	def set_many(self, duty_cycles):
+		""" Change the duty cycles of several channels at once, 
+			<duty_cycles> maps LED indices to duty cycles.
+		"""
+		for idx, dc in duty_cycles.items():
+			self.set(idx, dc)
+			
+	def set_all(self, dc):
+		self.set_many(dict((idx, dc) for idx in range(len(self.backend.pins))))
+		
+	def release(self, idx):
+		""" Stop the channel of LED <idx>, the pin is a digital output again. """
+		if self.active_mask >> idx & 1:
+			self.channels[idx].stop()
+			self.active_mask &= ~(1 << idx)
+			del self.duty_cycles[idx]
+			
+	def close(self):
+		for idx in list(self.duty_cycles):
+			self.release(idx)
 
 
 class LedControllerBase(object):
-	def __init__(self, *args):
+	""" Frames are integer bitmasks: bit i set means the LED plugged to 
+		self.pins[i] is on. The last frame written is kept in self.frame, so 
+		every new frame only touches the pins whose state actually changed.
+		The pins are driven by a backend of gpio_backends, opened from 
+		GPIO_BACKEND unless one is passed as <backend>. After start_render(),
+		frames go to a timing.FrameBuffer and writing one never waits for 
+		the GPIO output.
+	"""
+	def __init__(self, *args, backend=None):
 		self.pins = [a for a in args]
 		self.led_indices = list(range(len(self.pins)))
+		# pin number -> index in self.pins, computed once
+		self.pin_index = dict((p, i) for i, p in enumerate(self.pins))
+		self.all_mask = (1 << len(self.pins)) - 1
+		self.gpio_writes = 0
+		self.gpio_writes_avoided = 0
+		self.scheduler = timing.DeadlineScheduler()
+		self.backend = backend or gpio_backends.open_backend(GPIO_BACKEND, self.pins)
+		self.pwm = PwmPool(self.backend)
+		self.frame_buffer = None
 		self.post_init()
 		
+	@classmethod
+	def with_shift_register(cls, led_count, data=SHIFT_DATA_PIN, clock=SHIFT_CLOCK_PIN, latch=SHIFT_LATCH_PIN, 
+							spi=None, pin_backend=None):
+		""" Controller of <led_count> LEDs on a chain of shift registers, see 
+			gpio_backends.ShiftRegisterBackend. Its pins are the outputs of 
+			the chain.
+		"""
+		backend = gpio_backends.ShiftRegisterBackend(led_count, data, clock, latch, spi=spi, 
+													 pin_backend=pin_backend or GPIO_BACKEND)
+		return cls(*backend.pins, backend=backend)
+		
 	def post_init(self):
-		# Call GPIO pins via their number.
-		GPIO.setmode(GPIO.BCM)
-
-		# Set direction and frequency of pins.
-		for p in self.pins:
-			GPIO.setup(p, GPIO.OUT)		
-			
+		# State of the pins is unknown, the next frame writes all of them.
+		self.frame = None
+		# Swap number of the last frame handed to the render thread, see write_time.
+		self.frame_swap = None
+		
+	def start_render(self, rate=timing.RENDER_RATE):
+		""" Write frames to the pins from a render thread, <rate> times per 
+			second, instead of in write_frame.
+		"""
+		if self.frame_buffer is None:
+			self.frame_buffer = timing.FrameBuffer(self.backend, rate, lambda: self.pwm.active_mask, TRACER)
+			if self.frame is not None:
+				self.frame_swap = self.frame_buffer.show(self.frame)
 			
+	def stop_render(self):
+		""" Stop the render thread, frames are written at once again. """
+		if self.frame_buffer is not None:
+			self.frame_buffer.close()
+			# Count the pins the render thread wrote like those of write_frame.
+			self.gpio_writes += self.frame_buffer.pin_writes
+			self.gpio_writes_avoided += self.frame_buffer.pin_writes_avoided
+			self.frame_buffer = None
 			
+	def code_to_mask(self, code):
+		""" Turn a list of LED indices into a frame bitmask. """
+		mask = 0
+		for idx in code:
+			mask |= 1 << idx
+		return mask & self.all_mask
+		
+	def write_frame(self, mask):
+		""" Show the frame <mask>, writing only the pins that changed since 
+			the last frame.
+		"""
+		mask &= self.all_mask
+		diff = self.all_mask if self.frame is None else mask ^ self.frame
+		self.frame = mask
+		if self.frame_buffer is not None:
+			# The render thread writes it, leaving out the PWM pins itself, 
+			# and counts and traces the pin writes.
+			if diff:
+				self.frame_swap = self.frame_buffer.show(mask)
+				if TRACER is not None and diff & ~self.pwm.active_mask:
+					self.frame_buffer.trace(self.frame_swap)
+			else:
+				self.gpio_writes_avoided += len(self.pins)
+			return
+		# Pins driven by PWM keep their duty cycle until released.
+		diff &= ~self.pwm.active_mask
+		written = bin(diff).count('1')
+		if written:
+			self.backend.write(mask, diff)
+		if TRACER is not None and written:
+			TRACER.mark('write')
+		self.gpio_writes += written
+		self.gpio_writes_avoided += len(self.pins) - written
+		
+	def write_time(self, swap, write_from, write_to):
+		""" (start, end) of the time.monotonic() times between which a frame 
+			reached the pins, given the times <write_from> and <write_to> 
+			around its write_frame call and the self.frame_swap after it. With a 
+			render thread that is the refresh which wrote the frame, until 
+			then from <write_from> to now.
+		"""
+		if self.frame_buffer is None or swap is None:
+			return write_from, write_to
+		written = self.frame_buffer.write_time(swap)
+		if written is None:
+			return write_from, max(write_to, time.monotonic())
+		return written
+		
 	def phase(self, code, delay=0):		
 		""" Core method of the hole script: Light up all specified LEDs.
 			<code> is a list of numbers corresponding to the indices of the list self.pins, 
 			i.e. 1 correspondes to the LED plugged to GPIO_PIN_2 
 		"""
-		status = [GPIO.HIGH if self.pins.index(p) in code else GPIO.LOW for p in self.pins]
-		map(lambda a: GPIO.output(*a), zip(self.pins, status))
+		self.write_frame(self.code_to_mask(code))
 		if delay:
-			time.sleep(delay)
+			self.scheduler.sleep(delay)
 		
 	def phase2(self, code, delay=0, independent=False, rev=False, inv=False, stop=False):		
 		""" [skip this on first read] More sophisticated version of phase.
@@ -74,78 +289,110 @@ class LedControllerBase(object):
 			is set to True.
 			
 		"""
-		status_A = GPIO.HIGH
-		status_B = GPIO.LOW
-		if rev:
-			# , then interchange the stati.
-			C = status_B
-			status_B = status_A
-			status_A = C
+		mask = self.code_to_mask(code)
 		if inv:
 			# , then reset code to its difference with all pins.
-			code = list(set(self.led_indices).difference(code))
-			
-		# Prepare list of lists, each holding a pin number and its desired status.
-		if independent:
-			status = [status_A for idx in code]
-			pin_status = zip([p for p in self.pins if self.pins.index(p) in code], status)
-		else:
-			status = [status_A if self.pins.index(p) in code else status_B for p in self.pins]
-			pin_status = zip(self.pins, status)
-			
-		# Set GPIO pin stati.
-		map(lambda a: GPIO.output(*a), pin_status)
+			mask ^= self.all_mask
+		self.phase2_mask(mask, independent=independent, rev=rev)
 		# Optionally sleep and stop.
 		if delay:
-			time.sleep(delay)
+			self.scheduler.sleep(delay)
 		if stop:
-			self.phase2(code, independent=independent, rev=True, inv=inv)
+			self.phase2_mask(mask, independent=independent, rev=True)
 			
+	def phase2_mask(self, mask, independent=False, rev=False):
+		""" phase2 on a bitmask, after <inv> has been applied. """
+		if independent:
+			current = self.frame or 0
+			self.write_frame(current & ~mask if rev else current | mask)
+		else:
+			self.write_frame(mask ^ self.all_mask if rev else mask)
 			
-	def blink(self, code, rounds=1, delay1=STD_DELAY, delay2=-1):
-		for i in range(rounds):
-			self.phase(code, delay=delay1)
-			self.stop()
-			time.sleep(delay2 if delay2 >= 0 else delay1)
+			
+	def animation(self, mode, **params):
+		""" Compiled timeline of one of the modes, see animations.compile_animation. """
+		return animations.compile_animation(mode, len(self.pins), **params)
+		
+	def play(self, timeline):
+		""" Show the frames of a compiled timeline at their offsets. """
+		self.scheduler.run(timeline, self.write_frame)
+		return time.time()
+		
+	async def play_async(self, timeline):
+		""" Coroutine version of play, cancelling it stops at the current frame. """
+		await self.scheduler.run_async(timeline, self.write_frame)
 		return time.time()
 		
+	def stream(self, pattern):
+		""" Play a lazy pattern of (duration, mask) frames, see patterns. """
+		self.scheduler.stream(pattern, self.write_frame)
+		return time.time()
 		
-	def phase_blink(self, code_phase, code_blink, delay=0, rounds=1, delay1=STD_DELAY, delay2=-1):
-		self.phase(code_phase, delay=delay)
+	async def stream_async(self, pattern):
+		await self.scheduler.stream_async(pattern, self.write_frame)
+		return time.time()
+		
+	async def phase_async(self, code, delay=0):
+		self.write_frame(self.code_to_mask(code))
+		if delay:
+			await self.scheduler.sleep_async(delay)
+		
+	def blink_timeline(self, code, rounds=1, delay1=STD_DELAY, delay2=-1):
+		return self.animation('blink', code=self.code_to_mask(code), rounds=rounds, 
+								delay=delay1, delay2=delay2 if delay2 >= 0 else delay1)
+		
+	def blink(self, code, rounds=1, delay1=STD_DELAY, delay2=-1):
+		return self.play(self.blink_timeline(code, rounds, delay1, delay2))
+		
+	async def blink_async(self, code, rounds=1, delay1=STD_DELAY, delay2=-1):
+		return await self.play_async(self.blink_timeline(code, rounds, delay1, delay2))
+		
+	def phase_blink_timeline(self, code_phase, code_blink, delay=0, rounds=1, delay1=STD_DELAY, delay2=-1):
+		""" Show <code_phase> for <delay>, then blink <code_blink> on top of it. """
+		base, blink = self.code_to_mask(code_phase), self.code_to_mask(code_blink)
 		delay2 = delay2 if delay2 >= 0 else delay1
-		for i in range(rounds):
-			self.phase2(code_blink, delay=delay1, independent=True)
-			self.phase2(code_blink, delay=delay2, independent=True, rev=True)
+		masks = [base] + [base | blink, base & ~blink] * rounds
+		holds = [delay] + [delay1, delay2] * rounds
+		return animations.compile_frames(masks, holds, len(self.pins))
+		
+	def phase_blink(self, code_phase, code_blink, delay=0, rounds=1, delay1=STD_DELAY, delay2=-1):
+		return self.play(self.phase_blink_timeline(code_phase, code_blink, delay, rounds, delay1, delay2))
+		
+	async def phase_blink_async(self, code_phase, code_blink, delay=0, rounds=1, delay1=STD_DELAY, delay2=-1):
+		return await self.play_async(self.phase_blink_timeline(code_phase, code_blink, delay, rounds, delay1, delay2))
 	
-	def start_pwm(self, code, freq=100):
+	def start_pwm(self, code, freq=PWM_FREQUENCY):
+		""" Switch the first LED of <code> to PWM output. Returns its index, 
+			which is the handle for dimm and stop_pwm.
+		"""
 		idx = code[0]
-		pwm_pin = GPIO.PWM(self.pins[idx], freq)
-		pwm_pin.start(0)
-		return pwm_pin
+		self.pwm.set(idx, 0, freq)
+		return idx
 		
-	def dimm(self, pwm_pin, delay=0.1, freq=100, dc=50):
+	def dimm(self, pwm_pin, delay=0.1, freq=None, dc=50):
 		# before a call to dimm: pwm_pin = self.start_pwm(code=code, freq=freq)	
-		pwm_pin.ChangeDutyCycle(dc)
+		self.pwm.set(pwm_pin, dc, freq)
 		time.sleep(delay)
 		# after the call: self.stop_pwm(pwm_pin)
 		
 	def stop_pwm(self, pwm_pin):
-		pwm_pin.stop()
-		GPIO.cleanup()
-		self.post_init()
+		""" Switch the LED back to digital output, restoring its frame state. """
+		self.pwm.release(pwm_pin)
+		if self.frame_buffer is not None:
+			self.frame_buffer.invalidate(1 << pwm_pin)
+		elif self.frame is not None:
+			self.backend.write(self.frame, 1 << pwm_pin)
+			self.gpio_writes += 1
 				
-	def disco_mode(self, rounds=100):
+	def disco_mode(self, rounds=100, seed=None, density=None, max_lit=None):
 		""" Chose a subset of all pin indices randomly and phase them for 
-			a random amount of time.
+			a random amount of time. <seed> repeats a show, <density> and 
+			<max_lit> weight the subsets, see animations.RandomFrames.
 		"""
-		comb = list(chain.from_iterable(combinations(self.led_indices, r) for r in range(len(self.led_indices))))
-		#comb = [[], [0], [1], [2], [3], [0, 1], [0, 2], [0, 3], [1, 2], [1, 3], [2, 3], [0, 1, 2], [1, 2, 3], [0, 2, 3], [0, 1, 3]] for 4 pins
-		for i in range(rounds):
-			s = random.random()	
-			code = random.choice(comb)		
-			self.phase(code, 0.2*s)
-		self.stop()
-		return time.time()
+		return self.play(self.animation('disco', rounds=rounds, seed=seed, density=density, max_lit=max_lit))
+		
+	async def disco_mode_async(self, rounds=100, seed=None, density=None, max_lit=None):
+		return await self.play_async(self.animation('disco', rounds=rounds, seed=seed, density=density, max_lit=max_lit))
 		
 	
 	def raupe(self, delay=STD_DELAY, rounds=20, rev=False):
@@ -155,13 +402,10 @@ class LedControllerBase(object):
 			previous one off and the next one on.
 			<rev> ... from right to left
 		"""
-		pc = len(self.pins)
-		for i in range(rounds):
-			for j in range(pc):
-				self.phase([j]) if not(rev) else self.phase([pc-j-1])
-				time.sleep(delay)
-		self.stop()
-		return time.time()
+		return self.play(self.animation('raupe', delay=delay, rounds=rounds, rev=rev))
+		
+	async def raupe_async(self, delay=STD_DELAY, rounds=20, rev=False):
+		return await self.play_async(self.animation('raupe', delay=delay, rounds=rounds, rev=rev))
 						
 	
 	def progress_mode(self, delay=0.3, rounds=1, rev=False, inv=False):
@@ -170,228 +414,462 @@ class LedControllerBase(object):
 			<rev> ... from right to left
 			<inv> Successively switch off LEDs
 		"""
-		pc = len(self.pins)
-		for i in range(rounds):
-			for j in range(pc):
-				if inv:
-					j = pc-j
-				else:					
-					j=j+1	
-				self.phase(list(range(j))) if not(rev) else self.phase([pc-k-1 for k in range(j)])
-				time.sleep(delay)
-		self.stop()
-		return time.time()
+		return self.play(self.animation('progress', delay=delay, rounds=rounds, rev=rev, inv=inv))
+		
+	async def progress_mode_async(self, delay=0.3, rounds=1, rev=False, inv=False):
+		return await self.play_async(self.animation('progress', delay=delay, rounds=rounds, rev=rev, inv=inv))
 		
 		
 	def stop(self):
 		""" All pins LOW 
-			Equivalent to self.phase2(self.pins, rev=True)
+			Equivalent to self.phase2(self.led_indices, independent=True, rev=True)
 		"""
-		for p in self.pins:
-			GPIO.output(p, GPIO.LOW)
+		self.write_frame(0)
 	
 	# More ideas for blinking patterns:
 	# 	alternate blink: code1, code2 -> alternate phase(code1) and phase(code2)
 	#	beat/disco: blink with a given bpm
 	
 	
+	def test_modes(self):
+		""" Name and timeline of every mode shown by test. """
+		return [
+			("LedControllerBase.raupe(rounds=2)", self.animation('raupe', rounds=2)),
+			("LedControllerBase.raupe(rounds=2, rev=True)", self.animation('raupe', rounds=2, rev=True)),
+			("LedControllerBase.progress_mode(rounds=2)", self.animation('progress', rounds=2)),
+			("LedControllerBase.progress_mode(rounds=2, rev=True)", self.animation('progress', rounds=2, rev=True)),
+			("LedControllerBase.progress_mode(rounds=2, inv=True)", self.animation('progress', rounds=2, inv=True)),
+			("LedControllerBase.progress_mode(rounds=2, rev=True, inv=True)", self.animation('progress', rounds=2, rev=True, inv=True)),
+			("LedControllerBase.disco_mode(rounds=20)", self.animation('disco', rounds=20)),
+		]
+		
 	def test(self):
 		print("Showing all modes")
-		delay=0.5
-		print("LedControllerBase.raupe(rounds=2)")
-		self.raupe(rounds=2)
-		time.sleep(delay)
-		print("LedControllerBase.raupe(rounds=2, rev=True)")
-		self.raupe(rounds=2, rev=True)
-		time.sleep(delay)
-		print("LedControllerBase.progress_mode(rounds=2)")
-		self.progress_mode(rounds=2)
-		time.sleep(delay)
-		print("LedControllerBase.progress_mode(rounds=2, rev=True)")
-		self.progress_mode(rounds=2, rev=True)
-		time.sleep(delay)
-		print("LedControllerBase.progress_mode(rounds=2, inv=True)")
-		self.progress_mode(rounds=2, inv=True)
-		time.sleep(delay)
-		print("LedControllerBase.progress_mode(rounds=2, rev=True, inv=True)")
-		self.progress_mode(rounds=2, rev=True, inv=True)
-		time.sleep(delay)
-		print("LedControllerBase.disco_mode(rounds=20)")
-		self.disco_mode(rounds=20)
+		for i, (name, timeline) in enumerate(self.test_modes()):
+			if i:
+				time.sleep(0.5)
+			print(name)
+			self.play(timeline)
+			
+	async def test_async(self):
+		print("Showing all modes")
+		for i, (name, timeline) in enumerate(self.test_modes()):
+			if i:
+				await asyncio.sleep(0.5)
+			print(name)
+			await self.play_async(timeline)
 	
 
 class LedGameController(LedControllerBase):
 	def __init__(self, *args):
 		super(LedGameController, self).__init__(*args)
 
-class LedPatternRepeater(object):
-	""" Create a pattern and show it.
+def held_leds(joy):
+	""" Indices of the LEDs whose gamepad buttons are held down right now. """
+	buttons = joy.snapshot().buttons
+	if TRACER is not None:
+		TRACER.mark('decide')
+	return [i for i, b in enumerate(LED_BUTTONS) if buttons & xbox.BUTTON_BITS[b]]
+	
+def picked_leds(joy, since):
+	""" LEDs picked with the gamepad buttons after the time <since>, taken from 
+		the joystick's input history. Returns one list of LED indices per button 
+		press, so a fast double tap counts twice, and the time to pass as <since> 
+		on the next call.
+	"""
+	timed, until = timed_picks(joy, since)
+	return [pick for t, pick in timed], until
+	
+def timed_picks(joy, since):
+	""" Like picked_leds, with every pick as (t, pick): <t> is the xbox.clock() 
+		time the line of the button press was read.
 	"""
+	joy.refresh()
+	until = joy.history.latest()
+	picks = []
+	for t, pressed, released in joy.history.transitions(since, until):
+		pick = [i for i, b in enumerate(LED_BUTTONS) if pressed & xbox.BUTTON_BITS[b]]
+		if pick:
+			picks.append((t, pick))
+	if TRACER is not None and picks:
+		TRACER.mark('decide')
+	return picks, until
+	
+def reaction_time(joy, lit_from, lit_at, pressed_at):
+	""" Time between an LED lighting up and the button press answering it, as 
+		(seconds, uncertainty in seconds). The LED lit up while it was written 
+		between the xbox.clock() times <lit_from> and <lit_at>, the line of the 
+		press was read at <pressed_at>. The press itself happened up to 
+		xbox.INPUT_RESOLUTION before the line was sent, and the line may have 
+		waited in the pipe since the line read before it, e.g. while the loop 
+		was writing the LEDs or sleeping.
+	"""
+	earliest = pressed_at - xbox.INPUT_RESOLUTION
+	read_before = joy.history.before(pressed_at)
+	if read_before is not None:
+		earliest = min(earliest, read_before - xbox.INPUT_RESOLUTION)
+	longest = pressed_at - lit_from
+	shortest = max(0.0, earliest - lit_at)
+	return (longest + shortest) / 2, (longest - shortest) / 2
+	
+	
+# 2 Asyncio runtime
+# The gamepad is read by the event loop (see xbox.Joystick.attach), games and 
+# animations are coroutines. Nothing polls: coroutines sleep until the next 
+# gamepad input or their next deadline.
+
+class BackPressed(Exception):
+	""" Raised by run_until_back when Back cancelled the coroutine. """
+	
+async def wait_input(joy, timeout=None):
+	""" Sleep until the gamepad state changes or <timeout> seconds passed. """
+	if timeout is not None and timeout <= 0:
+		return
+	try:
+		await asyncio.wait_for(asyncio.shield(joy.nextState()), timeout)
+	except asyncio.TimeoutError:
+		pass
+		
+async def wait_players(gamepads, timeout=None):
+	""" wait_input for an attached xbox.JoystickGroup: sleep until the gamepad 
+		of any player changes or <timeout> seconds passed.
+	"""
+	if timeout is not None and timeout <= 0:
+		return
+	try:
+		await asyncio.wait_for(asyncio.shield(gamepads.nextChange()), timeout)
+	except asyncio.TimeoutError:
+		pass
+		
+async def wait_release(joy, button):
+	while joy.snapshot().pressed(button):
+		await wait_input(joy)
+		
+async def run_until_back(joy, coro, enabled=None):
+	""" Run the coroutine <coro> and return its result. Pressing Back cancels it 
+		immediately, even in the middle of an animation, and raises BackPressed. 
+		Back is ignored while the optional function <enabled> returns False.
+	"""
+	task = asyncio.ensure_future(coro)
+	back = False
+	try:
+		while not task.done():
+			if joy.Back() and (enabled is None or enabled()):
+				if TRACER is not None:
+					TRACER.mark('decide')
+				back = True
+				task.cancel()
+				break
+			await asyncio.wait([task, asyncio.shield(joy.nextState())], return_when=asyncio.FIRST_COMPLETED)
+	finally:
+		if not task.done():
+			task.cancel()
+	try:
+		return await task
+	except asyncio.CancelledError:
+		if back:
+			raise BackPressed()
+		raise
+		
+		
+class LedGame(object):
+	""" Base class of the gamepad games. play() is the game itself, run() plays 
+		it until it ends or the player presses Back and returns the score.
+	"""
+	name = "Game"
+	
 	def __init__(self, led_controller, joystick):
 		self.LEDC = led_controller
 		self.joy = joystick
-		self.pattern = []
+		self.score = None
+		# LEDs that have a gamepad button, see LED_BUTTONS.
+		self.leds = led_controller.led_indices[:len(LED_BUTTONS)]
+		# Set to False while the game uses Back itself.
+		self.back_cancels = True
 		
-	def show_pattern(self):
-		for pat in self.pattern:
-			self.LEDC.phase2(pat[0], delay=pat[1], independent=True)
-		self.LEDC.stop()
+	async def play(self):
+		raise NotImplementedError
+		
+	async def close(self):
+		""" Shown after Back ended the game. """
+		print("Closing {}...".format(self.name))
+		await self.LEDC.progress_mode_async(inv=True)
+		
+	async def run(self):
+		try:
+			return await run_until_back(self.joy, self.play(), lambda: self.back_cancels)
+		except BackPressed:
+			await self.close()
+			return self.score
+		finally:
+			await wait_release(self.joy, 'Back')
+	
+	
+class LedPatternRepeater(LedGame):
+	""" Create a pattern and show it.
+	"""
+	name = "Led Pattern Repeater"
+	
+	def __init__(self, led_controller, joystick):
+		super(LedPatternRepeater, self).__init__(led_controller, joystick)
+		# pattern_files.PatternFile of the last recording, None if there is none.
+		try:
+			self.pattern = pattern_files.open_pattern(PATTERN_FILE)
+		except ValueError as e:
+			print(e)
+			self.pattern = None
 		
-	def define_pattern(self):
+	def save_pattern(self, masks, times):
+		""" Store the frames masks[i], shown from times[i] to times[i+1], in 
+			PATTERN_FILE and load it as the current pattern.
+		"""
+		holds = [end - start for start, end in zip(times, times[1:])]
+		pattern_files.write_pattern(PATTERN_FILE, masks[:len(holds)] + [0], holds + [0], len(self.LEDC.pins))
+		if self.pattern is not None:
+			self.pattern.close()
+		self.pattern = pattern_files.PatternFile(PATTERN_FILE)
+		
+	async def define_pattern(self):
+		""" Records the LEDs picked with A, B, X and Y until Back is pressed. 
+			Changes are timed with the time their gamepad line was read.
+		"""
 		print("Please define your new pattern by pressing A, B, X and Y buttons")
 		ledc, joy = self.LEDC, self.joy
-		pattern = []
-		change_pick = []
-		start_pause = time.time()
-		while 1:
-			
-			if self.joy.Back():
-				self.pattern = pattern
-				print("Saved new pattern:")
-				print(self.pattern)
-				ledc.progress_mode()
-				return
+		pick = held_leds(joy)
+		masks, times = [ledc.code_to_mask(pick)], [xbox.clock()]
+		self.back_cancels = False
+		try:
+			while not joy.Back():
+				await wait_input(joy)
+				change_pick = held_leds(joy)
+				if change_pick != pick:
+					masks.append(ledc.code_to_mask(change_pick))
+					times.append(joy.snapshot().time)
+					pick = change_pick
+					ledc.phase(pick)
+					print(pick)
+			times.append(joy.snapshot().time)
+			self.save_pattern(masks, times)
+			print("Saved new pattern to {}: {} frames, {:.2f} s".format(PATTERN_FILE, len(self.pattern), self.pattern.duration))
+			await ledc.progress_mode_async()
+			await wait_release(joy, 'Back')
+		finally:
+			self.back_cancels = True
 			
-			inpt = [joy.A(), joy.B(), joy.X(), joy.Y()]
-			pick = [inpt.index(el) for el in inpt if el]
-			
-			ledc.phase2(pick, independent=True)					
-					
-			if pick:
-				print(pick)
-				end_pause = time.time()
-				pattern.append([[], end_pause-start_pause])
-				start_time = time.time()
-				while 1:
-					change_inpt = [joy.A(), joy.B(), joy.X(), joy.Y()]
-					change_pick = [change_inpt.index(el) for el in change_inpt if el]
-					
-					if change_pick != pick:
-						if change_pick:
-							ledc.phase2(change_pick, independent=True)
-						else:
-							ledc.stop()
-						print(change_pick)
-						end_time = time.time()
-						pattern.append([pick, end_time-start_time])
-						start_pause = time.time()
-						break
-					time.sleep(INPUT_LOOP_DELAY)
-		
-			time.sleep(INPUT_LOOP_DELAY) 
+	async def run(self):
+		try:
+			return await super(LedPatternRepeater, self).run()
+		finally:
+			# Unmap the pattern file, the next game opens it again.
+			if self.pattern is not None:
+				self.pattern.close()
+				self.pattern = None
 		
-	def run(self):
+	async def play(self):
 		
 		ledc, joy = self.LEDC, self.joy
-		ledc.progress_mode()
-		time.sleep(0.5)
+		await ledc.progress_mode_async()
+		await asyncio.sleep(0.5)
 		while 1:
-			if self.joy.Back():
-				ledc.progress_mode(inv=True)
-				return
-			
-			elif self.joy.dpadDown():
-				self.define_pattern()
+			if joy.dpadDown():
+				await self.define_pattern()
 				
-			elif self.joy.dpadUp():
-				if self.pattern:
-					self.show_pattern()
+			elif joy.dpadUp():
+				if self.pattern is not None:
+					await ledc.play_async(self.pattern)
 				else:
-					self.LEDC.test()
-					
-			time.sleep(INPUT_LOOP_DELAY)
+					await ledc.test_async()
+			else:	
+				await wait_input(joy)
 		
 	
-class AnotherGame():
+class AnotherGame(LedGame):
 	""" Each round is composed of five turns. In each turn, after a random time, 
 		one of the LEDs will light up. The player then has a certain amount of time, 
 		to press the gamepad button that corresponds to the LED. In each round the maximum response 
 		time for the player is decreased by a thenth of a second. 
 	"""
+	name = "Another Game"
+	
 	def __init__(self, led_controller, joystick):
-		self.LEDC = led_controller
-		self.joy = joystick
+		super(AnotherGame, self).__init__(led_controller, joystick)
 		self.turns_per_round = 4
 		self.time_decrease_table = TIME_DECREASE_TABLE
+		# (seconds, uncertainty) of every answer, see reaction_time
+		self.reaction_times = []
 	
 	def forge_sequence(self):
 		seq=[]
 		pause = []
 		for i in range(self.turns_per_round):
-			p = random.choice(self.LEDC.led_indices)
+			p = random.choice(self.leds)
 			seq.append(p)
 			q = 0.3 + random.random() * 5
 			pause.append(q)
-		return zip(seq, pause)
+		return list(zip(seq, pause))
 	
 		
-	def run(self):
+	async def play(self):
 		
 		ledc, joy = self.LEDC, self.joy
 		N = 0
-		ledc.progress_mode()
-		time.sleep(0.5)
+		await ledc.progress_mode_async()
+		await asyncio.sleep(0.5)
 		while 1:			
+			self.score = N
 			seq_pause = self.forge_sequence()
-			ledc.blink(ledc.led_indices, rounds=N)
-			time.sleep(0.5)
+			await ledc.blink_async(ledc.led_indices, rounds=N)
+			await asyncio.sleep(0.5)
 			for t in range(self.turns_per_round):
 				secret, pause = seq_pause[t]
-				checked = False
-				#old_pick = 0
-				pick = []
-				ledc.blink(list(range(t+1)), rounds=3)
+				await ledc.blink_async(list(range(t+1)), rounds=3)
 				ledc.stop()
-				time.sleep(pause)
+				await asyncio.sleep(pause)
+				# The turn is timed on the clock of the gamepad input: from the 
+				# GPIO write to the time the line of the press was read.
+				lit_from = xbox.clock()
 				ledc.phase([secret])
-				start_time = time.time()
+				lit_at = xbox.clock()
+				lit_swap = ledc.frame_swap
+				deadline = lit_at + TIME_DECREASE_TABLE[N] + GAME_INPUT_DELAY
+				since = joy.history.latest()
 				while 1:
 					# responding turn
-					# wait for input, if any show it. If gamepad button is released, check the guess.
-					if self.joy.Back():
-						ledc.progress_mode(inv=True)
-						return N
-				
-					if time.time() > start_time + TIME_DECREASE_TABLE[N] + 0.25:						
-						print("Time is up!")
-						ledc.disco_mode(rounds=20)
-						return N
-												
-					inpt = [joy.A(), joy.B(), joy.X(), joy.Y()]
-					pick = [inpt.index(el) for el in inpt if el] if not pick else pick #old_pick == pick else old_pick
-					
-					ledc.phase2(pick, independent=True)					
-							
-					if pick and not checked and not any([joy.A(), joy.B(), joy.X(), joy.Y()]):
-						print(str(pick[0]), end=", ")
-						checked = True
+					# wait for input, if any show it. The first button press is the guess.
+					ledc.phase2(held_leds(joy), independent=True)
+					picks, since = timed_picks(joy, since)
+					if picks and picks[0][0] <= deadline:
+						pressed_at, pick = picks[0]
+						# With a render thread the LED lit up on a later refresh.
+						written_from, written_at = ledc.write_time(lit_swap, lit_from, lit_at)
+						reaction, uncertainty = reaction_time(joy, written_from, written_at, pressed_at)
+						self.reaction_times.append((reaction, uncertainty))
+						print("{} ({:.1f} +- {:.1f} ms)".format(pick[0], 1e3 * reaction, 1e3 * uncertainty), end=", ")
 						if len(pick)==1 and secret==pick[0]:
-							checked = False
-							pick = []
 							break
 						else:
-							ledc.phase_blink([secret], [pick[0]], rounds=5)							
+							await ledc.phase_blink_async([secret], [pick[0]], rounds=5)							
 							print("You Lose")
-							self.LEDC.disco_mode(rounds=20)
+							await ledc.disco_mode_async(rounds=20)
 							return N
 					
-					#old_pick = pick
-					time.sleep(INPUT_LOOP_DELAY)
+					time_left = deadline - xbox.clock()
+					if picks or time_left < 0:
+						print("Time is up!")
+						await ledc.disco_mode_async(rounds=20)
+						return N
+					await wait_input(joy, time_left)
 				
 				ledc.stop()
 			print()
 			N = N+1
 				
-class BinaryCalculator():
-	""" Four LEDs are perfectly suited to show the binary numbers between 0001 and 1111. 
-		This class lets you calculate on this set of numbers.
+class ReactionRace(AnotherGame):
+	""" Another Game for 2 to 4 players, one gamepad each, read through the 
+		xbox.JoystickGroup <gamepads>. In each turn, after a random time, one of 
+		the LEDs lights up and the first player to press its button scores. A 
+		player whose first press is a wrong button is out of the turn. Presses 
+		are compared by the time their line was read, so it does not matter in 
+		which order the pipes were read. After RACE_ROUNDS rounds the LEDs of 
+		the players with the most points (LED 0 for player 1) blink. Back of 
+		player 1 ends the game.
 	"""
-	def __init__(self, led_controller, joystick):
-		self.LEDC = led_controller
-		self.joy = joystick
-		self.binary_number = [[], [0], [1], [0, 1], [2], [0,2], [1,2], [0,1,2], [3], [0,3], [1,3], [0,1,3], [2,3], [0,2,3], [1,2,3], [0,1,2,3]]
-		# Example: 7 = 1 + 2 + 4 = 2^0 * 2^1 * 2^2 = [0, 1, 2]
-		self.current_number = 0 # decimal system, i.e. corresponds to indices of self.binary_numbers
+	name = "Reaction Race"
+	
+	def __init__(self, led_controller, gamepads):
+		super(ReactionRace, self).__init__(led_controller, gamepads[0])
+		self.gamepads = gamepads
+		self.scores = [0] * len(gamepads)
+		
+	async def race(self, secret, since, deadline):
+		""" Player who pressed the button of LED <secret> first, after the 
+			history times <since> of the players and before <deadline>, and the 
+			time the line of the press was read. (None, None) if nobody did.
+		"""
+		gamepads = self.gamepads
+		out = set()
+		while 1:
+			first = None
+			for player in range(len(gamepads)):
+				if player in out:
+					continue
+				picks, since[player] = timed_picks(gamepads[player], since[player])
+				if picks and picks[0][0] <= deadline:
+					pressed_at, pick = picks[0]
+					if pick != [secret]:
+						out.add(player)
+					elif first is None or pressed_at < first[1]:
+						first = player, pressed_at
+			if first is not None:
+				return first
+			time_left = deadline - xbox.clock()
+			if time_left < 0 or len(out) == len(gamepads):
+				return None, None
+			await wait_players(gamepads, time_left)
+		
+	async def play(self):
+		ledc, gamepads = self.LEDC, self.gamepads
+		self.score = self.scores
+		await ledc.progress_mode_async()
+		await asyncio.sleep(0.5)
+		for N in range(RACE_ROUNDS):
+			seq_pause = self.forge_sequence()
+			await ledc.blink_async(ledc.led_indices, rounds=N)
+			await asyncio.sleep(0.5)
+			for t in range(self.turns_per_round):
+				secret, pause = seq_pause[t]
+				await ledc.blink_async(list(range(t+1)), rounds=3)
+				ledc.stop()
+				await asyncio.sleep(pause)
+				lit_from = xbox.clock()
+				ledc.phase([secret])
+				lit_at = xbox.clock()
+				lit_swap = ledc.frame_swap
+				deadline = lit_at + TIME_DECREASE_TABLE[N] + GAME_INPUT_DELAY
+				since = [joy.history.latest() for joy in gamepads]
+				winner, pressed_at = await self.race(secret, since, deadline)
+				ledc.stop()
+				if winner is None:
+					print("Nobody", end=", ")
+					await ledc.blink_async([secret], rounds=3, delay1=0.1)
+					continue
+				self.scores[winner] += 1
+				written_from, written_at = ledc.write_time(lit_swap, lit_from, lit_at)
+				reaction, uncertainty = reaction_time(gamepads[winner], written_from, written_at, pressed_at)
+				print("Player {} ({:.1f} +- {:.1f} ms)".format(winner + 1, 1e3 * reaction, 1e3 * uncertainty), end=", ")
+				await ledc.blink_async([winner % len(ledc.pins)], rounds=2)
+			print()
+			print("Points: " + ", ".join(str(points) for points in self.scores))
+		best = max(self.scores)
+		winners = [player for player, points in enumerate(self.scores) if points == best]
+		if len(winners) == 1:
+			print("Player {} wins!".format(winners[0] + 1))
+		else:
+			print("Draw between the players {}!".format(", ".join(str(player + 1) for player in winners)))
+		await ledc.blink_async([player % len(ledc.pins) for player in winners], rounds=5)
+		# Seeded from random like the turns, so a seeded race repeats exactly.
+		await ledc.disco_mode_async(rounds=20, seed=random.getrandbits(32))
+		return self.scores
+				
+class BinaryCalculator(LedGame):
+	""" The LEDs show a binary number, LED i the bit 2^i. This class lets you 
+		calculate on the numbers of <width> bits, modulo 2^width, by default of 
+		as many bits as there are LEDs: four LEDs the numbers between 0000 and 
+		1111, 8, 16 or 32 LEDs on shift registers numbers of as many bits. With 
+		fewer LEDs than bits, the LEDs show the lowest bits.
+	"""
+	name = "Binary Calculator"
+	
+	def __init__(self, led_controller, joystick, width=None):
+		super(BinaryCalculator, self).__init__(led_controller, joystick)
+		self.width = width or len(led_controller.pins)
+		self.modulus = 1 << self.width
+		# Example: 7 = 1 + 2 + 4 = 2^0 + 2^1 + 2^2, the frame 0b0111 lights LED 0, 1 and 2
+		self.current_number = 0
+		
+	def show_number(self):
+		""" The current number is the frame itself, cut to the LEDs. """
+		self.LEDC.write_frame(self.current_number)
 	
 	def str_op(self, op):
 		if op == 0:
@@ -405,14 +883,10 @@ class BinaryCalculator():
 		return op
 		
 	def str_num(self, num):
-		if num < 10:
-			num = ' {}'.format(num)
-		else:
-			num = str(num) 
-		return num
+		# Right aligned to the digits of the largest number.
+		return str(num).rjust(len(str(self.modulus - 1)))
 		
 	def calculate(self, a, b, op):
-		N = len(self.binary_number)
 		if op == 0:
 			c = a + b 
 		elif op == 1:
@@ -420,52 +894,60 @@ class BinaryCalculator():
 		elif op == 2:
 			c =  a * b
 		elif op == 3:
-			c =  a/b
-		c = c%N
+			# Integer division, dividing by zero gives zero.
+			c =  a // b if b else 0
+		c = c % self.modulus
 		return c
 		
-	def change_current_number(self, direction):
-		ledc = self.LEDC
+	async def change_current_number(self, direction):
+		""" Scroll through the numbers while a trigger is held, the further it 
+			is pressed the faster. The step between two numbers doubles every 
+			SCROLL_DOUBLING_STEPS steps, so with the trigger fully pressed all 
+			2^32 numbers of 32 bits are passed within about five seconds. Eased 
+			below SCROLL_FINE_PRESSURE, it steps by 1 and speeds up again once 
+			pressed further.
+		"""
 		joy = self.joy
-		N = len(self.binary_number)
-		old_number = self.current_number
-		start_time = time.time()
-		#delay = abs(self.current_number - old_number) 
+		max_step = max(1, self.modulus >> 4)
+		start_time = xbox.clock()
 		delay = 0
+		steps = 0
 		while joy.rightTrigger() or joy.leftTrigger():
-			ledc.phase(self.binary_number[self.current_number])
-			if time.time() > start_time + delay:
+			self.show_number()
+			if xbox.clock() >= start_time + delay:
+				pressure = joy.rightTrigger() + joy.leftTrigger()
+				if pressure < SCROLL_FINE_PRESSURE:
+					steps = 0
+				step = min(1 << steps // SCROLL_DOUBLING_STEPS, max_step)
+				steps += 1
 				if direction > 0:
-					self.current_number = (self.current_number + 1) % N
+					self.current_number = (self.current_number + step) % self.modulus
 				elif direction < 0:
-					self.current_number = (self.current_number - 1) % N
-				delay += (NO_GOOD_NAME_CONSTANT - joy.rightTrigger() - joy.leftTrigger())
-			time.sleep(INPUT_LOOP_DELAY)
+					self.current_number = (self.current_number - step) % self.modulus
+				delay += (NO_GOOD_NAME_CONSTANT - pressure)
+			# Wake up for the next step or when the trigger moves.
+			await wait_input(joy, start_time + delay - xbox.clock())
 			
-	def run(self):
+	async def play(self):
 		joy = self.joy
 		ledc = self.LEDC
 		print("Starting Binary Calculator...")
-		ledc.progress_mode()
+		await ledc.progress_mode_async()
 		ledc.stop()
 		print("Controls:")
 		print("A            - +\nB            - -\nX            - *\nY            - /\nRightBumper  - =\nRightTrigger - next binary number\nLeftTrigger  - previous binary number\nBack         - +\n")
 		a = -1
 		b = -1
 		op = -1
-		pick = []
+		since = joy.history.latest()
 		while 1:
 			# Enter a number and confirm with a A, B, X, Y or LeftBumper.
-			ledc.phase(self.binary_number[self.current_number])
-			if joy.Back():
-				print("Closing Binary Calculator...")
-				ledc.progress_mode(inv=True)
-				return True
+			self.show_number()
 			if joy.rightTrigger():					
 				# Switch to the next binary at the given speed
-				self.change_current_number(1)
+				await self.change_current_number(1)
 			if joy.leftTrigger():
-				self.change_current_number(-1)
+				await self.change_current_number(-1)
 			if joy.rightBumper():
 				if not a<0:
 					b = self.current_number
@@ -475,14 +957,12 @@ class BinaryCalculator():
 					print("= {}".format(self.str_num(c))) 
 					self.current_number = c
 					a, b, op = [-1]*3
-					pick = []
 					print()
 										
-			inpt = [joy.A(), joy.B(), joy.X(), joy.Y()]
-			pick = [inpt.index(el) for el in inpt if el] if not pick else pick
-			if pick:
+			picks, since = picked_leds(joy, since)
+			for pick in picks:
 				
-				ledc.blink([0,1,2,3], rounds=2) # alternative: time.sleep(0.2), to prevent the pick from being fired again and again
+				await ledc.blink_async(ledc.led_indices, rounds=2)
 				
 				if a<0:
 					a = self.current_number
@@ -499,37 +979,52 @@ class BinaryCalculator():
 					op = pick[0]
 					print("{}".format(self.str_op(op)), end="")
 					b = -1	
-				pick = []			
-			time.sleep(INPUT_LOOP_DELAY)
+			if not picks:
+				await wait_input(joy)
 			
 			
 
-class LedMemory():
+class LedMemory(LedGame):
 	""" Starting with three, each round LEDs 
 		will light up. The player has to memorize in which order the LEDs light up. 
 		After the sequence is shown, the player has to repeat it using the gamepad 
 		buttons A, B, X and Y. If the sequence was repeated correctly, you will get 
-		a new sequence with one more LED lighting up. """
-	def __init__(self, led_controller, joystick, speed):
-		self.LEDC = led_controller
-		self.joy = joystick
+		a new sequence with one more LED lighting up. 
+		In <endless> mode the sequence is kept and grows by one LED per round,
+		without limit. """
+	name = "Led Memory"
+	
+	def __init__(self, led_controller, joystick, speed, endless=False):
+		super(LedMemory, self).__init__(led_controller, joystick)
 		self.speed_factor = 1/GAME_SPEED_RECIPROCALS[speed]
+		self.endless = endless
+		# Sequence of the endless mode, one LED index per byte.
+		self.sequence = bytearray()
 		
 	def forge_sequence(self, lngth):
 		seq=[]
 		for i in range(lngth):
-			p = random.choice(self.LEDC.pins)
-			seq.append(self.LEDC.pins.index(p))
+			seq.append(random.choice(self.leds))
 		return seq
 		
-	def show_sequence(self, seq):
-		for s in seq:
-			self.LEDC.blink([s], delay1=self.speed_factor * GAME_SHOW_DELAY, delay2=self.speed_factor * GAME_SHOW_DELAY)
+	def next_sequence(self, lngth):
+		""" Sequence of the round with <lngth> LEDs: a new one, in endless mode
+			the one of the last round extended.
+		"""
+		if not self.endless:
+			return self.forge_sequence(lngth)
+		while len(self.sequence) < lngth:
+			self.sequence.append(random.choice(self.leds))
+		return self.sequence
+		
+	def sequence_pattern(self, seq):
+		return patterns.sequence(seq, self.speed_factor * GAME_SHOW_DELAY)
 			
-	def run(self):
+	async def play(self):
 		""" Governs the game process. """
+		joy = self.joy
 		print("Starting Led Memory...")
-		self.LEDC.progress_mode()
+		await self.LEDC.progress_mode_async()
 		self.LEDC.stop()
 		print("Controls:")
 		print("A    - LED 1\nB    - LED 2\nX    - LED 3\nY    - LED 4\nBack - close game\n")
@@ -537,49 +1032,124 @@ class LedMemory():
 		while 1:
 			# game loop
 			# show the current round, forge a new sequence, show it, initialize game variables.
-			time.sleep(0.5)
-			self.LEDC.blink(list(range(len(self.LEDC.pins))), delay1=self.speed_factor*GAME_SHOW_DELAY, delay2=self.speed_factor * 0.33 * GAME_SHOW_DELAY, rounds=N)
+			self.score = N-1
+			await asyncio.sleep(0.5)
+			# Endless rounds are too long to count them by blinking.
+			await self.LEDC.blink_async(list(range(len(self.LEDC.pins))), delay1=self.speed_factor*GAME_SHOW_DELAY, delay2=self.speed_factor * 0.33 * GAME_SHOW_DELAY, rounds=1 if self.endless else N)
 			self.LEDC.stop()
 
-			time.sleep(0.5)
-			seq = self.forge_sequence(N)
-			print(seq)
-			self.show_sequence(seq)
+			await asyncio.sleep(0.5)
+			seq = self.next_sequence(N)
+			if self.endless:
+				print("Round {}".format(N))
+			else:
+				print(seq)
+			await self.LEDC.stream_async(self.sequence_pattern(seq))
 			no = 0
-			checked = False
-			pick = []
+			since = joy.history.latest()
 
-			while 1:
+			while no<N:
 				# guessing round
-				# wait for input, if any show it. If gamepad button is released, check the guess.
-				if joy.Back():
-					print("Closing Led Memory...")
-					self.LEDC.progress_mode(inv=True)
-					return N-1
-				inpt = [joy.A(), joy.B(), joy.X(), joy.Y()]
-				pick = [inpt.index(el) for el in inpt if el] if not pick else pick
-				self.LEDC.phase(pick)
-				
-				if pick and not checked and not any([joy.A(), joy.B(), joy.X(), joy.Y()]):
-					self.LEDC.stop()
+				# wait for input, if any show it. Every button press is checked, in order.
+				self.LEDC.phase(held_leds(joy))
+				picks, since = picked_leds(joy, since)
+				for pick in picks:
 					print(str(pick[0]), end=', ')
-					checked = True
 					if len(pick)==1 and seq[no]==pick[0]:
 						no=no+1
-						checked = False
-						pick = []						
+						if no>=N:
+							break
 					else:
+						self.LEDC.stop()
 						print("You Lose")
-						self.LEDC.disco_mode(rounds=20)
+						await self.LEDC.disco_mode_async(rounds=20)
 						return N-1
-				if no>=N:
-					print()
-					break
-				time.sleep(INPUT_LOOP_DELAY)
-										
+				if no<N:
+					await wait_input(joy)
+			print()
+			self.LEDC.stop()
 			N=N+1
-		return N
 			
+class MemoryDuel(LedMemory):
+	""" Led Memory for 2 to 4 players, one gamepad each, read through the 
+		xbox.JoystickGroup <gamepads>. Every round the sequence is shown once 
+		and all players still in the game repeat it at the same time, each on 
+		their own gamepad. A wrong button puts a player out. When one player is 
+		left, or all that were left fail in the same round, they win. Back of 
+		player 1 ends the game.
+	"""
+	name = "Memory Duel"
+	
+	def __init__(self, led_controller, gamepads, speed, endless=False):
+		super(MemoryDuel, self).__init__(led_controller, gamepads[0], speed, endless)
+		self.gamepads = gamepads
+		# Longest sequence every player repeated.
+		self.scores = [0] * len(gamepads)
+		
+	async def repeat_sequence(self, seq, players):
+		""" Let <players> repeat <seq> at the same time. Returns the players 
+			who repeated it without a wrong button.
+		"""
+		gamepads = self.gamepads
+		since = dict((player, gamepads[player].history.latest()) for player in players)
+		done = dict((player, 0) for player in players)
+		out = set()
+		while 1:
+			for player in players:
+				if player in out or done[player] >= len(seq):
+					continue
+				picks, since[player] = picked_leds(gamepads[player], since[player])
+				for pick in picks:
+					if len(pick)==1 and seq[done[player]]==pick[0]:
+						done[player] += 1
+						if done[player] >= len(seq):
+							break
+					else:
+						print("Player {} is out".format(player + 1), end=', ')
+						out.add(player)
+						break
+			repeating = [player for player in players if player not in out and done[player] < len(seq)]
+			if not repeating:
+				return [player for player in players if player not in out]
+			self.LEDC.phase(sorted(set(led for player in repeating for led in held_leds(gamepads[player]))))
+			await wait_players(gamepads)
+			
+	async def play(self):
+		ledc = self.LEDC
+		self.score = self.scores
+		print("Starting Memory Duel...")
+		await ledc.progress_mode_async()
+		ledc.stop()
+		players = list(range(len(self.gamepads)))
+		N=3
+		while 1:
+			await asyncio.sleep(0.5)
+			await ledc.blink_async(list(range(len(ledc.pins))), delay1=self.speed_factor*GAME_SHOW_DELAY, delay2=self.speed_factor * 0.33 * GAME_SHOW_DELAY, rounds=1 if self.endless else N)
+			ledc.stop()
+			await asyncio.sleep(0.5)
+			seq = self.next_sequence(N)
+			print("Round {}".format(N))
+			await ledc.stream_async(self.sequence_pattern(seq))
+			left = await self.repeat_sequence(seq, players)
+			ledc.stop()
+			print()
+			for player in left:
+				self.scores[player] = N
+			if len(left) <= 1:
+				break
+			players = left
+			N=N+1
+		# Nobody left: the players of the last round all failed in it.
+		winners = left or players
+		if len(winners) == 1:
+			print("Player {} wins!".format(winners[0] + 1))
+		else:
+			print("Draw between the players {}!".format(", ".join(str(player + 1) for player in winners)))
+		await ledc.blink_async([player % len(ledc.pins) for player in winners], rounds=5)
+		# Seeded from random like the sequences, so a seeded duel repeats exactly.
+		await ledc.disco_mode_async(rounds=20, seed=random.getrandbits(32))
+		return self.scores
+	
 	
 def polar_coords(x,y):
 	radius = math.sqrt(x**2 + y**2)
@@ -606,15 +1176,14 @@ def polar_coords(x,y):
 			
 			
 def keyboard_mainloop(LEDC):
-	switch_to_joy = 0		
+	""" Keyboard menu. Returns 'j' to switch to gamepad input, None to quit. """
 	while 1:
 		mode = raw_input("Command: ")
 		if mode == 'x':			
 			LEDC.stop()	
-			break
+			return None
 		elif mode == 'j':
-			switch_to_joy = 1		
-			break
+			return 'j'
 		if mode == 'n':
 			LEDC.normal_mode()
 			LEDC.stop()					
@@ -638,85 +1207,139 @@ def keyboard_mainloop(LEDC):
 		elif mode == 'h':
 			print("Menu\n====\nx - quit\nj - switch to gamepad control\ns - change GPIO pin numbers\nd - disco mode\nr - raupe\nt - test mode\np - progress mode")
 		
-	if switch_to_joy:
-		input_mode, joy = start_routine()
-	
-		if input_mode == 'j':
-			joystick_mainloop(joy, LEDController)	
-		elif input_mode == 'k':
-			keyboard_mainloop(LEDController)
+def show_stream_frame(ledc, frame):
+	""" Show a frame_stream.Frame: a mask as digital output, levels as PWM 
+		duty cycles. Without PWM hardware a level of half or more is on, see 
+		gpio_backends.DigitalPwm.
+	"""
+	if frame.kind == frame_stream.KIND_MASK:
+		ledc.write_frame(frame.data)
+		for idx in ledc.led_indices:
+			if ledc.pwm.active_mask >> idx & 1:
+				ledc.stop_pwm(idx)
+	else:
+		ledc.pwm.set_many(dict((idx, 100.0 * level / 255) for idx, level in zip(ledc.led_indices, frame.data)))
+		
+async def listen_mainloop(ledc, listener, rate=frame_stream.REFRESH_RATE):
+	""" Show the frames streamed to the frame_stream.FrameListener <listener>,
+		the newest due one on each of <rate> refresh ticks per second. 
+	"""
+	loop = asyncio.get_running_loop()
+	loop.add_reader(listener.fileno(), listener.receive)
+	try:
+		while True:
+			frame = listener.due()
+			if frame is not None:
+				show_stream_frame(ledc, frame)
+			await ledc.scheduler.sleep_async(1.0 / rate)
+	finally:
+		loop.remove_reader(listener.fileno())
+		
+async def joystick_mainloop(ledc, joy):
+	""" Gamepad menu, run it with asyncio.run(). The event loop reads the gamepad, 
+		so the menu only wakes up on input or for the next frame of an animation.
+		Returns 'k' to switch to keyboard input, None to close the application.
+		With several players the loop reads all gamepads through GAMEPADS.
+	"""
+	reader = joy if GAMEPADS is None else GAMEPADS
+	reader.attach(asyncio.get_running_loop())
+	try:
+		return await joystick_menu(ledc, joy)
+	finally:
+		reader.detach()
 		
-def joystick_mainloop(ledc, joy):
-	switch_to_key = 0
+async def joystick_menu(ledc, joy):
 	current_led = 0 % len(ledc.pins)	
 	simple_game_speed = 1
 	while 1:
+		busy = True
 		if joy.Back():
 			# Close application.
 			joy.close()
-			break
+			return None
 		elif joy.dpadDown():
 			# Switch to keyboard input style.
-			switch_to_key = 1
-			break
+			return 'k'
 		elif joy.dpadUp():
 			# Show all functions and print their names to console.
-			ledc.test()
+			try:
+				await run_until_back(joy, ledc.test_async())
+			except BackPressed:
+				ledc.stop()
+				await wait_release(joy, 'Back')
 		elif joy.dpadRight():
 			# Switch to the next LED.
 			current_led = (current_led + 1) % len(ledc.pins)
-			ledc.phase([current_led], 0.3)
+			await ledc.phase_async([current_led], 0.3)
 			ledc.stop()
 		elif joy.dpadLeft():
 			# Switch to the previous LED.
 			current_led = (current_led - 1) % len(ledc.pins)
-			ledc.phase([current_led], 0.3)
+			await ledc.phase_async([current_led], 0.3)
 			ledc.stop()
 		elif joy.leftTrigger():
 			# Let the current LED blink.
-			ledc.blink([current_led], delay1=0.5*(NO_GOOD_NAME_CONSTANT-joy.leftTrigger()))							
-		elif joy.rightTrigger():
-			# Dimm the current LED.
-			old_led = current_led
+			await ledc.blink_async([current_led], delay1=0.5*(NO_GOOD_NAME_CONSTANT-joy.leftTrigger()))							
+		elif joy.rightTrigger() >= TRIGGER_THRESHOLD:
+			# Dimm the current LED, the loop below runs at least once.
 			pwm_pin = ledc.start_pwm([current_led], 50)
-			while 1:
-				ledc.dimm(pwm_pin, dc=100*joy.rightTrigger())
-				if joy.rightTrigger()<0.05:
-					ledc.stop_pwm(pwm_pin)
-					ledc.stop()
-					break
-			current_led = old_led
+			while joy.rightTrigger() >= TRIGGER_THRESHOLD:
+				ledc.dimm(pwm_pin, delay=0, dc=100*joy.rightTrigger())
+				await wait_input(joy)
+			ledc.stop_pwm(pwm_pin)
+			ledc.stop()
 		elif joy.rightBumper():
 			# Increase game speed.
 			simple_game_speed = (simple_game_speed + 1) % len(GAME_SPEED_RECIPROCALS)	
-			ledc.blink(list(range(simple_game_speed+1)), delay1=0.5, delay2=0, rounds=1)				
+			await ledc.blink_async(list(range(simple_game_speed+1)), delay1=0.5, delay2=0, rounds=1)				
 		elif joy.leftBumper():
 			# Decrease game speed.
 			simple_game_speed = (simple_game_speed - 1) % len(GAME_SPEED_RECIPROCALS)
-			ledc.blink(list(range(simple_game_speed+1)), delay1=0.5, delay2=0, rounds=1)
+			await ledc.blink_async(list(range(simple_game_speed+1)), delay1=0.5, delay2=0, rounds=1)
+		elif joy.Guide():
+			# Endless Led Memory.
+			if GAMEPADS is not None:
+				sg = MemoryDuel(ledc, GAMEPADS, simple_game_speed, endless=True)
+				print("Points: " + str(await sg.run()))
+			else:
+				sg = LedMemory(ledc, joy, simple_game_speed, endless=True)
+				print("Score: " + str(await sg.run()))
 		elif joy.Start():			
 			if current_led == 0:
-				sg = LedMemory(ledc, joy, simple_game_speed)
-				print("Score: " + str(sg.run()))
+				if GAMEPADS is not None:
+					sg = MemoryDuel(ledc, GAMEPADS, simple_game_speed)
+					print("Points: " + str(await sg.run()))
+				else:
+					sg = LedMemory(ledc, joy, simple_game_speed)
+					print("Score: " + str(await sg.run()))
 			elif current_led == 1:
-				sg = BinaryCalculator(ledc, joy)
-				sg.run()			
+				sg = BinaryCalculator(ledc, joy, CALCULATOR_BITS)
+				await sg.run()			
 			elif current_led == 2:
-				sg = AnotherGame(ledc, joy)
-				print("Score: " + str(sg.run()))
+				if GAMEPADS is not None:
+					sg = ReactionRace(ledc, GAMEPADS)
+					print("Points: " + str(await sg.run()))
+				else:
+					sg = AnotherGame(ledc, joy)
+					print("Score: " + str(await sg.run()))
 			elif current_led == 3:
 				sg = LedPatternRepeater(ledc, joy)
-				sg.run()
+				await sg.run()
+			else:
+				# LEDs past the fourth, on shift registers, have no game.
+				busy = False
+		else:
+			busy = False
+		if TRACER is not None and busy:
+			TRACER.mark('decide')
 				
-		inpt = [joy.A(), joy.B(), joy.X(), joy.Y()]
-		ledc.phase([i for i in range(4) if inpt[i]])
+		ledc.phase(held_leds(joy))
 		
 		#x, y = joy.leftStick()
 		#angle, radius = polar_coords(x,y)
-		time.sleep(INPUT_LOOP_DELAY)
-	
-	if switch_to_key:
-		keyboard_mainloop(ledc)
+		if not busy:
+			# Nothing to do until the next input.
+			await wait_input(joy)
 
 
 def determine_input_mode():
@@ -734,49 +1357,173 @@ def determine_input_mode():
 def connect_gamepad():
 	""" If no gamepad can be found, it falls back to keyboard input style. """
 	try:
-		print("Connecting the gamepad...")
-		return xbox.Joystick()
+		if PLAYERS > 1:
+			global GAMEPADS
+			print("Connecting {} gamepads...".format(PLAYERS))
+			GAMEPADS = xbox.JoystickGroup(PLAYERS)
+			joy = GAMEPADS[0]
+		else:
+			print("Connecting the gamepad...")
+			joystick = xbox.SharedJoystick if READER_PROCESS else xbox.Joystick
+			joy = joystick(record=RECORD_FILE, replay=REPLAY_FILE, speed=REPLAY_SPEED)
+		joy.tracer = TRACER
+		return joy
 	except IOError:
 		print("The gamepad cannot be found. Switching to keyboard input...")
 		return 0			
 
+def find_gamepad():
+	""" Calls determine_input_mode() and connect_gamepad(). Returns the input 
+		mode and the joystick, 0 if none is connected.
+	"""
+	input_mode = determine_input_mode()
+	joy = connect_gamepad() if input_mode == 'j' else 0
+	return input_mode, joy
+	
+def start_controller():
+	if SHIFT_REGISTER_LEDS:
+		latch = None if SHIFT_SPI else SHIFT_LATCH_PIN
+		ledc = LedControllerBase.with_shift_register(SHIFT_REGISTER_LEDS, latch=latch, spi=SHIFT_SPI)
+	else:
+		ledc = LedControllerBase(GPIO_PIN_1, GPIO_PIN_2, GPIO_PIN_3, GPIO_PIN_4)
+	if RENDER_RATE:
+		ledc.start_render(RENDER_RATE)
+	return ledc
+
 def start_routine():
-	""" Calls determine_input_mode() and connect_gamepad(). Returns the input_mode 
-		and the joystick if one is connected. 
+	""" Looks for the gamepad in a second thread while the GPIO pins are set 
+		up and the intro is shown, so startup takes as long as the slowest of 
+		them. With READER_PROCESS the gamepad is connected first. Returns the 
+		input_mode, the led controller and the joystick if one is connected. 
 	"""		
 	print("Starting...")
-	ledc = LedControllerBase(GPIO_PIN_1, GPIO_PIN_2, GPIO_PIN_3, GPIO_PIN_4)  
-	print("Initialized led-controller.")
-	ledc.raupe(rounds = 2, delay=0.1)
-		
-	input_mode = determine_input_mode()
-	joy = connect_gamepad()
+	timer = timing.PhaseTimer()
+	def timed_find_gamepad():
+		with timer.phase('gamepad'):
+			return find_gamepad()
+	found = None
+	if READER_PROCESS:
+		# The reader process is forked, which is only safe while no other 
+		# thread runs.
+		found = timed_find_gamepad()
+	with concurrent.futures.ThreadPoolExecutor(1) as pool:
+		gamepad = pool.submit(timed_find_gamepad) if found is None else None
+		with timer.phase('gpio'):
+			ledc = start_controller()
+		print("Initialized led-controller.")
+		with timer.phase('intro'):
+			ledc.raupe(rounds = 2, delay=0.1)
+		input_mode, joy = found if found is not None else gamepad.result()
+	print(timer.report())
 	
 	if input_mode == 'j' and joy:
 		print("GAMEPAD input style.")
 		return 'j', ledc, joy			
-	elif input_mode == 'k' or not joy:
+	else:
 		print("KEYBOARD input style.")
 		return 'k', ledc, joy
 	
+def listen_routine(port):
+	""" Show the frames streamed to UDP <port> until Ctrl-C. """
+	ledc = start_controller()
+	listener = frame_stream.FrameListener(port)
+	print("Listening for frames on UDP port {}...".format(port))
+	if not ledc.backend.hardware_pwm:
+		print("The {} backend has no PWM, brightness levels are shown as on or off.".format(ledc.backend.name))
+	try:
+		asyncio.run(listen_mainloop(ledc, listener))
+	except KeyboardInterrupt:
+		pass
+	print(listener.report())
+	listener.close()
+	exit_routine(ledc, 0)
+	
 def exit_routine(ledc, joy):
 	print("Goodbye")	
+	print(ledc.scheduler.report())
+	if TRACER is not None:
+		print(TRACER.report())
 	if joy:
+		if getattr(joy, 'lost', 0):
+			print("Gamepad lines lost by the reader process: {}".format(joy.lost))
 		joy.close()		
+	if GAMEPADS is not None:
+		GAMEPADS.close()
+	ledc.pwm.close()
 	ledc.stop()
-	GPIO.cleanup()		
+	if ledc.frame_buffer is not None:
+		print(ledc.frame_buffer.report())
+	ledc.stop_render()
+	print("GPIO writes: {}, avoided: {}".format(ledc.gpio_writes, ledc.gpio_writes_avoided))
+	ledc.backend.close()
 
 			
 if __name__ == '__main__':
 	
-	input_mode, ledc, joy = start_routine()
-	try:
-		if input_mode == 'j':
-			joystick_mainloop(ledc, joy)	
-		elif input_mode == 'k':
-			keyboard_mainloop(ledc)
-	except KeyboardInterrupt, SystemExit:			
-		exit_routine(ledc, joy)		
-	
-	ledc.raupe(rounds = 2, delay=0.1, rev = True)
-	exit_routine(ledc, joy)
+	parser = argparse.ArgumentParser(description="Control LEDs with a gamepad or the keyboard.")
+	parser.add_argument('--trace-latency', action='store_true', 
+						help="trace the time from gamepad input to GPIO output and print percentiles on exit")
+	parser.add_argument('--backend', choices=('auto',) + tuple(sorted(gpio_backends.BACKENDS)), 
+						default=GPIO_BACKEND, help="library driving the GPIO pins")
+	parser.add_argument('--shift-register', type=int, default=SHIFT_REGISTER_LEDS, metavar='LEDS', 
+						help="drive this many LEDs on chained 74HC595 shift registers")
+	parser.add_argument('--calculator-bits', type=int, choices=(4, 8, 16, 32), metavar='BITS', 
+						help="calculate with numbers of 4, 8, 16 or 32 bits instead of one bit per LED")
+	parser.add_argument('--spi', action='store_true', 
+						help="send the shift register chain over SPI bus 0, device 0")
+	parser.add_argument('--record', metavar='FILE', 
+						help="record the gamepad input to this file")
+	parser.add_argument('--replay', metavar='FILE', 
+						help="play a recorded gamepad input instead of reading the gamepad")
+	parser.add_argument('--replay-speed', type=float, default=REPLAY_SPEED, metavar='FACTOR', 
+						help="replay this many times faster than recorded, 0 for as fast as possible")
+	parser.add_argument('--render-rate', type=float, default=RENDER_RATE, metavar='HZ', 
+						help="write the LEDs from a render thread this many times per second")
+	parser.add_argument('--reader-process', action='store_true', 
+						help="read and decode the gamepad input in a helper process, "
+						"meant for single core Pis (see xbox.SharedJoystick)")
+	parser.add_argument('--listen', type=int, metavar='PORT', 
+						help="show the frames streamed to this UDP port, see frame_stream")
+	parser.add_argument('--players', type=int, choices=range(1, 5), default=PLAYERS, 
+						help="number of gamepads, with more than one Led Memory is the Memory Duel "
+						"and Another Game the Reaction Race")
+	args = parser.parse_args()
+	if args.players > 1 and (args.record or args.replay or args.reader_process):
+		parser.error("--players cannot be combined with --record, --replay or --reader-process")
+	GPIO_BACKEND = args.backend
+	READER_PROCESS = args.reader_process
+	PLAYERS = args.players
+	RENDER_RATE = args.render_rate
+	RECORD_FILE = args.record
+	REPLAY_FILE = args.replay
+	REPLAY_SPEED = args.replay_speed
+	SHIFT_REGISTER_LEDS = args.shift_register
+	CALCULATOR_BITS = args.calculator_bits
+	if args.spi:
+		SHIFT_SPI = (0, 0)
+	if args.trace_latency:
+		TRACER = timing.LatencyTracer()
+	
+	if args.listen:
+		listen_routine(args.listen)
+	else:
+		input_mode, ledc, joy = start_routine()
+		try:
+			while input_mode:
+				if input_mode == 'j':
+					input_mode = asyncio.run(joystick_mainloop(ledc, joy))
+				elif input_mode == 'k':
+					input_mode = keyboard_mainloop(ledc)
+					if input_mode == 'j' and not joy:
+						joy = determine_input_mode() == 'j' and connect_gamepad()
+						input_mode = 'j' if joy else 'k'
+		except IOError:
+			# The end of a recording reads like a gamepad unplugged.
+			if REPLAY_FILE is None:
+				raise
+			print("End of the recording {}.".format(REPLAY_FILE))
+		except (KeyboardInterrupt, SystemExit):			
+			exit_routine(ledc, joy)		
+		
+		ledc.raupe(rounds = 2, delay=0.1, rev = True)
+		exit_routine(ledc, joy)
@@ -0,0 +1,180 @@
+""" Compact files of recorded LED patterns.
+
+A pattern is a sequence of frames (bitmasks as in LedControllerBase), each
+shown from its start time until the next one starts. Consecutive identical
+frames are merged when writing. Layout of a file, all numbers little endian:
+
+	header   HEADER, see below
+	frames   per frame: start time minus the start time of the previous frame,
+	         in microseconds as unsigned LEB128 varint, followed by the mask in
+	         <mask bytes> bytes
+	index    start times of every INDEX_EVERY-th frame as u64 array, then the
+	         file offsets of these frames as u64 array
+
+Files are memory-mapped on loading and decoded while playing, so long
+recordings start at once. The index lets playback start at any time offset
+after a binary search instead of a scan from the beginning.
+"""
+from array import array
+import bisect
+import mmap
+import os
+import struct
+import sys
+
+
+MAGIC = b'LEDPAT'
+VERSION = 1
+# magic, version, mask bytes, pin count, frame count, frames per index entry,
+# duration (us), index offset, index entries
+HEADER = struct.Struct('<6sHHIIIQQI')
+# Frames between two index entries.
+INDEX_EVERY = 64
+
+
+def _varint(value):
+	out = bytearray()
+	while value >= 0x80:
+		out.append(value & 0x7f | 0x80)
+		value >>= 7
+	out.append(value)
+	return out
+
+def _u64_array(values):
+	values = array('Q', values)
+	if sys.byteorder != 'little':
+		values.byteswap()
+	return values
+
+
+def write_pattern(path, masks, holds, pin_count, index_every=INDEX_EVERY):
+	""" Write the pattern showing masks[i] for holds[i] seconds each to <path>.
+		The file is replaced atomically, so a mapped older version stays valid.
+	"""
+	mask_bytes = max(1, (pin_count + 7) // 8)
+	body = bytearray()
+	times, offsets = [], []
+	elapsed = 0.0
+	last_start = 0
+	last_mask = None
+	count = 0
+	for mask, hold in zip(masks, holds):
+		start = int(round(elapsed * 1e6))
+		elapsed += hold
+		if mask == last_mask:
+			continue
+		if count % index_every == 0:
+			times.append(start)
+			offsets.append(HEADER.size + len(body))
+		body += _varint(start - last_start)
+		body += int(mask).to_bytes(mask_bytes, 'little')
+		last_start, last_mask = start, mask
+		count += 1
+	# The index is aligned for mapping it as u64 array.
+	body += bytes(-(HEADER.size + len(body)) % 8)
+	index_offset = HEADER.size + len(body)
+	header = HEADER.pack(MAGIC, VERSION, mask_bytes, pin_count, count, index_every, 
+						 int(round(elapsed * 1e6)), index_offset, len(times))
+	tmp = path + '.tmp'
+	with open(tmp, 'wb') as f:
+		f.write(header)
+		f.write(body)
+		f.write(_u64_array(times).tobytes())
+		f.write(_u64_array(offsets).tobytes())
+	os.replace(tmp, path)
+
+
+class PatternFile(object):
+	""" Memory-mapped pattern file. Plays like an animations.Timeline:
+		frames() yields (offset, mask) pairs and duration is the length in
+		seconds. seek(start) gives the same for the part after <start>.
+	"""
+	def __init__(self, path):
+		with open(path, 'rb') as f:
+			self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+		try:
+			(magic, version, self.mask_bytes, self.pin_count, self.count, self.index_every, 
+			 duration, index_offset, entries) = HEADER.unpack_from(self.map, 0)
+		except struct.error:
+			magic = version = None
+		if magic != MAGIC or version != VERSION:
+			self.map.close()
+			raise ValueError('{} is no pattern file of version {}'.format(path, VERSION))
+		self.duration = duration / 1e6
+		self.index = memoryview(self.map)[index_offset:index_offset + 16 * entries]
+		if sys.byteorder == 'little':
+			self.words = self.index.cast('Q')
+		else:
+			self.words = _u64_array(self.index.tobytes())
+			self.words.byteswap()
+		self.times = self.words[:entries]
+		self.offsets = self.words[entries:]
+
+	def __len__(self):
+		return self.count
+
+	def seek(self, start):
+		return PatternSlice(self, start)
+
+	def frames(self, start=0.0):
+		""" (offset, mask) pairs of the frames after <start> seconds, offsets
+			relative to <start>. The frame showing at <start> comes first.
+		"""
+		if not self.count:
+			return
+		start_us = int(round(start * 1e6))
+		entry = max(0, bisect.bisect_right(self.times, start_us) - 1)
+		data, mask_bytes = self.map, self.mask_bytes
+		pos = self.offsets[entry]
+		t = self.times[entry]
+		first = True
+		current = None
+		for i in range(entry * self.index_every, self.count):
+			# Start time difference, known from the index for the first frame.
+			delta = shift = 0
+			while True:
+				byte = data[pos]
+				pos += 1
+				delta |= (byte & 0x7f) << shift
+				shift += 7
+				if byte < 0x80:
+					break
+			if first:
+				first = False
+			else:
+				t += delta
+			mask = int.from_bytes(data[pos:pos + mask_bytes], 'little')
+			pos += mask_bytes
+			if t <= start_us:
+				current = mask
+				continue
+			if current is not None:
+				yield 0.0, current
+				current = None
+			yield (t - start_us) / 1e6, mask
+		if current is not None:
+			yield 0.0, current
+
+	def close(self):
+		for view in (self.times, self.offsets, self.words, self.index):
+			if isinstance(view, memoryview):
+				view.release()
+		self.map.close()
+
+
+class PatternSlice(object):
+	""" The part of a PatternFile after <start> seconds, playable as timeline. """
+	def __init__(self, pattern, start):
+		self.pattern = pattern
+		self.start = start
+		self.duration = max(0.0, pattern.duration - start)
+
+	def frames(self):
+		return self.pattern.frames(self.start)
+
+
+def open_pattern(path):
+	""" PatternFile of <path>, None if there is no such file. """
+	if not os.path.exists(path):
+		return None
+	return PatternFile(path)
@@ -0,0 +1,253 @@
+""" Lazy, composable LED patterns.
+
+A pattern is an iterable of (duration, mask) frames: the bitmask <mask>, as
+in LedControllerBase, is shown for <duration> seconds. The Pattern objects
+built here are lazy: nothing is computed until playback pulls the next frame,
+so a composed show of any length, even an endless one, runs in constant
+memory. Iterating a Pattern again starts it from the beginning.
+
+	show = concat(raupe(4, 0.1), progress(4, 0.1).mirror(4)).repeat(3)
+	ledc.stream(show.overlay(blink(1, delay1=0.25).repeat(), [3]))
+
+The built-in modes of LedControllerBase are defined here as generators with
+the same parameters; animations.compile_animation compiles them into the 
+cached timelines the controller plays. Any re-iterable of frames, e.g. a 
+list, can be used where a pattern is expected.
+"""
+import functools
+import itertools
+
+import animations
+
+
+class Pattern(object):
+	""" Re-iterable lazy pattern, iterating it calls <source>() for a fresh
+		iterator of (duration, mask) frames. The combinators are available as
+		methods as well, p + q concatenates.
+	"""
+	__slots__ = ('source',)
+
+	def __init__(self, source):
+		self.source = source
+
+	def __iter__(self):
+		return iter(self.source())
+
+	def __add__(self, other):
+		return concat(self, other)
+
+	def repeat(self, times=None):
+		return repeat(self, times)
+
+	def mirror(self, pin_count):
+		return mirror(self, pin_count)
+
+	def invert(self, pin_count):
+		return invert(self, pin_count)
+
+	def scale(self, factor):
+		return scale(self, factor)
+
+	def take(self, seconds):
+		return take(self, seconds)
+
+	def overlay(self, top, pins):
+		return overlay(self, top, pins)
+
+
+def pattern(generator):
+	""" Decorator turning a generator function of frames into a function
+		returning a Pattern, which calls the generator on every iteration.
+	"""
+	@functools.wraps(generator)
+	def make(*args, **kwargs):
+		return Pattern(lambda: generator(*args, **kwargs))
+	return make
+
+
+# 1 Sources
+
+@pattern
+def frames(masks, holds):
+	""" masks[i] shown for holds[i] seconds each. """
+	return zip(holds, masks)
+
+@pattern
+def timeline(compiled):
+	""" Frames of a compiled animations.Timeline or a pattern_files.PatternFile. """
+	last_offset, last_mask = None, None
+	for offset, mask in compiled.frames():
+		if last_offset is not None:
+			yield offset - last_offset, last_mask
+		last_offset, last_mask = offset, mask
+	if last_offset is not None:
+		yield compiled.duration - last_offset, last_mask
+
+@pattern
+def raupe(pin_count, delay=0.3, rounds=1, rev=False):
+	""" One LED at a time, from left to right (<rev>: right to left), then all off. """
+	for i in range(rounds):
+		for j in range(pin_count):
+			yield delay, 1 << (pin_count - 1 - j if rev else j)
+	yield 0, 0
+
+@pattern
+def progress(pin_count, delay=0.3, rounds=1, rev=False, inv=False):
+	""" Progress bar growing from the left (<rev>: right), <inv>: shrinking. """
+	all_mask = (1 << pin_count) - 1
+	for i in range(rounds):
+		for j in (range(pin_count, 0, -1) if inv else range(1, pin_count + 1)):
+			yield delay, all_mask ^ (all_mask >> j) if rev else (1 << j) - 1
+	yield 0, 0
+
+@pattern
+def blink(mask, rounds=1, delay1=0.3, delay2=None):
+	""" <mask> on for <delay1>, off for <delay2> seconds. """
+	for i in range(rounds):
+		yield delay1, mask
+		yield delay1 if delay2 is None else delay2, 0
+
+@pattern
+def sequence(indices, delay=0.3):
+	""" LED indices[i] on for <delay>, then all off for <delay> seconds, one 
+		after another. Frames are made while playing, so <indices> may be a 
+		sequence of any length, e.g. a bytearray.
+	"""
+	for idx in indices:
+		yield delay, 1 << idx
+		yield delay, 0
+
+@pattern
+def disco(pin_count, rounds=None, longest=0.2, seed=None, density=None, max_lit=None, batch=256):
+	""" <rounds> random frames, endless for None, see animations.RandomFrames, 
+		each shown for a random time below <longest> seconds, then all off. 
+		Frames are drawn <batch> at a time.
+	"""
+	source = animations.RandomFrames(pin_count, seed, density, max_lit)
+	left = rounds
+	while left is None or left > 0:
+		n = batch if left is None else min(batch, left)
+		masks = animations._tolist(source.batch(n))
+		holds = source.holds(n, longest)
+		for hold, mask in zip(holds, masks):
+			yield float(hold), mask
+		if left is not None:
+			left -= n
+	yield 0, 0
+
+
+# 2 Combinators
+
+@pattern
+def concat(*patterns):
+	""" The patterns one after another. """
+	return itertools.chain.from_iterable(patterns)
+
+@pattern
+def repeat(pat, times=None):
+	""" <pat> <times> times in a row, endlessly for None. Ends early once a 
+		pass of <pat> has no frames, e.g. when it is empty or an iterator.
+	"""
+	counter = itertools.count() if times is None else range(times)
+	for i in counter:
+		empty = True
+		for frame in pat:
+			empty = False
+			yield frame
+		if empty:
+			return
+
+@pattern
+def mirror(pat, pin_count):
+	""" Swap left and right. """
+	# Reversed bits of every byte, the mask is mirrored byte by byte.
+	table = [int('{:08b}'.format(byte)[::-1], 2) for byte in range(256)]
+	nbytes = (pin_count + 7) // 8
+	shift = 8 * nbytes - pin_count
+	for duration, mask in pat:
+		mirrored = int.from_bytes(bytes(table[b] for b in int(mask).to_bytes(nbytes, 'little')), 'big')
+		yield duration, mirrored >> shift
+
+@pattern
+def invert(pat, pin_count):
+	""" Every LED on that is off and vice versa. """
+	all_mask = (1 << pin_count) - 1
+	for duration, mask in pat:
+		yield duration, mask ^ all_mask
+
+@pattern
+def scale(pat, factor):
+	""" Play <factor> times slower (factor < 1: faster). """
+	for duration, mask in pat:
+		yield duration * factor, mask
+
+@pattern
+def take(pat, seconds):
+	""" The first <seconds> of <pat>, the last frame is cut short. """
+	left = seconds
+	for duration, mask in pat:
+		if left <= 0:
+			return
+		yield min(duration, left), mask
+		left -= duration
+
+@pattern
+def interleave(*patterns):
+	""" One frame of every pattern in turn, until one of them ends. """
+	iterators = [iter(p) for p in patterns]
+	while True:
+		for it in iterators:
+			frame = next(it, None)
+			if frame is None:
+				return
+			yield frame
+
+@pattern
+def overlay(base, top, pins):
+	""" <base> with the LEDs <pins> taken from <top>: bit j of the frames of
+		<top> is shown on LED pins[j]. Ends with <base>, after <top> ended
+		the LEDs show <base> again.
+	"""
+	pin_mask = 0
+	for p in pins:
+		pin_mask |= 1 << p
+
+	def spread(mask):
+		out = 0
+		while mask:
+			low = mask & -mask
+			out |= 1 << pins[low.bit_length() - 1]
+			mask ^= low
+		return out
+
+	tops = iter(top)
+	top_left, top_mask = 0, None
+	for duration, mask in base:
+		# Frames of zero duration are passed on unchanged, so a closing 
+		# all off frame of <base> switches the overlay off as well.
+		if duration <= 0:
+			yield duration, mask
+			continue
+		while duration > 0:
+			while top_left <= 0 and tops is not None:
+				frame = next(tops, None)
+				if frame is None:
+					tops, top_mask = None, None
+				else:
+					top_left, top_mask = frame[0], spread(frame[1])
+			if tops is None:
+				yield duration, mask
+				break
+			step = min(duration, top_left)
+			yield step, mask & ~pin_mask | top_mask
+			duration -= step
+			top_left -= step
+
+
+def compile_pattern(pat, pin_count):
+	""" The frames of the finite pattern <pat> as animations.Timeline. """
+	holds, masks = [], []
+	for duration, mask in pat:
+		holds.append(duration)
+		masks.append(mask)
+	return animations.compile_frames(masks, holds, pin_count)
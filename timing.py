@@ -0,0 +1,498 @@
+""" Drift-free timing of LED output.
+
+Frames are shown at absolute time.monotonic() deadlines instead of after
+chained relative sleeps, so the cost of the GPIO calls and the scheduling
+jitter of one frame do not add up over a whole animation. Waiting sleeps
+coarsely until shortly before the deadline and spins for the last stretch.
+The *_async variants only sleep through asyncio, without spinning, so the 
+event loop keeps reading input between frames, the CPU stays idle and an 
+animation can be cancelled at any frame.
+
+LatencyTracer measures how long a gamepad input takes until the LEDs react,
+PhaseTimer how long the phases of the startup take.
+
+VirtualClock replaces real time for replays of recorded input: time only 
+passes when the event loop has nothing to do and then jumps to the next 
+timer, so hours of recorded play run through the game logic in seconds.
+
+FrameBuffer decouples the producers of frames from the GPIO output: frames 
+are swapped into it without any I/O and a render thread writes the newest 
+one to the pins at a fixed refresh rate. A producer busy in Python code 
+holds the interpreter lock for up to the switch interval (5 ms by default) 
+before the render thread gets it, so the FrameBuffer lowers the switch 
+interval to SWITCH_SHARE of its refresh period while it runs.
+"""
+import asyncio
+from collections import deque
+import contextlib
+import math
+import selectors
+import sys
+import threading
+import time
+
+
+# Waits shorter than this are spun instead of slept (seconds).
+SPIN_THRESHOLD = 0.002
+# A chain of sleeps is restarted from now if its last deadline is older than this.
+RESYNC_THRESHOLD = 0.02
+# Number of frames whose lateness is kept for the statistics.
+LATENESS_HISTORY = 10000
+# Refreshes per second of a FrameBuffer.
+RENDER_RATE = 200
+# A refresh later than this share of the refresh period counts as late.
+LATE_SHARE = 0.5
+# Longest time another thread holds the interpreter lock while the render 
+# thread waits for it, as share of the refresh period.
+SWITCH_SHARE = 0.2
+# Refreshes whose write times are kept, see FrameBuffer.write_time.
+WRITE_HISTORY = 64
+
+# Clock and sleep of DeadlineScheduler and LatencyTracer, replaced while a 
+# VirtualClock is installed.
+clock = time.monotonic
+sleep = time.sleep
+
+
+class DeadlineScheduler(object):
+	""" Runs frames against absolute deadlines and records how late each
+		frame was.
+	"""
+	def __init__(self, spin=SPIN_THRESHOLD, resync=RESYNC_THRESHOLD, history=LATENESS_HISTORY):
+		self.spin = spin
+		self.resync = resync
+		self.deadline = None
+		self.lateness = deque(maxlen=history)
+
+	def wait_until(self, deadline):
+		""" Sleep until <deadline> and record the lateness of the wakeup. """
+		remaining = deadline - clock()
+		# A VirtualClock sleeps exactly, there is nothing to spin for.
+		spin = self.spin if sleep is time.sleep else 0.0
+		if remaining > spin:
+			sleep(remaining - spin)
+		now = clock()
+		while now < deadline:
+			now = clock()
+		self.lateness.append(now - deadline)
+
+	async def wait_until_async(self, deadline):
+		""" Sleep until <deadline> in the event loop, no spinning. """
+		now = clock()
+		while now < deadline:
+			await asyncio.sleep(deadline - now)
+			now = clock()
+		self.lateness.append(now - deadline)
+
+	def start(self):
+		""" Base time of the next frame: the last deadline if the previous
+			frame has just been shown, now otherwise.
+		"""
+		now = clock()
+		if self.deadline is None or now - self.deadline > self.resync:
+			return now
+		return self.deadline
+
+	def sleep(self, delay):
+		""" Sleep <delay> seconds counted from the last deadline, so that
+			consecutive calls do not drift.
+		"""
+		self.deadline = self.start() + delay
+		self.wait_until(self.deadline)
+
+	async def sleep_async(self, delay):
+		self.deadline = self.start() + delay
+		await self.wait_until_async(self.deadline)
+
+	def run(self, timeline, show):
+		""" Call show(mask) for every frame of <timeline> at its offset. """
+		start = self.start()
+		for offset, mask in timeline.frames():
+			self.wait_until(start + offset)
+			show(mask)
+		self.deadline = start + timeline.duration
+		if self.deadline > clock():
+			self.wait_until(self.deadline)
+
+	async def run_async(self, timeline, show):
+		start = self.start()
+		for offset, mask in timeline.frames():
+			await self.wait_until_async(start + offset)
+			show(mask)
+		self.deadline = start + timeline.duration
+		if self.deadline > clock():
+			await self.wait_until_async(self.deadline)
+
+	def stream(self, pattern, show):
+		""" Call show(mask) for every (duration, mask) frame of <pattern> and 
+			keep it for <duration>. Frames are pulled one at a time, the next 
+			one is computed while the current one is shown.
+		"""
+		deadline = self.start()
+		for duration, mask in pattern:
+			self.wait_until(deadline)
+			show(mask)
+			deadline += duration
+		self.deadline = deadline
+		if deadline > clock():
+			self.wait_until(deadline)
+			
+	async def stream_async(self, pattern, show):
+		deadline = self.start()
+		for duration, mask in pattern:
+			await self.wait_until_async(deadline)
+			show(mask)
+			deadline += duration
+		self.deadline = deadline
+		if deadline > clock():
+			await self.wait_until_async(deadline)
+
+	def stats(self):
+		""" Frame count, maximum, 99th percentile and mean lateness in seconds. """
+		lateness = sorted(self.lateness)
+		if not lateness:
+			return {'frames': 0, 'max': 0.0, 'p99': 0.0, 'mean': 0.0}
+		return {
+			'frames': len(lateness),
+			'max': lateness[-1],
+			'p99': lateness[min(len(lateness) - 1, int(0.99 * len(lateness)))],
+			'mean': sum(lateness) / len(lateness),
+		}
+
+	def report(self):
+		stats = self.stats()
+		return "Frame lateness over {} frames: max {:.3f} ms, p99 {:.3f} ms, mean {:.3f} ms".format(
+			stats['frames'], 1000 * stats['max'], 1000 * stats['p99'], 1000 * stats['mean'])
+
+
+# Stages traced by LatencyTracer after a line was read, in the order an input 
+# passes them.
+TRACE_STAGES = ('decode', 'decide', 'write')
+# Resolution of LatencyHistogram.
+BUCKETS_PER_DECADE = 20
+
+
+class LatencyHistogram(object):
+	""" Counts latencies in logarithmic buckets from 1 us to 1000 s, so 
+		percentiles can be read without keeping every sample.
+	"""
+	def __init__(self):
+		self.counts = [0] * (9 * BUCKETS_PER_DECADE + 1)
+		self.count = 0
+		self.max = 0.0
+
+	def add(self, latency):
+		if latency > 1e-6:
+			idx = min(int(math.log10(latency / 1e-6) * BUCKETS_PER_DECADE), len(self.counts) - 1)
+		else:
+			idx = 0
+		self.counts[idx] += 1
+		self.count += 1
+		self.max = max(self.max, latency)
+
+	def percentile(self, p):
+		""" Upper bound of the bucket holding the <p> percentile, in seconds. """
+		rank = p / 100.0 * self.count
+		seen = 0
+		for idx, count in enumerate(self.counts):
+			seen += count
+			if count and seen >= rank:
+				return min(1e-6 * 10 ** ((idx + 1) / BUCKETS_PER_DECADE), self.max)
+		return self.max
+
+
+class LatencyTracer(object):
+	""" Traces the time from reading a gamepad line with a button press to 
+		the stages that follow it. begin() starts a trace at the time the line 
+		was read, mark(stage) records the time passed since then, once per 
+		stage and trace. Call sites only check that a tracer is set, so tracing 
+		costs nothing while it is off.
+	"""
+	def __init__(self):
+		self.histograms = dict((stage, LatencyHistogram()) for stage in TRACE_STAGES)
+		self.origin = None
+		self.seen = set()
+
+	def begin(self, read_time):
+		self.origin = read_time
+		self.seen = set()
+
+	def mark(self, stage):
+		if self.origin is None or stage in self.seen:
+			return
+		self.seen.add(stage)
+		self.histograms[stage].add(clock() - self.origin)
+
+	def report(self):
+		lines = ["Input latency since the line was read (ms):"]
+		for stage in TRACE_STAGES:
+			hist = self.histograms[stage]
+			lines.append("  {:<7} n={:<6} p50 {:8.3f}  p90 {:8.3f}  p99 {:8.3f}  max {:8.3f}".format(
+				stage, hist.count, 1000 * hist.percentile(50), 1000 * hist.percentile(90),
+				1000 * hist.percentile(99), 1000 * hist.max))
+		return "\n".join(lines)
+
+
+class PhaseTimer(object):
+	""" Wall clock times of named phases, which may run in different threads 
+		at the same time. Times are counted from the creation of the timer.
+	"""
+	def __init__(self):
+		self.origin = time.monotonic()
+		self.phases = []
+		self.lock = threading.Lock()
+		
+	@contextlib.contextmanager
+	def phase(self, name):
+		start = time.monotonic()
+		try:
+			yield
+		finally:
+			end = time.monotonic()
+			with self.lock:
+				self.phases.append((name, start - self.origin, end - self.origin))
+				
+	def report(self):
+		phases = sorted(self.phases, key=lambda phase: phase[1])
+		total = max([end for name, start, end in phases] or [0.0])
+		busy = sum(end - start for name, start, end in phases)
+		lines = ["Startup took {:.0f} ms, {:.0f} ms of phases:".format(1000 * total, 1000 * busy)]
+		for name, start, end in phases:
+			lines.append("  {:<10} {:7.1f} -> {:7.1f} ms ({:.1f} ms)".format(
+				name, 1000 * start, 1000 * end, 1000 * (end - start)))
+		return "\n".join(lines)
+
+
+class FrameBuffer(object):
+	""" Double buffered frames for a GPIO backend of gpio_backends. Producers 
+		compose a frame in self.back and publish it with swap(), or do both 
+		with show(mask); the swap replaces the front frame at once. A render 
+		thread writes the front frame to <backend> <rate> times per second,
+		only the pins that changed and none of the pins in <hold>() (e.g. 
+		driven by PWM).
+		
+		A frame swapped in and replaced before a refresh wrote it counts as 
+		dropped, a refresh more than LATE_SHARE of the period after its 
+		deadline as late. Refreshes missed altogether are skipped. write_time() 
+		tells when a frame reached the pins. With a <tracer> (LatencyTracer) 
+		the write of a traced frame is marked by the render thread.
+	"""
+	def __init__(self, backend, rate=RENDER_RATE, hold=None, tracer=None):
+		self.backend = backend
+		self.period = 1.0 / rate
+		self.hold = hold or (lambda: 0)
+		self.tracer = tracer
+		# Swap number of the frame whose write is traced, None for none.
+		self.traced = None
+		# (last swap number written, start, end) of the last refreshes that wrote.
+		self.writes = deque(maxlen=WRITE_HISTORY)
+		self.back = 0
+		self.front = 0
+		self.lock = threading.Lock()
+		self.swaps = 0
+		# Pins to write on the next refresh even if unchanged, None for all.
+		self.invalid = None
+		self.written = None
+		self.rendered_swaps = 0
+		self.refreshes = 0
+		self.dropped = 0
+		self.late = 0
+		self.skipped = 0
+		self.pin_writes = 0
+		# Pins left unchanged by the refreshes that wrote a new frame.
+		self.pin_writes_avoided = 0
+		self.running = True
+		self.switch_interval = sys.getswitchinterval()
+		sys.setswitchinterval(min(self.switch_interval, SWITCH_SHARE * self.period))
+		self.thread = threading.Thread(target=self.render_loop, name='frame-render')
+		self.thread.daemon = True
+		self.thread.start()
+
+	def swap(self):
+		""" Make the back buffer the frame shown from the next refresh on. 
+			Returns the swap number of the frame, see write_time().
+		"""
+		with self.lock:
+			self.front = self.back
+			self.swaps += 1
+			return self.swaps
+
+	def show(self, mask):
+		self.back = mask
+		return self.swap()
+
+	def trace(self, swap):
+		""" Mark 'write' on the tracer once the frame <swap> is written. """
+		with self.lock:
+			self.traced = swap
+
+	def write_time(self, swap):
+		""" (start, end) of the time.monotonic() times between which the 
+			frame <swap>, or one swapped in after it, was written to the pins. 
+			None if that has not happened yet or is too long ago.
+		"""
+		for last, start, end in list(self.writes):
+			if last >= swap:
+				return start, end
+		return None
+
+	def invalidate(self, mask):
+		""" Write the pins of <mask> on the next refresh, whatever their state. """
+		with self.lock:
+			if self.invalid is not None:
+				self.invalid |= mask
+
+	def render(self):
+		""" Write the front frame, called by the render thread. """
+		with self.lock:
+			frame = self.front
+			swaps = self.swaps
+			new = swaps - self.rendered_swaps
+			self.rendered_swaps = swaps
+			invalid, self.invalid = self.invalid, 0
+			traced = self.traced
+			if traced is not None and traced <= swaps:
+				self.traced = None
+		if new > 1:
+			self.dropped += new - 1
+		if invalid is None or self.written is None:
+			changed = ~0
+		else:
+			changed = (frame ^ self.written) | invalid
+		changed &= ~self.hold()
+		changed &= (1 << len(self.backend.pins)) - 1
+		if new:
+			self.pin_writes_avoided += len(self.backend.pins) - bin(changed).count('1')
+		if changed:
+			start = time.monotonic()
+			self.backend.write(frame, changed)
+			self.writes.append((swaps, start, time.monotonic()))
+			self.pin_writes += bin(changed).count('1')
+			if traced is not None and traced <= swaps and self.tracer is not None:
+				self.tracer.mark('write')
+		self.written = frame
+
+	def render_loop(self):
+		deadline = time.monotonic()
+		try:
+			while self.running:
+				self.render()
+				self.refreshes += 1
+				deadline += self.period
+				now = time.monotonic()
+				if now < deadline:
+					time.sleep(deadline - now)
+					now = time.monotonic()
+				lateness = now - deadline
+				if lateness > LATE_SHARE * self.period:
+					self.late += 1
+					missed = int(lateness / self.period)
+					if missed:
+						self.skipped += missed
+						deadline += missed * self.period
+		finally:
+			# Also when a write failed, nothing needs the short interval any more.
+			sys.setswitchinterval(self.switch_interval)
+
+	def stats(self):
+		return {
+			'refreshes': self.refreshes,
+			'swaps': self.swaps,
+			'dropped': self.dropped,
+			'late': self.late,
+			'skipped': self.skipped,
+			'pin_writes': self.pin_writes,
+			'pin_writes_avoided': self.pin_writes_avoided,
+		}
+
+	def report(self):
+		return "Render thread: {refreshes} refreshes, {swaps} frames, {dropped} dropped, {late} late, {skipped} refreshes skipped, {pin_writes} pin writes".format(**self.stats())
+
+	def close(self):
+		""" Stop the render thread after writing the last frame. The render 
+			thread restores the switch interval when it ends.
+		"""
+		if not self.running:
+			return
+		self.running = False
+		self.thread.join()
+		self.render()
+
+
+class VirtualClock(object):
+	""" Simulated monotonic clock starting at <start> seconds. It is advanced 
+		by sleep() and by the event loop of new_event_loop(): when none of 
+		its file descriptors is ready, the loop jumps straight to its next 
+		timer instead of waiting for it. asyncio.sleep, wait_for and the 
+		_async waits of DeadlineScheduler then take no real time. A 
+		recording replayed by timers of the loop (xbox.Joystick with 
+		virtual=True) arrives at its recorded times, so the replay does not 
+		depend on how fast the machine is.
+		
+		While installed(), DeadlineScheduler, LatencyTracer and the given 
+		modules (their attribute clock, e.g. xbox) read this clock. Real I/O 
+		is still waited for, but only while no timer is due: the loop blocks 
+		when it has neither.
+	"""
+	def __init__(self, start=0.0):
+		self.now = start
+
+	def time(self):
+		return self.now
+
+	def sleep(self, seconds):
+		self.now += max(0.0, seconds)
+
+	@contextlib.contextmanager
+	def installed(self, *modules):
+		global clock, sleep
+		saved = clock, sleep, [module.clock for module in modules]
+		clock, sleep = self.time, self.sleep
+		for module in modules:
+			module.clock = self.time
+		try:
+			yield self
+		finally:
+			clock, sleep = saved[0], saved[1]
+			for module, module_clock in zip(modules, saved[2]):
+				module.clock = module_clock
+
+	def new_event_loop(self):
+		return VirtualEventLoop(self)
+
+	def run(self, coro):
+		""" Run the coroutine <coro> in a new loop on this clock, like asyncio.run. """
+		loop = self.new_event_loop()
+		try:
+			return loop.run_until_complete(coro)
+		finally:
+			loop.close()
+
+
+class VirtualSelector(selectors.DefaultSelector):
+	""" Selector of a VirtualEventLoop: polls the file descriptors and, if none 
+		is ready, advances the clock by the timeout instead of waiting. 
+	"""
+	def __init__(self, clock):
+		selectors.DefaultSelector.__init__(self)
+		self.clock = clock
+
+	def select(self, timeout=None):
+		ready = selectors.DefaultSelector.select(self, 0)
+		if ready or timeout == 0:
+			return ready
+		if timeout is None:
+			# No timer at all, only real I/O can go on.
+			return selectors.DefaultSelector.select(self, None)
+		self.clock.sleep(timeout)
+		return ready
+
+
+class VirtualEventLoop(asyncio.SelectorEventLoop):
+	""" asyncio event loop running on the time of a VirtualClock. """
+	def __init__(self, clock):
+		asyncio.SelectorEventLoop.__init__(self, VirtualSelector(clock))
+		self.clock = clock
+
+	def time(self):
+		return self.clock.now
@@ -23,12 +23,221 @@ Example usage:
     joy.close()                   #Cleanup before exit
 
 All controller buttons are supported.  See code for all functions.
+
+With Joystick(threaded=True) a background thread drains xboxdrv continuously,
+so the accessors never touch the pipe, and button presses and releases are
+queued as timestamped events:
+
+    event = joy.getEvent(timeout=1.0)   #JoystickEvent(time, button, pressed) or None
+
+Under asyncio, joy.attach(loop) lets the event loop read xboxdrv instead, and
+joy.nextState() is a future completing with the next decoded state.
+
+Joystick(record='play.xbr') writes every line read from xboxdrv with its clock()
+timestamp to a file, Joystick(replay='play.xbr', speed=10) reads such a file back
+instead of a controller, see replay().  The replay is fed through the same pipe and
+parsing as xboxdrv output, at speed times the recorded pace or, with speed=0, as fast
+as it is read.  It ends like an unplugged controller.  With virtual=True the event loop
+feeds the replay at its recorded times instead, see ReplayFeed and timing.VirtualClock.
+From the shell:
+
+    python xbox.py replay play.xbr 10 | less
 """
 
+from array import array
+import collections
+import os
+import selectors
+import signal
 import subprocess
 import select
+import sys
+import threading
 import time
 
+try:
+    import multiprocessing
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+# Monotonic clock for event timestamps where available
+clock = getattr(time, 'monotonic', time.time)
+
+# Buttons and the position of their digit in a 140 char xboxdrv line
+BUTTONS = (
+    ('dpadUp', 45), ('dpadDown', 50), ('dpadLeft', 55), ('dpadRight', 60),
+    ('Back', 68), ('Guide', 76), ('Start', 84),
+    ('leftThumbstick', 90), ('rightThumbstick', 95),
+    ('A', 100), ('B', 104), ('X', 108), ('Y', 112),
+    ('leftBumper', 118), ('rightBumper', 123),
+)
+
+# Bit of every button in JoystickState.buttons, in the order of BUTTONS
+BUTTON_BITS = dict((button, 1 << i) for i, (button, pos) in enumerate(BUTTONS))
+
+# Method of Joystick returning the status of <button>, 1 (pressed) or 0 (not pressed)
+def buttonAccessor(button):
+    shift = BUTTON_BITS[button].bit_length() - 1
+    def accessor(self):
+        self.refresh()
+        return self.state.buttons >> shift & 1
+    accessor.__name__ = button
+    return accessor
+
+class JoystickState(object):
+    """Decoded xboxdrv line: all buttons as one bitmask (see BUTTON_BITS), the raw stick
+    axes (-32768 to 32767), the raw triggers (0 to 255) and the clock() time the line
+    was read.  A state is never changed after it has been published.
+    """
+    __slots__ = ('buttons', 'leftX', 'leftY', 'rightX', 'rightY',
+                 'leftTrigger', 'rightTrigger', 'time')
+
+    def __init__(self, buttons=0, leftX=0, leftY=0, rightX=0, rightY=0,
+                 leftTrigger=0, rightTrigger=0, time=0.0):
+        self.buttons = buttons
+        self.leftX = leftX
+        self.leftY = leftY
+        self.rightX = rightX
+        self.rightY = rightY
+        self.leftTrigger = leftTrigger
+        self.rightTrigger = rightTrigger
+        self.time = time
+
+    def pressed(self, button):
+        return 1 if self.buttons & BUTTON_BITS[button] else 0
+
+# Decode a 140 char xboxdrv line into a JoystickState, exactly once per line
+def parseReading(line, timestamp=0.0):
+    buttons = 0
+    bit = 1
+    for button, pos in BUTTONS:
+        if line[pos:pos+1] == b'1':
+            buttons |= bit
+        bit <<= 1
+    return JoystickState(buttons, int(line[3:9]), int(line[13:19]), int(line[24:30]),
+                         int(line[34:40]), int(line[129:132]), int(line[136:139]), timestamp)
+
+# Number of xboxdrv lines kept in the input history
+HISTORY_SIZE = 4096
+# Seconds Joystick() waits for xboxdrv to report the controller
+DETECT_TIMEOUT = 2.0
+# Longest time in seconds between a button change and xboxdrv seeing it: the USB
+# interval the controller is polled at
+INPUT_RESOLUTION = 0.008
+
+class InputHistory:
+
+    """Ring buffer with the time, buttons and axes of every line read from xboxdrv.
+    Storage is preallocated, appending a sample creates no objects.  Samples are
+    appended in time order, so queries find their start by binary search.
+
+    Usage:
+        joy.history.pressedSince(xbox.BUTTON_BITS['A'], t)   #was A down at any time since t
+        joy.history.transitions(t0, t1)                     #[(time, pressed, released), ...]
+    """
+    def __init__(self,size = HISTORY_SIZE):
+        self.size = size
+        self.times = array('d', [0.0]) * size
+        self.buttons = array('l', [0]) * size
+        self.axes = array('l', [0]) * (6 * size)
+        self.count = 0      #number of samples ever appended, the newest is at (count-1) % size
+        self.lock = threading.Lock()
+
+    def append(self, state):
+        with self.lock:
+            i = self.count % self.size
+            self.times[i] = state.time
+            self.buttons[i] = state.buttons
+            self.axes[6*i:6*i+6] = array('l', (state.leftX, state.leftY, state.rightX, state.rightY,
+                                               state.leftTrigger, state.rightTrigger))
+            self.count += 1
+
+    # Append the sample at words[i] of a SharedJoystick ring, fields as in SAMPLE_FIELDS,
+    # without creating a state for it
+    def appendWords(self, words, i):
+        with self.lock:
+            j = self.count % self.size
+            self.times[j] = words[i] / 1e9
+            self.buttons[j] = words[i + 1]
+            axes = self.axes
+            for k in range(6):
+                axes[6*j + k] = words[i + 2 + k]
+            self.count += 1
+
+    # Time of the newest sample, 0.0 if there is none
+    def latest(self):
+        with self.lock:
+            return self.times[(self.count - 1) % self.size] if self.count else 0.0
+
+    # Time of the newest sample earlier than t, None if there is none in the history.
+    # Lines read together share a time, this is when the read before them took place.
+    def before(self, t):
+        with self.lock:
+            lo, hi = max(0, self.count - self.size), self.count
+            oldest = lo
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if self.times[mid % self.size] < t:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            return self.times[(lo - 1) % self.size] if lo > oldest else None
+
+    # Number of the first sample (counting all samples ever appended) later than t
+    def after(self, t):
+        lo, hi = max(0, self.count - self.size), self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.times[mid % self.size] <= t:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    # Buttons bitmask in effect at time t, i.e. of the last sample not later than t
+    def buttonsAt(self, t):
+        with self.lock:
+            n = self.after(t)
+            return self.buttons[(n - 1) % self.size] if n > max(0, self.count - self.size) else 0
+
+    # True if any button of the bitmask was down at any time since t
+    def pressedSince(self, mask, t):
+        with self.lock:
+            n = max(self.after(t) - 1, self.count - self.size, 0)
+            for i in range(n, self.count):
+                if self.buttons[i % self.size] & mask:
+                    return True
+            return False
+
+    # All button changes later than t0 and not later than t1 (None for now), as a list of
+    # (time, pressed bitmask, released bitmask)
+    def transitions(self, t0, t1=None):
+        with self.lock:
+            oldest = max(0, self.count - self.size)
+            start = self.after(t0)
+            end = self.count if t1 is None else self.after(t1)
+            previous = self.buttons[(start - 1) % self.size] if start > oldest else 0
+            result = []
+            for i in range(start, end):
+                current = self.buttons[i % self.size]
+                changed = current ^ previous
+                if changed:
+                    result.append((self.times[i % self.size], changed & current, changed & previous))
+                previous = current
+            return result
+
+# Number of events kept if nobody consumes them, the oldest are dropped first
+EVENT_QUEUE_SIZE = 256
+
+# A button press (pressed=True) or release, time is taken from clock()
+JoystickEvent = collections.namedtuple('JoystickEvent', 'time button pressed')
+
 class Joystick:
 
     """Initializes the joystick/wireless receiver, launching 'xboxdrv' as a subprocess
@@ -37,26 +246,53 @@ class Joystick:
     Calling any of the Joystick methods will cause a refresh to occur, if refreshTime has elapsed.
     Routinely call a Joystick method, at least once per second, to avoid overfilling the event buffer.
  
+    If threaded is True, a reader thread publishes every line as soon as it arrives
+    and queues button events, see getEvent().
+
+    With several controllers, controllerId selects one of them (xboxdrv --id, or
+    --wid for controllers on a wireless receiver), see JoystickGroup.
+
+    record is the name of a file to record the input to, replay one to read instead
+    of the controller at speed times the recorded pace (0: as fast as possible).
+    With virtual=True the replay is fed at its recorded times by the event loop the
+    Joystick is attached to, see ReplayFeed.
+ 
     Usage:
         joy = xbox.Joystick()
     """
-    def __init__(self,refreshRate = 30):
-        self.proc = subprocess.Popen(['xboxdrv','--no-uinput','--detach-kernel-driver'], stdout=subprocess.PIPE, bufsize=0)
-        self.pipe = self.proc.stdout
-        #
-        self.connectStatus = False  #will be set to True once controller is detected and stays on
-        self.reading = '0' * 140    #initialize stick readings to all zeros
-        #
-        self.refreshTime = 0    #absolute time when next refresh (read results from xboxdrv stdout pipe) is to occur
-        self.refreshDelay = 1.0 / refreshRate   #joystick refresh is to be performed 30 times per sec by default
+    def __init__(self,refreshRate = 30,threaded = False,historySize = HISTORY_SIZE,controllerId = None,wireless = False,
+                 record = None,replay = None,speed = 1.0,virtual = False):
+        if replay is not None:
+            args = [sys.executable, os.path.abspath(__file__), 'replay', replay, str(speed)]
+        else:
+            args = ['xboxdrv','--no-uinput','--detach-kernel-driver']
+            if controllerId is not None:
+                args += ['--wid' if wireless else '--id', str(controllerId)]
+        self.recording = open(record, 'w') if record is not None else None
+        if replay is not None and virtual:
+            self.feed = ReplayFeed(replay)
+            self.proc = None
+            self.pipe = self.feed.pipe
+        else:
+            self.feed = None
+            self.proc = subprocess.Popen(args, stdout=subprocess.PIPE, bufsize=0)
+            self.pipe = self.proc.stdout
+        self.initReading(historySize, threaded, refreshRate)
         #
-        # Read responses from 'xboxdrv' for upto 2 seconds, looking for controller/receiver to respond
+        # Read responses from 'xboxdrv' for upto 2 seconds, looking for controller/receiver to respond.
+        # select blocks until a line arrives or the time is up, so waiting costs no CPU.
         found = False
-        waitTime = time.time() + 2
-        while waitTime > time.time() and not found:
-            readable, writeable, exception = select.select([self.pipe],[],[],0)
+        waitTime = clock() + DETECT_TIMEOUT
+        while not found:
+            remaining = waitTime - clock()
+            if remaining <= 0:
+                break
+            readable, writeable, exception = select.select([self.pipe],[],[],remaining)
             if readable:
                 response = self.pipe.readline()
+                # xboxdrv exited, nothing more will come
+                if len(response) == 0:
+                    break
                 # Hard fail if we see this, so force an error
                 if response[0:7] == b'No Xbox':
                     raise IOError('No Xbox controller/receiver found')
@@ -67,36 +303,194 @@ class Joystick:
                 if len(response) == 140:
                     found = True
                     self.connectStatus = True
-                    self.reading = response
+                    self.state = parseReading(response, clock())
+                    self.history.append(self.state)
+                    self.record(response, self.state.time)
         # if the controller wasn't found, then halt
         if not found:
             self.close()
             raise IOError('Unable to detect Xbox controller/receiver - Run python as sudo')
+        #
+        if threaded:
+            self.reader = threading.Thread(target=self.readLoop, name='xboxdrv-reader')
+            self.reader.daemon = True
+            self.reader.start()
+
+    # State of reading self.pipe, shared with SharedJoystick
+    def initReading(self, historySize, threaded, refreshRate):
+        self.connectStatus = False  #will be set to True once controller is detected and stays on
+        self.state = JoystickState()    #initialize stick readings to all zeros
+        self.history = InputHistory(historySize)    #every line read, see InputHistory
+        self.events = queue.Queue(EVENT_QUEUE_SIZE)
+        #
+        self.threaded = threaded
+        self.loop = None            #asyncio event loop reading the pipe, see attach()
+        self.lineBuffer = b''
+        self.stateWaiter = None
+        self.closed = False
+        self.readerError = None     #exception raised while reading in the background, re-raised by refresh()
+        self.tracer = None          #optional latency tracer, see begin() and mark() in publish()
+        self.group = None           #JoystickGroup reading the pipe, see JoystickGroup.add()
+        #
+        self.refreshTime = 0    #absolute time when next refresh (read results from xboxdrv stdout pipe) is to occur
+        self.refreshDelay = 1.0 / refreshRate   #joystick refresh is to be performed 30 times per sec by default
+
+    """Body of the reader thread in threaded mode: read every line from xboxdrv as it
+    arrives and publish it.  Accessors only ever look at the published reading.
+    """
+    def readLoop(self):
+        try:
+            while not self.closed:
+                response = self.pipe.readline()
+                if len(response) == 0:
+                    raise IOError('Xbox controller disconnected from USB')
+                if len(response) == 140:
+                    self.publish(response, clock())
+                    self.connectStatus = True
+                else:
+                    self.connectStatus = False
+        except (IOError, OSError, ValueError) as e:
+            if not self.closed:
+                self.readerError = e
+
+    """Let an asyncio event loop read xboxdrv: the pipe is watched with loop.add_reader,
+    every line is published as soon as it arrives and nextState() wakes up waiting
+    coroutines.  Accessors do no I/O while attached.  Not possible in threaded mode.
+    """
+    def attach(self, loop):
+        if self.threaded:
+            raise ValueError('A threaded Joystick cannot be attached to an event loop')
+        self.loop = loop
+        self.stateWaiter = None     #a waiter of a previous loop can never complete
+        loop.add_reader(self.pipe.fileno(), self.readAvailable)
+        if self.feed is not None:
+            self.feed.start(loop)
+
+    # Stop reading from the event loop, accessors refresh themselves again
+    def detach(self):
+        if self.loop is not None:
+            self.loop.remove_reader(self.pipe.fileno())
+            self.loop = None
+
+    # Event loop callback: the pipe is readable, publish every complete line
+    def readAvailable(self):
+        data = os.read(self.pipe.fileno(), 65536)
+        if len(data) == 0:
+            # A zero length response means controller has been unplugged.
+            self.detach()
+            self.readerError = IOError('Xbox controller disconnected from USB')
+            self.wakeWaiter(None)
+            return
+        lines = (self.lineBuffer + data).split(b'\n')
+        self.lineBuffer = lines.pop()
+        timestamp = clock()
+        for line in lines:
+            if len(line) == 139:
+                self.publish(line + b'\n', timestamp)
+        # Any other last response means we have lost wireless or controller battery
+        if lines:
+            self.connectStatus = len(lines[-1]) == 139
+        self.wakeWaiter(self.state)
+
+    # Future completing with the next published state (attached mode only).  All callers
+    # between two states share one future, wrap it in asyncio.shield before cancelling.
+    def nextState(self):
+        if self.readerError:
+            raise self.readerError
+        if self.stateWaiter is None or self.stateWaiter.done():
+            self.stateWaiter = self.loop.create_future()
+        return self.stateWaiter
+
+    def wakeWaiter(self, state):
+        waiter, self.stateWaiter = self.stateWaiter, None
+        if waiter is not None and not waiter.done():
+            if self.readerError:
+                waiter.set_exception(self.readerError)
+            else:
+                waiter.set_result(state)
+
+    # Decode a line and publish it
+    def publish(self, response, timestamp):
+        self.record(response, timestamp)
+        self.publishState(parseReading(response, timestamp))
+
+    # Record a state in the history, queue an event for every button that changed, then
+    # swap in the new state.  States are never modified, so readers always see a whole line.
+    def publishState(self, state):
+        self.history.append(state)
+        changed = state.buttons ^ self.state.buttons
+        if changed:
+            self.publishChange(state.time, state.buttons, changed)
+        self.state = state
+
+    # Trace and queue the button changes of the bitmask changed, buttons read at time t
+    def publishChange(self, t, buttons, changed):
+        if changed & buttons and self.tracer is not None:
+            self.tracer.begin(t)
+            self.tracer.mark('decode')
+        for button, pos in BUTTONS:
+            bit = BUTTON_BITS[button]
+            if changed & bit:
+                self.putEvent(JoystickEvent(t, button, bool(buttons & bit)))
+
+    # Append a line to the recording, if any: the timestamp in seconds, a space, the line
+    def record(self, response, timestamp):
+        if self.recording is not None:
+            self.recording.write('%.6f %s' % (timestamp, response.decode('ascii')))
+
+    def putEvent(self, event):
+        while True:
+            try:
+                return self.events.put_nowait(event)
+            except queue.Full:
+                self.getEvent()
+
+    # Next button event, waiting up to timeout seconds (None waits forever).
+    # Returns None if no event arrived in time.
+    def getEvent(self,timeout=0):
+        try:
+            return self.events.get(timeout is None or timeout > 0, timeout)
+        except queue.Empty:
+            return None
+
+    # List of all button events queued so far
+    def pendingEvents(self):
+        events = []
+        while True:
+            event = self.getEvent()
+            if event is None:
+                return events
+            events.append(event)
 
     """Used by all Joystick methods to read the most recent events from xboxdrv.
     The refreshRate determines the maximum frequency with which events are checked.
     If a valid event response is found, then the controller is flagged as 'connected'.
     """
     def refresh(self):
+        # In threaded mode the reader thread keeps the reading up to date, when
+        # attached the event loop does, in a group JoystickGroup.refresh()
+        if self.threaded or self.loop is not None or self.group is not None:
+            if self.readerError:
+                raise self.readerError
+            return
         # Refresh the joystick readings based on regular defined freq
         if self.refreshTime < time.time():
             self.refreshTime = time.time() + self.refreshDelay  #set next refresh time
             # If there is text available to read from xboxdrv, then read it.
             readable, writeable, exception = select.select([self.pipe],[],[],0)
             if readable:
-                # Read every line that is availabe.  We only need to decode the last one.
+                # Read every line that is availabe, each one goes into the history.
                 while readable:
                     response = self.pipe.readline()
                     # A zero length response means controller has been unplugged.
                     if len(response) == 0:
                         raise IOError('Xbox controller disconnected from USB')
+                    # Valid controller response will be 140 chars.  
+                    if len(response) == 140:
+                        self.publish(response, clock())
                     readable, writeable, exception = select.select([self.pipe],[],[],0)
-                # Valid controller response will be 140 chars.  
-                if len(response) == 140:
-                    self.connectStatus = True
-                    self.reading = response
-                else:  #Any other response means we have lost wireless or controller battery
-                    self.connectStatus = False
+                # Any other last response means we have lost wireless or controller battery
+                self.connectStatus = len(response) == 140
 
     """Return a status of True, when the controller is actively connected.
     Either loss of wireless signal or controller powering off will break connection.  The
@@ -112,29 +506,43 @@ class Joystick:
         self.refresh()
         return self.connectStatus
 
+    # True if any of the buttons (names) was down at any time since t (a clock() time)
+    def pressedSince(self, t, *buttons):
+        self.refresh()
+        mask = 0
+        for button in buttons:
+            mask |= BUTTON_BITS[button]
+        return self.history.pressedSince(mask, t)
+
+    # All button changes between t0 and t1 (None for now), see InputHistory.transitions
+    def transitions(self, t0, t1=None):
+        self.refresh()
+        return self.history.transitions(t0, t1)
+
+    # Complete decoded state of the controller in one call, see JoystickState
+    def snapshot(self):
+        self.refresh()
+        return self.state
+
     # Left stick X axis value scaled between -1.0 (left) and 1.0 (right) with deadzone tolerance correction
     def leftX(self,deadzone=4000):
         self.refresh()
-        raw = int(self.reading[3:9])
-        return self.axisScale(raw,deadzone)
+        return self.axisScale(self.state.leftX,deadzone)
 
     # Left stick Y axis value scaled between -1.0 (down) and 1.0 (up)
     def leftY(self,deadzone=4000):
         self.refresh()
-        raw = int(self.reading[13:19])
-        return self.axisScale(raw,deadzone)
+        return self.axisScale(self.state.leftY,deadzone)
 
     # Right stick X axis value scaled between -1.0 (left) and 1.0 (right)
     def rightX(self,deadzone=4000):
         self.refresh()
-        raw = int(self.reading[24:30])
-        return self.axisScale(raw,deadzone)
+        return self.axisScale(self.state.rightX,deadzone)
 
     # Right stick Y axis value scaled between -1.0 (down) and 1.0 (up)
     def rightY(self,deadzone=4000):
         self.refresh()
-        raw = int(self.reading[34:40])
-        return self.axisScale(raw,deadzone)
+        return self.axisScale(self.state.rightY,deadzone)
 
     # Scale raw (-32768 to +32767) axis with deadzone correcion
     # Deadzone is +/- range of values to consider to be center stick (ie. 0.0)
@@ -148,104 +556,526 @@ class Joystick:
                 return (raw - deadzone) / (32767.0 - deadzone)
 
     # Dpad Up status - returns 1 (pressed) or 0 (not pressed)
-    def dpadUp(self):
-        self.refresh()
-        return int(self.reading[45:46])
-        
+    dpadUp = buttonAccessor('dpadUp')
+
     # Dpad Down status - returns 1 (pressed) or 0 (not pressed)
-    def dpadDown(self):
-        self.refresh()
-        return int(self.reading[50:51])
-        
+    dpadDown = buttonAccessor('dpadDown')
+
     # Dpad Left status - returns 1 (pressed) or 0 (not pressed)
-    def dpadLeft(self):
-        self.refresh()
-        return int(self.reading[55:56])
-        
+    dpadLeft = buttonAccessor('dpadLeft')
+
     # Dpad Right status - returns 1 (pressed) or 0 (not pressed)
-    def dpadRight(self):
-        self.refresh()
-        return int(self.reading[60:61])
-        
+    dpadRight = buttonAccessor('dpadRight')
+
     # Back button status - returns 1 (pressed) or 0 (not pressed)
-    def Back(self):
-        self.refresh()
-        return int(self.reading[68:69])
+    Back = buttonAccessor('Back')
 
     # Guide button status - returns 1 (pressed) or 0 (not pressed)
-    def Guide(self):
-        self.refresh()
-        return int(self.reading[76:77])
+    Guide = buttonAccessor('Guide')
 
     # Start button status - returns 1 (pressed) or 0 (not pressed)
-    def Start(self):
-        self.refresh()
-        return int(self.reading[84:85])
+    Start = buttonAccessor('Start')
 
     # Left Thumbstick button status - returns 1 (pressed) or 0 (not pressed)
-    def leftThumbstick(self):
-        self.refresh()
-        return int(self.reading[90:91])
+    leftThumbstick = buttonAccessor('leftThumbstick')
 
     # Right Thumbstick button status - returns 1 (pressed) or 0 (not pressed)
-    def rightThumbstick(self):
-        self.refresh()
-        return int(self.reading[95:96])
+    rightThumbstick = buttonAccessor('rightThumbstick')
 
     # A button status - returns 1 (pressed) or 0 (not pressed)
-    def A(self):
-        self.refresh()
-        return int(self.reading[100:101])
-        
+    A = buttonAccessor('A')
+
     # B button status - returns 1 (pressed) or 0 (not pressed)
-    def B(self):
-        self.refresh()
-        return int(self.reading[104:105])
+    B = buttonAccessor('B')
 
     # X button status - returns 1 (pressed) or 0 (not pressed)
-    def X(self):
-        self.refresh()
-        return int(self.reading[108:109])
+    X = buttonAccessor('X')
 
     # Y button status - returns 1 (pressed) or 0 (not pressed)
-    def Y(self):
-        self.refresh()
-        return int(self.reading[112:113])
+    Y = buttonAccessor('Y')
 
     # Left Bumper button status - returns 1 (pressed) or 0 (not pressed)
-    def leftBumper(self):
-        self.refresh()
-        return int(self.reading[118:119])
+    leftBumper = buttonAccessor('leftBumper')
 
     # Right Bumper button status - returns 1 (pressed) or 0 (not pressed)
-    def rightBumper(self):
-        self.refresh()
-        return int(self.reading[123:124])
+    rightBumper = buttonAccessor('rightBumper')
 
     # Left Trigger value scaled between 0.0 to 1.0
     def leftTrigger(self):
         self.refresh()
-        return int(self.reading[129:132]) / 255.0
+        return self.state.leftTrigger / 255.0
         
     # Right trigger value scaled between 0.0 to 1.0
     def rightTrigger(self):
         self.refresh()
-        return int(self.reading[136:139]) / 255.0
+        return self.state.rightTrigger / 255.0
 
     # Returns tuple containing X and Y axis values for Left stick scaled between -1.0 to 1.0
     # Usage:
     #     x,y = joy.leftStick()
     def leftStick(self,deadzone=4000):
         self.refresh()
-        return (self.leftX(deadzone),self.leftY(deadzone))
+        state = self.state
+        return (self.axisScale(state.leftX,deadzone),self.axisScale(state.leftY,deadzone))
 
     # Returns tuple containing X and Y axis values for Right stick scaled between -1.0 to 1.0
     # Usage:
     #     x,y = joy.rightStick() 
     def rightStick(self,deadzone=4000):
         self.refresh()
-        return (self.rightX(deadzone),self.rightY(deadzone))
+        state = self.state
+        return (self.axisScale(state.rightX,deadzone),self.axisScale(state.rightY,deadzone))
 
     # Cleanup by ending the xboxdrv subprocess
     def close(self):
-        self.proc.kill()
+        self.closed = True
+        self.detach()
+        if self.proc is not None:
+            self.proc.kill()
+        if self.feed is not None:
+            self.feed.close()
+            self.pipe.close()
+        if self.recording is not None:
+            self.recording.close()
+
+
+"""Several controllers, one xboxdrv process each, read through a single selector.  One
+refresh() waits on all pipes with one epoll call and reads only the pipes that have
+data, so a loop iteration costs the same however many players there are.  The
+Joysticks of the group never read themselves, their accessors and snapshot() just
+return what the last refresh() published.
+
+Usage:
+    group = xbox.JoystickGroup(2)
+    while True:
+        group.refresh(timeout=0.1)          #wait up to 0.1 s for input of any player
+        for player, state in enumerate(group.snapshots()):
+            if state.pressed('A'):
+                print('Player', player, 'pressed A')
+    group.close()
+
+Under asyncio, group.attach(loop) reads the pipes in the event loop instead and
+group.nextChange() is a future completing with the number of the next player whose
+controller changed.
+"""
+class JoystickGroup:
+
+    def __init__(self,count = 2,wireless = False,joysticks = None,**joystickOptions):
+        self.selector = selectors.DefaultSelector()
+        self.joysticks = []
+        self.loop = None
+        self.changeWaiter = None
+        if joysticks is None:
+            joysticks = []
+            try:
+                for player in range(count):
+                    joysticks.append(Joystick(controllerId=player,wireless=wireless,**joystickOptions))
+            except Exception:
+                for joy in joysticks:
+                    joy.close()
+                raise
+        for joy in joysticks:
+            self.add(joy)
+
+    # Add a Joystick as the next player, from now on the group reads its pipe
+    def add(self, joy):
+        if joy.threaded or joy.loop is not None:
+            raise ValueError('Only a Joystick that reads on demand can join a group')
+        player = len(self.joysticks)
+        joy.group = self
+        self.joysticks.append(joy)
+        self.selector.register(joy.pipe.fileno(), selectors.EVENT_READ, player)
+        if self.loop is not None:
+            self.attachPlayer(player)
+        return player
+
+    def __len__(self):
+        return len(self.joysticks)
+
+    # Joystick of a player, its accessors do no I/O
+    def __getitem__(self, player):
+        return self.joysticks[player]
+
+    # Read every pipe that has data, waiting up to timeout seconds (None waits forever)
+    # for the first one.  Returns the players whose controller sent lines.
+    def refresh(self,timeout = 0):
+        if self.loop is not None:
+            return []
+        players = []
+        for key, mask in self.selector.select(timeout):
+            self.readPlayer(key.data)
+            players.append(key.data)
+        for player in players:
+            joy = self.joysticks[player]
+            if joy.readerError:
+                # Disconnected, stop watching the pipe
+                self.selector.unregister(joy.pipe.fileno())
+                raise joy.readerError
+        return players
+
+    # Publish the lines available from the pipe of a player
+    def readPlayer(self, player):
+        joy = self.joysticks[player]
+        joy.readAvailable()
+        waiter, self.changeWaiter = self.changeWaiter, None
+        if waiter is not None and not waiter.done():
+            waiter.set_result(player)
+
+    # Decoded states of all players, in player order
+    def snapshots(self):
+        return [joy.state for joy in self.joysticks]
+
+    # Snapshot of one player
+    def snapshot(self, player):
+        return self.joysticks[player].state
+
+    # Button events of all players queued so far, as (player, JoystickEvent) in time order
+    def pendingEvents(self):
+        events = []
+        for player, joy in enumerate(self.joysticks):
+            events.extend((player, event) for event in joy.pendingEvents())
+        events.sort(key=lambda item: item[1].time)
+        return events
+
+    """Let an asyncio event loop read the pipes: they are added to the loop's own
+    selector, each readable pipe publishes its lines and wakes nextChange().
+    """
+    def attach(self, loop):
+        self.loop = loop
+        self.changeWaiter = None
+        for player in range(len(self.joysticks)):
+            self.attachPlayer(player)
+
+    def attachPlayer(self, player):
+        joy = self.joysticks[player]
+        joy.loop = self.loop
+        joy.stateWaiter = None
+        self.loop.add_reader(joy.pipe.fileno(), self.readPlayer, player)
+        if joy.feed is not None:
+            joy.feed.start(self.loop)
+
+    def detach(self):
+        if self.loop is not None:
+            for joy in self.joysticks:
+                joy.detach()
+            self.loop = None
+
+    # Future completing with the player whose controller sent the next lines (attached
+    # mode only).  Shared by all callers, wrap it in asyncio.shield before cancelling.
+    def nextChange(self):
+        if self.changeWaiter is None or self.changeWaiter.done():
+            self.changeWaiter = self.loop.create_future()
+        return self.changeWaiter
+
+    # End all xboxdrv processes
+    def close(self):
+        self.detach()
+        for joy in self.joysticks:
+            joy.close()
+        self.selector.close()
+
+
+# Samples kept in the ring of a SharedJoystick
+SHARED_RING_SIZE = 1024
+# Layout of the shared memory block of a SharedJoystick, in 64 bit words: the number of
+# samples ever written, the connection status, 1 once the reader process ended, then the
+# ring of samples: time (ns of clock()), buttons and the six axes of SAMPLE_FIELDS
+SHARED_COUNT, SHARED_CONNECTED, SHARED_ENDED, SHARED_RING = range(4)
+SAMPLE_FIELDS = ('time', 'buttons', 'leftX', 'leftY', 'rightX', 'rightY', 'leftTrigger', 'rightTrigger')
+SAMPLE_WORDS = len(SAMPLE_FIELDS)
+# Seconds refresh() waits for the lock of the shared block before it takes the reader
+# process for dead
+SHARED_LOCK_TIMEOUT = 1.0
+
+
+"""Joystick whose xboxdrv output is read and decoded by a helper process, so parsing does
+not compete with the game loop for the interpreter lock, nor on a single core Pi for
+longer than the helper needs.  The helper writes every decoded line into a ring in a
+multiprocessing.shared_memory block, under a multiprocessing.Lock shared with this
+process.  The lock is a semaphore, taking and releasing it are memory barriers, so a
+sample is never read half written, also on the weakly ordered multi-core ARM CPUs of a
+Pi 2, 3 or 4.  refresh() only takes the lock when the count of samples changed, then
+copies the new samples from the ring into the history in one block copy, no objects
+per sample, and queues their button changes like the lines of a Joystick.  The state is
+a JoystickState copied from the newest sample.  Lines the helper wrote while more than
+SHARED_RING_SIZE lines were unread are lost, self.lost counts them.
+
+Takes the options of Joystick except threaded, e.g. SharedJoystick(record='play.xbr').
+attach(loop) works as for Joystick, the helper writes a byte to a wakeup pipe for it.
+Needs the fork start method of multiprocessing, i.e. Linux, so create it before the
+program starts other threads.
+"""
+class SharedJoystick(Joystick):
+
+    def __init__(self,historySize = HISTORY_SIZE,ringSize = SHARED_RING_SIZE,**joystickOptions):
+        if shared_memory is None:
+            raise ImportError('SharedJoystick needs multiprocessing.shared_memory (Python 3.8)')
+        if joystickOptions.get('virtual'):
+            raise ValueError('The helper process of a SharedJoystick has no event loop to feed a virtual replay')
+        self.ringSize = ringSize
+        self.shm = shared_memory.SharedMemory(create=True, size=8 * (SHARED_RING + SAMPLE_WORDS * ringSize))
+        self.words = self.shm.buf.cast('q')
+        wakeRead, wakeWrite = os.pipe()
+        # The helper inherits the mapping, the lock and the pipe, so it has to be forked
+        context = multiprocessing.get_context('fork')
+        self.lock = context.Lock()
+        resultRead, resultWrite = context.Pipe(duplex=False)
+        self.reader = context.Process(target=sharedReader, name='xboxdrv-reader',
+                                      args=(self.words, self.lock, ringSize, resultWrite, wakeWrite, joystickOptions))
+        self.reader.daemon = True
+        self.reader.start()
+        os.close(wakeWrite)
+        resultWrite.close()
+        #
+        self.proc = None
+        self.feed = None
+        self.recording = None
+        self.pipe = os.fdopen(wakeRead, 'rb', buffering=0)
+        self.initReading(historySize, False, 30)
+        self.seen = 0           #number of samples taken from the ring so far
+        self.lost = 0           #number of samples overwritten before they were taken
+        # Buffer refresh() copies the new samples to
+        self.samples = memoryview(array('q', bytes(8 * SAMPLE_WORDS * ringSize)))
+        #
+        # The helper reports whether it found the controller
+        if not resultRead.poll(DETECT_TIMEOUT + 5):
+            error = 'Unable to start the xboxdrv reader process'
+        else:
+            error = resultRead.recv()
+        resultRead.close()
+        try:
+            if error is not None:
+                raise IOError(error)
+            self.refresh()
+        except IOError:
+            self.close()
+            raise
+
+    """Take the samples the helper published since the last call from the shared block.
+    Without new samples it only reads one word, so it is cheap enough to run on every
+    accessor call.
+    """
+    def refresh(self):
+        if self.readerError:
+            raise self.readerError
+        words = self.words
+        # Read without the lock, a count seen late only delays the samples to the next call
+        if words[SHARED_COUNT] == self.seen and not words[SHARED_ENDED]:
+            return
+        if not self.lock.acquire(timeout=SHARED_LOCK_TIMEOUT):
+            self.readerError = IOError('The xboxdrv reader process stopped while writing')
+            raise self.readerError
+        try:
+            count = words[SHARED_COUNT]
+            if count == self.seen:
+                # Ended, the count read under the lock is the last one
+                self.readerError = IOError('Xbox controller disconnected from USB')
+                raise self.readerError
+            first = max(self.seen, count - self.ringSize)
+            # Copy the samples first to count - 1 in at most two slices, the ring may wrap
+            start, end = first % self.ringSize, (count - 1) % self.ringSize + 1
+            if start < end:
+                size = (end - start) * SAMPLE_WORDS
+                self.samples[:size] = words[SHARED_RING + start * SAMPLE_WORDS:SHARED_RING + end * SAMPLE_WORDS]
+            else:
+                size = (self.ringSize - start) * SAMPLE_WORDS
+                self.samples[:size] = words[SHARED_RING + start * SAMPLE_WORDS:SHARED_RING + self.ringSize * SAMPLE_WORDS]
+                self.samples[size:size + end * SAMPLE_WORDS] = words[SHARED_RING:SHARED_RING + end * SAMPLE_WORDS]
+                size += end * SAMPLE_WORDS
+            connected = words[SHARED_CONNECTED]
+        finally:
+            self.lock.release()
+        samples, history = self.samples, self.history
+        buttons = self.state.buttons
+        for i in range(0, size, SAMPLE_WORDS):
+            history.appendWords(samples, i)
+            changed = samples[i + 1] ^ buttons
+            if changed:
+                buttons = samples[i + 1]
+                self.publishChange(samples[i] / 1e9, buttons, changed)
+        self.lost += first - self.seen
+        self.seen = count
+        i = size - SAMPLE_WORDS
+        self.state = JoystickState(samples[i + 1], samples[i + 2], samples[i + 3], samples[i + 4], samples[i + 5],
+                                   samples[i + 6], samples[i + 7], samples[i] / 1e9)
+        self.connectStatus = bool(connected)
+
+    # Event loop callback: the helper published lines
+    def readAvailable(self):
+        if len(os.read(self.pipe.fileno(), 65536)) == 0:
+            self.detach()
+            self.readerError = IOError('Xbox controller disconnected from USB')
+            self.wakeWaiter(None)
+            return
+        try:
+            self.refresh()
+        except IOError:
+            pass
+        self.wakeWaiter(self.state)
+
+    # End the helper process, which ends xboxdrv
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.detach()
+        if self.reader.is_alive():
+            self.reader.terminate()
+        self.reader.join()
+        self.pipe.close()
+        self.samples.release()
+        self.words.release()
+        self.shm.close()
+        self.shm.unlink()
+
+
+# Body of the helper process of a SharedJoystick: read xboxdrv with a Joystick and write
+# every decoded line into the ring of the shared block words, holding lock
+def sharedReader(words, lock, ringSize, result, wakeFd, joystickOptions):
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        joy = Joystick(**joystickOptions)
+    except Exception as e:
+        result.send(str(e))
+        return
+    result.send(None)
+    result.close()
+    os.set_blocking(wakeFd, False)
+    count = 0
+    try:
+        while True:
+            response = joy.pipe.readline()
+            if len(response) == 0:
+                break
+            if len(response) == 140:
+                timestamp = clock()
+                joy.record(response, timestamp)
+                state = parseReading(response, timestamp)
+                sample = array('q', (int(timestamp * 1e9), state.buttons, state.leftX, state.leftY,
+                                     state.rightX, state.rightY, state.leftTrigger, state.rightTrigger))
+                i = SHARED_RING + count % ringSize * SAMPLE_WORDS
+                count += 1
+                with lock:
+                    words[i:i + SAMPLE_WORDS] = sample
+                    words[SHARED_COUNT] = count
+                    words[SHARED_CONNECTED] = 1
+            else:
+                with lock:
+                    words[SHARED_CONNECTED] = 0
+            try:
+                os.write(wakeFd, b'\0')
+            except BlockingIOError:
+                pass    #the pipe is full, the main process has a wakeup pending anyway
+    finally:
+        with lock:
+            words[SHARED_ENDED] = 1
+        joy.close()
+        os.close(wakeFd)
+
+
+"""Replay of a recording by the event loop instead of a process, for Joystick(replay=...,
+virtual=True): the recorded lines are written into the pipe the Joystick reads by timers
+of the loop it is attached to, each at its recorded time shifted to the time of the
+first attach.  On the loop of a timing.VirtualClock every line is read at exactly its
+recorded time and the pauses between lines take no real time, so a replay gives the
+same result on any machine.  Lines only flow while a loop runs.
+"""
+class ReplayFeed:
+
+    def __init__(self,path):
+        self.recording = open(path, 'rb')
+        readFd, self.writeFd = os.pipe()
+        self.pipe = os.fdopen(readFd, 'rb', buffering=0)
+        os.set_blocking(self.writeFd, False)
+        os.write(self.writeFd, b'Press Ctrl-c to quit\n')
+        self.loop = None
+        self.handle = None
+        self.offset = None      #loop time minus recorded time
+        self.entry = self.nextEntry()  #(recorded time, line) of the next line, None at the end
+
+    def nextEntry(self):
+        entry = self.recording.readline()
+        if not entry:
+            return None
+        timestamp, line = entry.split(b' ', 1)
+        return float(timestamp), line
+
+    # Feed the lines from loop, continuing where the previous loop stopped
+    def start(self, loop):
+        self.stop()
+        self.loop = loop
+        if self.entry is not None and self.offset is None:
+            self.offset = loop.time() - self.entry[0]
+        self.schedule()
+
+    def schedule(self):
+        if self.entry is None:
+            self.end()
+        else:
+            self.handle = self.loop.call_at(self.entry[0] + self.offset, self.feed)
+
+    # Timer callback: write the next line
+    def feed(self):
+        try:
+            os.write(self.writeFd, self.entry[1])
+        except BlockingIOError:
+            # Nobody reads the pipe at the moment, try again one poll interval later
+            self.handle = self.loop.call_later(INPUT_RESOLUTION, self.feed)
+            return
+        self.entry = self.nextEntry()
+        self.schedule()
+
+    # End of the recording: close the pipe, the Joystick reads it like an unplugged controller
+    def end(self):
+        if self.writeFd is not None:
+            os.close(self.writeFd)
+            self.writeFd = None
+
+    def stop(self):
+        if self.handle is not None:
+            self.handle.cancel()
+            self.handle = None
+
+    def close(self):
+        self.stop()
+        self.end()
+        self.recording.close()
+
+
+"""Stand-in for xboxdrv playing a recording of Joystick(record=...): prints the greeting
+of xboxdrv, then the recorded lines to out, at speed times the recorded pace (0: as
+fast as out takes them).  Joystick(replay=...) runs it as its xboxdrv process.
+"""
+def replay(path, speed=1.0, out=None):
+    if out is None:
+        out = sys.stdout.buffer
+    with open(path, 'rb') as recording:
+        out.write(b'Press Ctrl-c to quit\n')
+        out.flush()
+        start = clock()
+        first = None
+        for entry in recording:
+            timestamp, line = entry.split(b' ', 1)
+            if speed > 0:
+                if first is None:
+                    first = float(timestamp)
+                delay = start + (float(timestamp) - first) / speed - clock()
+                if delay > 0:
+                    time.sleep(delay)
+                out.write(line)
+                out.flush()
+            else:
+                out.write(line)
+    out.flush()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) in (3, 4) and sys.argv[1] == 'replay':
+        try:
+            replay(sys.argv[2], float(sys.argv[3]) if len(sys.argv) == 4 else 1.0)
+        except (BrokenPipeError, KeyboardInterrupt):
+            pass
+        except OSError as e:
+            sys.exit(str(e))
+    else:
+        sys.exit('Usage: python xbox.py replay FILE [SPEED]')